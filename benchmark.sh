@@ -0,0 +1,31 @@
+#!/bin/bash
+# Runs the micro-benchmarks in tests/test_benchmarks.py against the latest
+# baseline stored in tests/benchmarks for this platform and Python version,
+# and fails if the median time of any is more than BENCHMARK_THRESHOLD
+# (default 20%) slower. Run it from a `pipenv shell`, as for the tests.
+#
+# Usage:
+#   ./benchmark.sh [pytest options]        compare with the baseline
+#   ./benchmark.sh save [pytest options]   store a new baseline, after a
+#                                          deliberate change or on a new machine
+
+set -e
+cd "$(dirname "$0")"
+
+threshold="${BENCHMARK_THRESHOLD:-20%}"
+options=(tests/test_benchmarks.py --benchmark-only --benchmark-storage=tests/benchmarks)
+
+if [[ "$1" == "save" ]]; then
+  shift
+  exec python -m pytest "${options[@]}" --benchmark-save=baseline "$@"
+fi
+
+# pytest-benchmark only warns when there is nothing to compare with, which
+# would let the gate pass on an interpreter without a baseline
+machine="$(python -c 'from pytest_benchmark.utils import get_machine_id; print(get_machine_id())')"
+if ! compgen -G "tests/benchmarks/$machine/*.json" > /dev/null; then
+  echo "No benchmark baseline for $machine in tests/benchmarks; store one with ./benchmark.sh save" >&2
+  exit 1
+fi
+
+exec python -m pytest "${options[@]}" --benchmark-compare --benchmark-compare-fail="median:$threshold" "$@"
@@ -8,11 +8,16 @@ from flask import (
     abort,
     current_app,
 )
+import re
 import json
 from datetime import datetime
+from sqlalchemy import or_
+from sqlalchemy.orm import selectinload
 from lightbluetent.users import auth_decorator
-from lightbluetent.models import db, Setting, User, Group
+from lightbluetent.models import db, Setting, User, Group, Room
 from lightbluetent.config import PermissionType
+from lightbluetent.api import MeetingStatusService
+from lightbluetent.profiling import query_profiler
 from PIL import Image, UnidentifiedImageError
 
 
@@ -28,18 +33,135 @@ def manage():
     if not user:
         return redirect(url_for("users.register"))
 
-    # TO-DO: PAGINATION
     if user.has_permission_to(PermissionType.CAN_VIEW_ADMIN_PAGE):
+        # Only the first page of groups is rendered; the rest, and the rooms
+        # and users listings, are loaded incrementally from admins.listing.
+        groups, next_cursor = paginate("groups")
         return render_template(
             "admins/index.html",
             page_title="Administrator panel",
-            groups=Group.query.all(),
+            groups=groups,
+            group_count=Group.query.count(),
+            next_cursor=next_cursor,
+            running_counts=count_running(groups),
+            endpoint_stats=query_profiler.endpoint_stats(),
             user=user,
+            errors={},
         )
     else:
         abort(404)
 
 
+# Number of rooms in session for each group, from the status index (the
+# poller's table, or one cached getMeetings call) rather than asking BBB
+# about each room.
+def count_running(groups):
+    room_ids = [room.id for group in groups for room in group.rooms]
+    statuses = MeetingStatusService(room_ids=room_ids)
+    return {
+        group.id: sum(statuses.is_running(room.id) for room in group.rooms) for group in groups
+    }
+
+
+# For each listing: the model, the column it's ordered and paginated by, and
+# the columns searched. The searched columns have trigram indexes in
+# PostgreSQL, so substring searches don't scan the table.
+LISTINGS = {
+    "groups": (Group, Group.id, (Group.id, Group.name)),
+    "rooms": (Room, Room.id, (Room.id, Room.name, Room.alias)),
+    "users": (User, User.id, (User.crsid, User.full_name)),
+}
+
+
+# Keyset pagination: returns up to ADMIN_PAGE_SIZE rows of the listing
+# ordered after the cursor `after`, optionally filtered by the search string
+# `q`, and the cursor for the next page (None on the last page).
+def paginate(listing, q="", after=None):
+    model, key, search_columns = LISTINGS[listing]
+    page_size = current_app.config["ADMIN_PAGE_SIZE"]
+
+    query = model.query
+    if listing == "groups":
+        query = query.options(selectinload(Group.rooms), selectinload(Group.owners))
+
+    if q:
+        pattern = "%" + re.sub(r"([\\%_])", r"\\\1", q) + "%"
+        query = query.filter(or_(*(column.ilike(pattern, escape="\\") for column in search_columns)))
+
+    if after is not None:
+        query = query.filter(key > after)
+
+    # Fetch one extra row to find out whether there's another page
+    rows = query.order_by(key).limit(page_size + 1).all()
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        return rows, getattr(rows[-1], key.key)
+    return rows, None
+
+
+@bp.route("/list/<listing>", methods=["GET"])
+@auth_decorator
+def listing(listing):
+    crsid = auth_decorator.principal
+    user = User.query.filter_by(crsid=crsid).first()
+
+    if not user or not user.has_permission_to(PermissionType.CAN_VIEW_ADMIN_PAGE):
+        abort(404)
+    if listing not in LISTINGS:
+        abort(404)
+
+    q = request.args.get("q", "").strip()
+    after = request.args.get("after")
+    if after is not None and listing == "users":
+        try:
+            after = int(after)
+        except ValueError:
+            abort(400)
+
+    rows, next_cursor = paginate(listing, q, after)
+
+    if listing == "groups":
+        running_counts = count_running(rows)
+        items = [
+            {
+                "title": group.name,
+                "subtitle": group.id,
+                "url": url_for("groups.home", group_id=group.id),
+                "description": group.description,
+                "detail": f"{ len(group.owners) } owner(s), { running_counts[group.id] } session(s) in progress",
+            }
+            for group in rows
+        ]
+    elif listing == "rooms":
+        items = [
+            {
+                "title": room.name,
+                "subtitle": room.alias or room.id,
+                "url": url_for("room_aliases.home", room_id=room.id),
+                "description": room.description,
+                "detail": f"Group { room.group_id }" if room.group_id else f"Personal room of user { room.user_id }",
+            }
+            for room in rows
+        ]
+    else:
+        items = [
+            {
+                "title": row.full_name or row.crsid,
+                "subtitle": row.crsid,
+                "url": None,
+                "description": row.email,
+                "detail": row.role.role.value,
+            }
+            for row in rows
+        ]
+
+    return (
+        json.dumps({"items": items, "next": next_cursor}),
+        200,
+        {"Content-Type": "application/json"},
+    )
+
+
 @bp.route("/update/<update_type>", methods=["POST"])
 def update(update_type):
     setting = request.get_json()
@@ -2,11 +2,58 @@ from os import getenv
 from urllib.parse import urlencode
 from hashlib import sha1
 from flask import current_app, url_for
-from lightbluetent.models import Asset
+from lightbluetent.models import db, Asset, MeetingStatus
+from lightbluetent.cache import TTLCache
+from lightbluetent.metrics import metrics
 
 import requests
 import xmltodict
 import os
+from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Shared between workers (depending on the configured backend) so that page
+# views don't each hit BBB. Keys are "meetings" for the getMeetings index and
+# "running:<meetingID>" for isMeetingRunning.
+meeting_status_cache = TTLCache("meeting_status", "MEETING_STATUS_CACHE")
+
+# One pooled HTTP session per process, so that API calls reuse keep-alive
+# connections to the BBB host instead of paying TCP+TLS setup every time.
+# Keyed on the pid so a forked worker never shares its parent's sockets.
+_http_session = None
+_http_session_pid = None
+
+
+def http_session():
+    global _http_session, _http_session_pid
+
+    if _http_session is None or _http_session_pid != os.getpid():
+        config = current_app.config
+        # Only retry failures to connect: by then BBB can't have acted on the call.
+        # read=False re-raises read timeouts as they are, instead of as a
+        # MaxRetryError that requests would report as a ConnectionError.
+        retry = Retry(
+            total=config["BBB_CONNECT_RETRIES"],
+            connect=config["BBB_CONNECT_RETRIES"],
+            read=False,
+            status=0,
+            backoff_factor=config["BBB_RETRY_BACKOFF"],
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=config["BBB_POOL_SIZE"],
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        _http_session = session
+        _http_session_pid = os.getpid()
+
+    return _http_session
+
 
 # Represents a meeting for a group.
 # Usage:
@@ -64,6 +111,13 @@ class Meeting:
             current_app.logger.error(f"Error creating meeting: { response['message'] }")
             return (False, f"Error creating meeting: { response['message'] }")
 
+        # The cached status is now out of date
+        meeting_status_cache.delete(f"running:{ self.id }")
+        meeting_status_cache.delete("meetings")
+        if current_app.config["MEETING_POLLER_ENABLED"]:
+            MeetingStatus.query.filter_by(room_id=self.id).update({"is_running": True})
+            db.session.commit()
+
         return (True, "")
 
 
@@ -108,17 +162,23 @@ class Meeting:
         return self.build_url("join", params)
 
     def is_running(self):
+        running = meeting_status_cache.get_or_load(f"running:{ self.id }", self.fetch_running)
+        return bool(running)
+
+    # Returns None if the status couldn't be determined, so that it is only
+    # negatively cached.
+    def fetch_running(self):
         params = {}
         params["meetingID"] = self.id
 
         response, error = self.request("isMeetingRunning", params)
 
         if response is None:
-            return False
+            return None
 
         if response["returncode"] != "SUCCESS":
-            current_app.logger.error(f"Error checking meeting status: { response.message }")
-            return False
+            current_app.logger.error(f"Error checking meeting status: { response.get('message') }")
+            return None
 
         return True if response["running"] == "true" else False
 
@@ -126,20 +186,31 @@ class Meeting:
     # Private API #
 
     # Make a request. Returns None, error_msg if
-    #   a) the request timed out, or
+    #   a) the request timed out or the server couldn't be reached, or
     #   b) an error response was received, or
     #   c) the reponse was malformed, or
     #   d) the reponse was not a valid BBB response (i.e. missing returncode key).
-    def request(self, call, params):
-        url = self.build_url(call, params)
+    @staticmethod
+    def request(call, params):
+        url = Meeting.build_url(call, params)
+
+        timeout = (
+            current_app.config["BBB_CONNECT_TIMEOUT"],
+            current_app.config["BBB_READ_TIMEOUT"],
+        )
 
         try:
-            res = requests.get(url, timeout=(0.5, 10))
+            with metrics.timer("lbt_bbb_request_duration_seconds", call=call):
+                res = http_session().get(url, timeout=timeout)
 
         except requests.exceptions.ReadTimeout:
             current_app.logger.error(f"Timeout timed out! Requests.exceptions.ReadTimeout when making API call { call }")
             return (None, f"Timeout timed out! Requests.exceptions.ReadTimeout when making API call { call }")
 
+        except requests.exceptions.ConnectionError as e:
+            current_app.logger.error(f"Could not connect to server when making API call { call }: { e }")
+            return (None, f"Could not connect to server when making API call { call }")
+
         if res.status_code != requests.codes.ok:
             current_app.logger.error(f"Error { res.status_code } from server: { res.text }")
             return (None, f"Error { res.status_code } from server: { res.text }")
@@ -156,16 +227,128 @@ class Meeting:
             return (xml["response"], "")
 
 
-    def generate_checksum(self, call, query):
+    @staticmethod
+    def generate_checksum(call, query):
         hash_string = call + query + getenv("BIGBLUEBUTTON_SECRET")
         checksum = sha1(hash_string.encode()).hexdigest()
 
         return checksum
 
 
-    def build_url(self, call, params):
+    @staticmethod
+    def build_url(call, params):
         query = urlencode(params or {})
-        query += "&checksum=" + self.generate_checksum(call, query)
+        query += "&checksum=" + Meeting.generate_checksum(call, query)
         url = f"{getenv('BIGBLUEBUTTON_URL')}{call}?{query}"
 
         return url
+
+
+# Resolves the running state of many rooms from a single getMeetings call,
+# rather than one isMeetingRunning call per room. When MEETING_POLLER_ENABLED
+# is set, the state is instead read from the meeting_statuses table kept up to
+# date by the poller, and BBB isn't contacted at all; pass room_ids to only
+# load those rooms.
+# Usage:
+# statuses = MeetingStatusService()
+# for room in group.rooms:
+#     running = statuses.is_running(room.id)
+# if statuses.stale:
+#     # warn that the state may be out of date
+class MeetingStatusService:
+
+    def __init__(self, room_ids=None):
+        self.room_ids = room_ids
+        self.polled_at = None
+        self._index = None
+
+
+    # Read the index from the meeting status cache, fetching it on a miss. If
+    # BBB can't be reached the index is empty, so every room reports not
+    # running, which matches the behaviour of Meeting.is_running on error.
+    def fetch(self):
+        if current_app.config["MEETING_POLLER_ENABLED"]:
+            return self.fetch_polled()
+
+        self._index = meeting_status_cache.get_or_load("meetings", self.fetch_index) or {}
+        return self._index
+
+
+    def fetch_polled(self):
+        query = MeetingStatus.query
+        if self.room_ids is not None:
+            query = query.filter(MeetingStatus.room_id.in_(self.room_ids))
+
+        index = {}
+        for status in query:
+            index[status.room_id] = {
+                "running": status.is_running,
+                "participant_count": status.participant_count,
+                "start_time": int(status.start_time.timestamp() * 1000) if status.start_time else 0,
+            }
+            if self.polled_at is None or status.polled_at > self.polled_at:
+                self.polled_at = status.polled_at
+
+        self._index = index
+        return index
+
+
+    # Fetch getMeetings and index the result by meetingID, or None on error.
+    @staticmethod
+    def fetch_index():
+        response, error = Meeting.request("getMeetings", {})
+
+        if response is None:
+            return None
+
+        if response["returncode"] != "SUCCESS":
+            current_app.logger.error(f"Error fetching meetings: { response.get('message') }")
+            return None
+
+        index = {}
+
+        meetings = response.get("meetings") or {}
+        meetings = meetings.get("meeting", [])
+        # xmltodict collapses a single child element into a dict
+        if isinstance(meetings, dict):
+            meetings = [meetings]
+
+        for meeting in meetings:
+            index[meeting["meetingID"]] = {
+                "running": meeting.get("running") == "true",
+                "participant_count": int(meeting.get("participantCount") or 0),
+                "start_time": int(meeting.get("startTime") or 0),
+            }
+
+        return index
+
+
+    @property
+    def index(self):
+        if self._index is None:
+            self.fetch()
+        return self._index
+
+
+    def status(self, meeting_id):
+        return self.index.get(meeting_id)
+
+
+    def is_running(self, meeting_id):
+        status = self.status(meeting_id)
+        return status is not None and status["running"]
+
+
+    # Whether the polled state is too old to be trusted. Always False when
+    # asking BBB directly.
+    @property
+    def stale(self):
+        if not current_app.config["MEETING_POLLER_ENABLED"]:
+            return False
+
+        self.index
+        if self.polled_at is None:
+            return True
+
+        stale_after = timedelta(seconds=current_app.config["MEETING_POLLER_STALE_AFTER"])
+        return datetime.utcnow() - self.polled_at > stale_after
@@ -14,11 +14,16 @@ from lightbluetent.utils import (
     server_error,
     table_exists,
     responsive_image,
+    lookup_cache,
 )
 from lightbluetent.models import (
     db,
     migrate,
     Setting,
+    settings_registry,
+    asset_cache,
+    directory_cache,
+    settings_cache,
     Role,
     Permission,
     User,
@@ -28,6 +33,13 @@ from lightbluetent.models import (
     Authentication
 )
 from lightbluetent.config import PermissionType, RoleType
+from lightbluetent.api import meeting_status_cache
+from lightbluetent.poller import poll_once, run_poller, start_poller_thread
+from lightbluetent.profiling import query_profiler
+from lightbluetent.metrics import metrics
+from lightbluetent.logos import process_pending_logos, cache_hashed_images
+from lightbluetent.static_assets import static_assets
+from lightbluetent.compression import compression
 from functools import wraps
 import click
 from datetime import datetime, timedelta
@@ -88,6 +100,7 @@ def create_app(config_name=None):
     config_module = f"lightbluetent.config.{config_name.capitalize()}Config"
     app.config.from_object(config_module)
     configure_logging(app)
+    compression.init_app(app)
 
     if not app.secret_key and "FLASK_SECRET_KEY" in os.environ:
         app.secret_key = os.environ["FLASK_SECRET_KEY"]
@@ -95,6 +108,8 @@ def create_app(config_name=None):
     if not app.request_class.trusted_hosts and "FLASK_TRUSTED_HOSTS" in os.environ:
         app.request_class.trusted_hosts = os.environ["FLASK_TRUSTED_HOSTS"].split(",")
 
+    app.request_class.max_form_memory_size = app.config["MAX_FORM_MEMORY_SIZE"]
+
     app.config["CSRF_CHECK_REFERER"] = False
     csrf = SeaSurf(app)
     csp = {
@@ -118,6 +133,18 @@ def create_app(config_name=None):
 
     db.init_app(app)
     migrate.init_app(app, db)
+    meeting_status_cache.init_app(app)
+    lookup_cache.init_app(app)
+    asset_cache.init_app(app)
+    directory_cache.init_app(app)
+    settings_cache.init_app(app)
+    settings_registry.init_app(app)
+    query_profiler.init_app(app)
+    app.after_request(cache_hashed_images)
+    static_assets.init_app(app)
+    metrics.init_app(
+        app, caches=(meeting_status_cache, lookup_cache, asset_cache, directory_cache)
+    )
 
     app.register_blueprint(general.bp)
     app.register_blueprint(rooms.bp)
@@ -135,7 +162,7 @@ def create_app(config_name=None):
 
     @app.context_processor
     def inject_settings():
-        return dict(settings=Setting.query.all())
+        return dict(settings=settings_registry.all())
 
     @app.template_test()
     def equalto(value, other):
@@ -173,6 +200,39 @@ def create_app(config_name=None):
                 else:
                     click.echo("Role does not exist")
 
+    @app.cli.command("cache-stats")
+    def cache_stats():
+        """ Shows hit/miss counters for the application's caches """
+        for cache in (meeting_status_cache, lookup_cache, asset_cache, directory_cache):
+            click.echo(f"{cache.name}:")
+            for stat, value in cache.stats().items():
+                click.echo(f"  {stat}: {value}")
+
+    @app.cli.command("poll-meetings")
+    @click.option("--once", is_flag=True, help="Poll once and exit")
+    def poll_meetings(once):
+        """ Keeps the meeting_statuses table up to date with BBB """
+        if once:
+            if not poll_once():
+                raise click.ClickException("Could not fetch meetings from BBB")
+        else:
+            run_poller(app)
+
+    @app.cli.command("collect-static")
+    def collect_static():
+        """ Fingerprints and precompresses the static files """
+        manifest = static_assets.collect()
+        click.echo(f"Collected {len(manifest)} static file(s)")
+
+    @app.cli.command("process-logos")
+    def process_logos():
+        """ Processes logo uploads that are still pending """
+        count = process_pending_logos()
+        click.echo(f"Processed {count} logo(s)")
+
+    if app.config["MEETING_POLLER_THREAD"]:
+        start_poller_thread(app)
+
     with app.app_context():
 
         # create seed values for settings if not already present
@@ -0,0 +1,404 @@
+import atexit
+import json
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from flask import current_app
+
+
+# Storage backends for TTLCache. A backend stores opaque strings with an
+# expiry and keeps integer counters, which can be listed by prefix and
+# incremented in batches; everything else (freshness, negative
+# caching, revalidation) is handled by TTLCache so that the backends stay
+# trivial to swap.
+#
+#   memory: an in-process LRU, private to each gunicorn worker
+#   sqlite: a SQLite file shared by every worker on the host
+#   redis:  any Redis-compatible server (redis://...), shared by all hosts
+
+
+class MemoryBackend:
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            self._data[key] = (value, time.time() + timeout)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key, amount=1):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def incr_many(self, amounts):
+        with self._lock:
+            for key, amount in amounts.items():
+                self._counters[key] = self._counters.get(key, 0) + amount
+
+    def counter(self, key):
+        return self._counters.get(key, 0)
+
+    def counters(self, prefix):
+        with self._lock:
+            return {k: v for k, v in self._counters.items() if k.startswith(prefix)}
+
+
+class SQLiteBackend:
+
+    def __init__(self, path, maxsize=1024):
+        self.path = path
+        self.maxsize = maxsize
+        # Evicting scans the table, so it's done every so many writes rather
+        # than on each; the table can overshoot maxsize by that many entries
+        # per worker in between.
+        self.evict_every = max(1, maxsize // 16)
+        self._writes = 0
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS counters (key TEXT PRIMARY KEY, value INTEGER)"
+            )
+
+    # sqlite3 connections can't be shared between threads, so keep one each.
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connect().execute(
+            "SELECT value, expires FROM cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return row[0]
+
+    def set(self, key, value, timeout):
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+            (key, value, time.time() + timeout),
+        )
+        self._writes += 1
+        if self._writes >= self.evict_every:
+            self._writes = 0
+            self.evict()
+
+    # Evict expired entries, then the soonest to expire, to stay bounded.
+    def evict(self):
+        conn = self._connect()
+        conn.execute("DELETE FROM cache WHERE expires < ?", (time.time(),))
+        conn.execute(
+            "DELETE FROM cache WHERE key IN "
+            "(SELECT key FROM cache ORDER BY expires DESC LIMIT -1 OFFSET ?)",
+            (self.maxsize,),
+        )
+
+    def delete(self, key):
+        self._connect().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def incr(self, key, amount=1):
+        self.incr_many({key: amount})
+
+    # One transaction, so one write lock and fsync, for any number of keys.
+    def incr_many(self, amounts):
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT INTO counters (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = value + excluded.value",
+                amounts.items(),
+            )
+
+    def counter(self, key):
+        row = self._connect().execute(
+            "SELECT value FROM counters WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def counters(self, prefix):
+        rows = self._connect().execute(
+            "SELECT key, value FROM counters WHERE substr(key, 1, ?) = ?",
+            (len(prefix), prefix),
+        )
+        return dict(rows)
+
+
+class RedisBackend:
+
+    def __init__(self, url):
+        # Optional dependency: only needed when this backend is configured.
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self._redis.get(key)
+        return value.decode() if value is not None else None
+
+    def set(self, key, value, timeout):
+        self._redis.set(key, value, ex=max(1, int(timeout)))
+
+    def delete(self, key):
+        self._redis.delete(key)
+
+    def incr(self, key, amount=1):
+        self._redis.incr(key, amount)
+
+    def incr_many(self, amounts):
+        pipeline = self._redis.pipeline(transaction=False)
+        for key, amount in amounts.items():
+            pipeline.incr(key, amount)
+        pipeline.execute()
+
+    def counter(self, key):
+        value = self._redis.get(key)
+        return int(value) if value is not None else 0
+
+    def counters(self, prefix):
+        keys = list(self._redis.scan_iter(match=prefix + "*"))
+        if not keys:
+            return {}
+        values = self._redis.mget(keys)
+        return {
+            key.decode(): int(value)
+            for key, value in zip(keys, values)
+            if value is not None
+        }
+
+
+# Adds up counter increments in memory and writes them to a backend in one
+# batch at most every interval seconds, so that counting something on the
+# request path costs a dict update rather than a write to a shared backend.
+# Reads flush first, so they include this worker's own increments; other
+# workers' may be up to interval seconds behind.
+# Usage:
+# counters = BufferedCounters(backend, 5)
+# counters.incr("requests")
+class BufferedCounters:
+
+    def __init__(self, backend, interval):
+        self.backend = backend
+        self.interval = interval
+        self._pending = {}
+        self._flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+        _buffered_counters.add(self)
+
+    def incr(self, key, amount=1):
+        with self._lock:
+            self._pending[key] = self._pending.get(key, 0) + amount
+            due = time.monotonic() - self._flushed_at >= self.interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flushed_at = time.monotonic()
+        if pending:
+            self.backend.incr_many(pending)
+
+    def counter(self, key):
+        self.flush()
+        return self.backend.counter(key)
+
+    def counters(self, prefix):
+        self.flush()
+        return self.backend.counters(prefix)
+
+
+# Every live BufferedCounters, flushed by one exit handler so that a worker
+# doesn't lose its last increments. A new app (as in tests) creates new ones;
+# registering each with atexit would keep them all alive.
+_buffered_counters = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_buffered_counters():
+    for counters in list(_buffered_counters):
+        counters.flush()
+
+
+BACKENDS = {
+    "memory": lambda url, maxsize: MemoryBackend(maxsize),
+    "sqlite": lambda url, maxsize: SQLiteBackend(url, maxsize),
+    "redis": lambda url, maxsize: RedisBackend(url),
+}
+
+
+# A cache of JSON-serialisable values with a TTL, negative caching and
+# stale-while-revalidate. Configured from the app config using a prefix, e.g.
+# for prefix "MEETING_STATUS_CACHE": MEETING_STATUS_CACHE_BACKEND, _URL,
+# _SIZE, _TTL, _NEGATIVE_TTL and _STALE_TTL.
+# Usage:
+# cache = TTLCache("meeting_status", "MEETING_STATUS_CACHE")
+# cache.init_app(app)
+# value = cache.get_or_load("key", lambda: expensive_call())
+#
+# A loader returning None is treated as a failure or absence and is cached for
+# only NEGATIVE_TTL seconds. Once an entry is older than its TTL it is still
+# served for up to STALE_TTL more seconds while a background thread reloads it.
+# Hit and miss statistics are buffered and written every STATS_FLUSH_INTERVAL
+# seconds (default 5); generation counters are written straight away.
+class TTLCache:
+
+    STATS = ("hits", "misses", "stale", "negative_hits", "loads")
+
+    def __init__(self, name, config_prefix):
+        self.name = name
+        self.config_prefix = config_prefix
+        self.backend = None
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        config = lambda key, default=None: app.config.get(
+            f"{self.config_prefix}_{key}", default
+        )
+        backend = config("BACKEND", "memory")
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown cache backend for {self.name}: {backend!r}")
+
+        self.backend = BACKENDS[backend](config("URL"), config("SIZE", 1024))
+        self._stats = BufferedCounters(self.backend, config("STATS_FLUSH_INTERVAL", 5))
+        self.ttl = config("TTL", 15)
+        self.negative_ttl = config("NEGATIVE_TTL", self.ttl)
+        self.stale_ttl = config("STALE_TTL", 0)
+
+    def _key(self, key):
+        return f"{self.name}:{key}"
+
+    def _count(self, stat):
+        self._stats.incr(self._key(f"stats:{stat}"))
+
+    def get_or_load(self, key, loader):
+        raw = self.backend.get(self._key(key))
+
+        if raw is None:
+            self._count("misses")
+            return self._load(key, loader)
+
+        entry = json.loads(raw)
+        value = entry["value"]
+        ttl = self.ttl if value is not None else self.negative_ttl
+
+        if time.time() - entry["time"] > ttl:
+            self._count("stale")
+            self._revalidate(key, loader)
+        elif value is None:
+            self._count("negative_hits")
+        else:
+            self._count("hits")
+
+        return value
+
+    # Like get_or_load for many keys at once: loader is called once with the
+    # list of keys that aren't fresh and returns a dict of their values.
+    # Stale entries are reloaded along with the misses.
+    def get_many_or_load(self, keys, loader):
+        values = {}
+        missing = []
+
+        for key in keys:
+            raw = self.backend.get(self._key(key))
+            if raw is not None:
+                entry = json.loads(raw)
+                value = entry["value"]
+                ttl = self.ttl if value is not None else self.negative_ttl
+                if time.time() - entry["time"] <= ttl:
+                    self._count("hits" if value is not None else "negative_hits")
+                    values[key] = value
+                    continue
+            self._count("misses")
+            missing.append(key)
+
+        if missing:
+            self._count("loads")
+            loaded = loader(missing)
+            for key in missing:
+                values[key] = loaded.get(key)
+                self.set(key, values[key])
+
+        return values
+
+    def _load(self, key, loader):
+        self._count("loads")
+        value = loader()
+        self.set(key, value)
+        return value
+
+    def set(self, key, value):
+        ttl = self.ttl if value is not None else self.negative_ttl
+        entry = json.dumps({"value": value, "time": time.time()})
+        self.backend.set(self._key(key), entry, ttl + self.stale_ttl)
+
+    # Reload a stale entry in the background, at most once at a time per key
+    # within this worker.
+    def _revalidate(self, key, loader):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        app = current_app._get_current_object()
+
+        def run():
+            try:
+                with app.app_context():
+                    self._load(key, loader)
+            except Exception:
+                app.logger.exception(f"Failed to revalidate {self.name} cache entry {key!r}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def delete(self, key):
+        self.backend.delete(self._key(key))
+
+    # Generation counters invalidate whole families of entries by changing
+    # the keys they're stored under, rather than deleting each one.
+    def generation(self, key):
+        return self.backend.counter(self._key(f"generation:{key}"))
+
+    def bump(self, key):
+        self.backend.incr(self._key(f"generation:{key}"))
+
+    def stats(self):
+        stats = {stat: self._stats.counter(self._key(f"stats:{stat}")) for stat in self.STATS}
+        lookups = stats["hits"] + stats["misses"] + stats["stale"] + stats["negative_hits"]
+        stats["hit_ratio"] = (lookups - stats["misses"]) / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,91 @@
+import gzip
+import time
+from flask import request, _app_ctx_stack
+from lightbluetent.metrics import metrics
+
+
+# Compresses dynamic responses (HTML pages, JSON) with brotli or gzip,
+# whichever the client prefers and is available; brotli needs the optional
+# brotli package. Only responses of an allowed content type and at least
+# COMPRESS_MIN_SIZE bytes are compressed. Files sent from disk and responses
+# that already have a Content-Encoding, such as precompressed static files,
+# are left alone. So are pages that render a CSRF token: compressing a secret
+# next to input reflected from the request (the manage and join forms) would
+# let an attacker recover it from the compressed sizes (BREACH).
+# Usage:
+# compression.init_app(app)
+class Compression:
+
+    def init_app(self, app):
+        config = app.config
+        self.min_size = config["COMPRESS_MIN_SIZE"]
+        self.mimetypes = set(config["COMPRESS_MIMETYPES"])
+        self.level = config["COMPRESS_LEVEL"]
+        self.brotli_quality = config["COMPRESS_BROTLI_QUALITY"]
+
+        try:
+            # Optional dependency: without it only gzip is offered
+            import brotli
+        except ImportError:
+            brotli = None
+        self.brotli = brotli
+
+        app.before_request(self.start_request)
+        # Registered before the other after_request hooks, so it runs last
+        # and sees the final body
+        app.after_request(self.compress)
+
+    # SeaSurf flags the app context when a template renders csrf_token(); an
+    # app context can outlive a request (in tests), so the flag is cleared
+    # at the start of each.
+    def start_request(self):
+        _app_ctx_stack.top.csrf_token_requested = False
+
+    def choose_encoding(self):
+        accepted = request.accept_encodings
+        options = [("gzip", accepted["gzip"])]
+        if self.brotli is not None:
+            options.append(("br", accepted["br"]))
+        # Brotli, being smaller, wins ties such as "gzip, br" or "*"
+        encoding, quality = max(options, key=lambda option: (option[1], option[0] == "br"))
+        return encoding if quality > 0 else None
+
+    def compress(self, response):
+        if (
+            response.direct_passthrough
+            or response.is_streamed
+            or response.status_code < 200
+            or response.status_code in (204, 304)
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in self.mimetypes
+            or getattr(_app_ctx_stack.top, "csrf_token_requested", False)
+        ):
+            return response
+
+        response.vary.add("Accept-Encoding")
+        encoding = self.choose_encoding()
+        data = response.get_data()
+        if encoding is None or len(data) < self.min_size:
+            return response
+
+        start = time.perf_counter()
+        if encoding == "br":
+            compressed = self.brotli.compress(data, quality=self.brotli_quality)
+        else:
+            compressed = gzip.compress(data, compresslevel=self.level)
+        metrics.observe("lbt_compression_seconds", time.perf_counter() - start, encoding=encoding)
+        metrics.inc("lbt_compression_bytes_total", len(data), stage="in")
+        metrics.inc("lbt_compression_bytes_total", len(compressed), stage="out")
+
+        response.set_data(compressed)
+        response.headers["Content-Encoding"] = encoding
+
+        # The body now differs between encodings, so a strong ETag would lie
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            response.set_etag(etag, weak=True)
+
+        return response
+
+
+compression = Compression()
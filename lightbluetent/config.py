@@ -2,6 +2,7 @@ import os
 import enum
 import json
 import subprocess
+import tempfile
 from email.utils import formataddr
 
 
@@ -46,15 +47,40 @@ class Config(object):
 
     # Requests up to 4 MB
     MAX_CONTENT_LENGTH = 4 *  1024 * 1024
+    # Form fields other than files are held in memory, up to this many bytes
+    # in all; Werkzeug writes uploaded files over 500 KB to a temporary file
+    MAX_FORM_MEMORY_SIZE = 512 * 1024
 
     HAS_DIRECTORY_PAGE = True
+    # The directory's group order is reshuffled this often, in seconds
+    DIRECTORY_ROTATION_PERIOD = int(os.getenv("DIRECTORY_ROTATION_PERIOD", 60 * 60))
+    # Groups on the directory page as first sent; the rest are loaded a page
+    # at a time on request, or found with the search box
+    DIRECTORY_PAGE_SIZE = int(os.getenv("DIRECTORY_PAGE_SIZE", 60))
     NUMBER_OF_DAYS = 2
 
     DEFAULT_GROUP_LOGO = "default_group_logo.png"
     DEFAULT_ROOM_LOGO = "default_room_logo.png"
     MAX_LOGO_SIZE = (512, 512)
+    # Logos are rejected from their header if they have more pixels than this,
+    # which bounds the memory needed to decode one
+    MAX_LOGO_PIXELS = int(os.getenv("MAX_LOGO_PIXELS", 40 * 1000 * 1000))
     LOGO_ALLOWED_EXTENSIONS = {".png", ".jpeg", ".jpg", ".gif"}
     IMAGES_DIR = "lightbluetent/static/images"
+    # Logo uploads wait here until a worker has rendered their variants; with
+    # no workers, `flask process-logos` must be run to process them
+    LOGO_STAGING_DIR = os.getenv(
+        "LOGO_STAGING_DIR", os.path.join(tempfile.gettempdir(), "lightbluetent-uploads")
+    )
+    LOGO_WORKERS = int(os.getenv("LOGO_WORKERS", 2))
+    # Formats logos are saved in besides PNG, where Pillow supports them
+    LOGO_EXTRA_FORMATS = os.getenv("LOGO_EXTRA_FORMATS", "WEBP,AVIF").split(",")
+
+    # Static files fingerprinted by `flask collect-static` (see
+    # static_assets.py); patterns are relative to the static folder. Uploaded
+    # logos are left out, being content-hashed already.
+    USE_STATIC_MANIFEST = os.getenv("USE_STATIC_MANIFEST", "") == "true"
+    STATIC_COLLECT_PATTERNS = ["*.css", "*.js", "*.svg", "*.ico", "images/default_*"]
 
     # Since using url_for(static", ...) prepends lightbluetent/static to the URL
     # for us, we have the relative path to the images directory from the static folder.
@@ -62,6 +88,123 @@ class Config(object):
     # getting the URL of the bbb_logo to pass to BBB.
     IMAGES_DIR_FROM_STATIC = "images"
 
+    # HTTP client for the BBB API: connections are pooled per worker and
+    # connection failures are retried with exponential backoff. Timeouts are
+    # in seconds.
+    BBB_POOL_SIZE = int(os.getenv("BBB_POOL_SIZE", 10))
+    BBB_CONNECT_TIMEOUT = float(os.getenv("BBB_CONNECT_TIMEOUT", 0.5))
+    BBB_READ_TIMEOUT = float(os.getenv("BBB_READ_TIMEOUT", 10))
+    BBB_CONNECT_RETRIES = 2
+    BBB_RETRY_BACKOFF = 0.1
+
+    # Caches BBB meeting status between requests. The backend is one of
+    # "memory" (per worker), "sqlite" (URL is a file path shared by all
+    # workers) or "redis" (URL is a redis:// URL). Times are in seconds.
+    MEETING_STATUS_CACHE_BACKEND = os.getenv("MEETING_STATUS_CACHE_BACKEND", "memory")
+    MEETING_STATUS_CACHE_URL = os.getenv("MEETING_STATUS_CACHE_URL")
+    MEETING_STATUS_CACHE_SIZE = 4096
+    MEETING_STATUS_CACHE_TTL = int(os.getenv("MEETING_STATUS_CACHE_TTL", 15))
+    MEETING_STATUS_CACHE_NEGATIVE_TTL = 5
+    MEETING_STATUS_CACHE_STALE_TTL = 60
+
+    # Caches University Lookup API responses by crsid; the backend options
+    # are as for the meeting status cache. Unknown crsids are cached for
+    # NEGATIVE_TTL.
+    LOOKUP_CACHE_BACKEND = os.getenv("LOOKUP_CACHE_BACKEND", "memory")
+    LOOKUP_CACHE_URL = os.getenv("LOOKUP_CACHE_URL")
+    LOOKUP_CACHE_SIZE = 2048
+    LOOKUP_CACHE_TTL = 24 * 60 * 60
+    LOOKUP_CACHE_NEGATIVE_TTL = 60 * 60
+    LOOKUP_CACHE_STALE_TTL = 0
+    # Base URL of the University Lookup API; can point at a stub server when
+    # load testing, as BIGBLUEBUTTON_URL can for BBB
+    LOOKUP_API_URL = os.getenv("LOOKUP_API_URL", "https://www.lookup.cam.ac.uk/api/v1/")
+    # Maximum number of Lookup API calls made at once when adding many users
+    LOOKUP_CONCURRENCY = 10
+
+    # Caches asset variants by key for responsive images. Entries are
+    # invalidated when a logo changes, which only reaches other workers with
+    # a shared backend; otherwise they see the change within TTL seconds.
+    ASSET_CACHE_BACKEND = os.getenv("ASSET_CACHE_BACKEND", "memory")
+    ASSET_CACHE_URL = os.getenv("ASSET_CACHE_URL")
+    ASSET_CACHE_SIZE = 4096
+    ASSET_CACHE_TTL = 5 * 60
+
+    # Caches the rendered directory page and its group cards. Entries are
+    # invalidated by generation counters kept in the same backend, so it
+    # must be shared by every worker: with "memory", an edit handled by one
+    # worker would leave the others serving the old page for up to TTL.
+    DIRECTORY_CACHE_BACKEND = os.getenv("DIRECTORY_CACHE_BACKEND", "sqlite")
+    DIRECTORY_CACHE_URL = os.getenv(
+        "DIRECTORY_CACHE_URL", os.path.join(tempfile.gettempdir(), "lightbluetent-directory.sqlite3")
+    )
+    DIRECTORY_CACHE_SIZE = 8192
+    DIRECTORY_CACHE_TTL = 5 * 60
+
+    # Holds the generation counter that tells each worker's settings registry
+    # to reload after a setting is changed. Like the directory cache, it must
+    # be shared by every worker.
+    SETTINGS_CACHE_BACKEND = os.getenv("SETTINGS_CACHE_BACKEND", "sqlite")
+    SETTINGS_CACHE_URL = os.getenv(
+        "SETTINGS_CACHE_URL", os.path.join(tempfile.gettempdir(), "lightbluetent-settings.sqlite3")
+    )
+
+    # Per-request SQL instrumentation (see profiling.py). Queries slower than
+    # SLOW_QUERY_MS are logged, as are requests slower than SLOW_REQUEST_MS or
+    # making more than MAX_QUERIES queries. Per-endpoint totals are added up
+    # in each worker, written every FLUSH_INTERVAL seconds to a backend as for
+    # the caches above, and shown in the admin panel. SERVER_TIMING adds the
+    # timings to every response, where anyone can read them, so it is off
+    # unless debugging.
+    QUERY_PROFILER_BACKEND = os.getenv("QUERY_PROFILER_BACKEND", "memory")
+    QUERY_PROFILER_URL = os.getenv("QUERY_PROFILER_URL")
+    QUERY_PROFILER_FLUSH_INTERVAL = 5
+    QUERY_PROFILER_SLOW_QUERY_MS = int(os.getenv("QUERY_PROFILER_SLOW_QUERY_MS", 100))
+    QUERY_PROFILER_SLOW_REQUEST_MS = int(os.getenv("QUERY_PROFILER_SLOW_REQUEST_MS", 1000))
+    QUERY_PROFILER_MAX_QUERIES = int(os.getenv("QUERY_PROFILER_MAX_QUERIES", 30))
+    QUERY_PROFILER_SERVER_TIMING = os.getenv("QUERY_PROFILER_SERVER_TIMING", "") == "true"
+
+    # Prometheus-style metrics served at /metrics (see metrics.py), to admins
+    # or to scrapers sending "Authorization: Bearer <METRICS_TOKEN>". The
+    # backend is shared (sqlite by default) so that the samples of all the
+    # gunicorn workers are added together, as a scrape only reaches one of
+    # them; each worker writes its own every FLUSH_INTERVAL seconds.
+    METRICS_BACKEND = os.getenv("METRICS_BACKEND", "sqlite")
+    METRICS_URL = os.getenv(
+        "METRICS_URL", os.path.join(tempfile.gettempdir(), "lightbluetent-metrics.sqlite3")
+    )
+    METRICS_FLUSH_INTERVAL = 5
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+    # Compression of dynamic responses (see compression.py). LEVEL is the gzip
+    # level, 1-9; brotli, if installed, uses BROTLI_QUALITY, 0-11.
+    COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", 500))
+    COMPRESS_MIMETYPES = [
+        "text/html",
+        "text/css",
+        "text/plain",
+        "text/xml",
+        "application/json",
+        "application/javascript",
+        "image/svg+xml",
+    ]
+    COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", 6))
+    COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", 4))
+
+    # Number of groups, rooms or users per page of the admin panel listings
+    ADMIN_PAGE_SIZE = 50
+
+    # Background meeting poller (see poller.py). When enabled, page views read
+    # meeting state from the database instead of asking BBB, so either
+    # `flask poll-meetings` must be running or MEETING_POLLER_THREAD set.
+    # Times are in seconds; JITTER is a fraction of the interval.
+    MEETING_POLLER_ENABLED = os.getenv("MEETING_POLLER_ENABLED", "") == "true"
+    MEETING_POLLER_THREAD = os.getenv("MEETING_POLLER_THREAD", "") == "true"
+    MEETING_POLLER_INTERVAL = int(os.getenv("MEETING_POLLER_INTERVAL", 10))
+    MEETING_POLLER_JITTER = 0.2
+    MEETING_POLLER_MAX_BACKOFF = 300
+    MEETING_POLLER_STALE_AFTER = 60
+
     # defines the default roles that come with the app
     # a role has permissions associated with it
     ROLES_INFO = []
@@ -155,6 +298,7 @@ class ProductionConfig(Config):
     """Production configuration"""
 
     PRODUCTION = True
+    USE_STATIC_MANIFEST = os.getenv("USE_STATIC_MANIFEST", "true") == "true"
     EMAIL_CONFIGURATION = {
         'mailhost': 'localhost',
         'fromaddr': 'lightbluetent@srcf.net',
@@ -170,3 +314,8 @@ class TestingConfig(Config):
     """Testing configuration"""
 
     TESTING = True
+    SECRET_KEY = "testing"
+    # A single process, and nothing left behind between test runs
+    DIRECTORY_CACHE_BACKEND = "memory"
+    SETTINGS_CACHE_BACKEND = "memory"
+    METRICS_BACKEND = "memory"
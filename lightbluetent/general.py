@@ -1,9 +1,28 @@
-from flask import Blueprint, render_template, redirect, url_for, current_app
+from flask import (
+    Blueprint,
+    render_template,
+    redirect,
+    url_for,
+    current_app,
+    request,
+    abort,
+    session,
+    make_response,
+    get_template_attribute,
+)
+from jinja2 import Markup
 from lightbluetent.users import auth_decorator
 from flask_babel import _
-from lightbluetent.api import Meeting
-from lightbluetent.models import Group
+from lightbluetent.api import MeetingStatusService
+from lightbluetent.models import db, Group, Room, User, directory_cache
+from lightbluetent.config import PermissionType
+from lightbluetent.metrics import metrics
+from lightbluetent.utils import responsive_image
+from hashlib import sha1
+import hmac
 import random
+import json
+import time
 
 bp = Blueprint("general", __name__)
 
@@ -14,24 +33,36 @@ def index():
     has_directory_page = current_app.config["HAS_DIRECTORY_PAGE"]
 
     if has_directory_page:
-        groups = Group.query.all()
-
-        running_meetings = {}
-        for group in groups:
-            group_meetings = {}
-            for room in group.rooms:
-                meeting = Meeting(room)
-                group_meetings[room.id] = meeting.is_running()
-            running_meetings[group.id] = group_meetings
-
-        # Shuffle the socs so they all have a chance of being near the top
-        random.shuffle(groups)
-        return render_template(
-            "users/directory.html",
-            page_title=_("Welcome to SRCF Events!"),
-            groups=groups,
-            running_meetings=running_meetings,
-        )
+        statuses = MeetingStatusService()
+
+        seed = rotation_seed()
+
+        # Pending flashed messages are the only per-visitor part of the page
+        if "_flashes" in session:
+            return render_directory(statuses, seed)
+
+        # Everything else the page depends on, so browsers and proxies can
+        # revalidate with the ETag. Only the cards are cached on the server,
+        # so the cache holds an entry per group rather than a whole page for
+        # every combination of running meetings.
+        running = sorted(room_id for room_id, status in statuses.index.items() if status["running"])
+        version = [
+            seed,
+            directory_cache.generation("directory"),
+            running,
+            statuses.stale,
+            current_app.config["GITHUB_REV"],
+        ]
+        etag = sha1(json.dumps(version).encode()).hexdigest()
+
+        if request.if_none_match.contains_weak(etag):
+            response = make_response("", 304)
+        else:
+            response = make_response(render_directory(statuses, seed))
+        response.headers["X-Directory-Rotation"] = str(seed)
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+        return response
     else:
         if auth_decorator.principal:
             return redirect(url_for("users.home"))
@@ -42,6 +73,134 @@ def index():
         )
 
 
+# The directory order is rotated every DIRECTORY_ROTATION_PERIOD seconds so
+# that every group gets a chance to be near the top, while all workers (and
+# caches) agree on the order within a period. The seed is the period number.
+def rotation_seed():
+    return int(time.time() // current_app.config["DIRECTORY_ROTATION_PERIOD"])
+
+
+# Render the first page of the directory; the rest is fetched page by page
+# through the search endpoint when the visitor asks for more.
+def render_directory(statuses, seed):
+    cards, more = directory_page(statuses, seed, 1)
+    return render_template(
+        "users/directory.html",
+        page_title=_("Welcome to SRCF Events!"),
+        cards=cards,
+        next_page=2 if more else None,
+        seed=seed,
+        status_stale=statuses.stale,
+    )
+
+
+# Returns the cards on one page of the directory in the order given by seed,
+# and whether there are more pages. Only the groups on the page are loaded;
+# their cards are cached until the group, its rooms, links or logo change,
+# or one of its rooms starts or stops.
+def directory_page(statuses, seed, page):
+    page_size = current_app.config["DIRECTORY_PAGE_SIZE"]
+    group_ids = sorted(group_id for group_id, in db.session.query(Group.id))
+    # Shuffle the socs so they all have a chance of being near the top
+    random.Random(seed).shuffle(group_ids)
+    page_ids = group_ids[(page - 1) * page_size:page * page_size]
+
+    groups = {group.id: group for group in Group.load_directory(page_ids)}
+    render_card = get_template_attribute("users/macros/directory_group.html", "render")
+    # Cards rendered by an earlier release's templates aren't reused
+    github_rev = current_app.config["GITHUB_REV"]
+
+    # Resolve every group logo in one query rather than one per group
+    responsive_image.prefetch(group.logo for group in groups.values() if group.logo is not None)
+
+    def card(group):
+        group_meetings = {room.id: statuses.is_running(room.id) for room in group.rooms}
+        running = ",".join(sorted(room_id for room_id, running in group_meetings.items() if running))
+        generation = directory_cache.generation(f"group:{ group.id }")
+        return directory_cache.get_or_load(
+            f"card:{ group.id }:{ generation }:{ running }:{ github_rev }",
+            lambda: str(render_card(group, {group.id: group_meetings})),
+        )
+
+    cards = [Markup(card(groups[group_id])) for group_id in page_ids if group_id in groups]
+    return cards, len(group_ids) > page * page_size
+
+
+@bp.route("/search", methods=["GET"])
+def search():
+    if not current_app.config["HAS_DIRECTORY_PAGE"]:
+        abort(404)
+
+    # Further pages of the directory, in the order of the rotation the
+    # visitor's first page was rendered in
+    page = request.args.get("page", type=int)
+    if page is not None:
+        if page < 1:
+            abort(404)
+        seed = request.args.get("seed", rotation_seed(), type=int)
+        cards, more = directory_page(MeetingStatusService(), seed, page)
+        return (
+            json.dumps({"cards": cards, "next_page": page + 1 if more else None}),
+            200,
+            {"Content-Type": "application/json"},
+        )
+
+    q = request.args.get("q", "").strip()
+
+    groups = [
+        {
+            "name": group.name,
+            "description": group.description,
+            "url": url_for("groups.home", group_id=group.id),
+        }
+        for group in Group.search(q)
+    ]
+    rooms = [
+        {
+            "name": room.name,
+            "description": room.description,
+            "group": room.group.name,
+            "url": url_for("room_aliases.home", room_id=room.id),
+        }
+        for room in Room.search(q)
+    ]
+
+    return (
+        json.dumps({"groups": groups, "rooms": rooms}),
+        200,
+        {"Content-Type": "application/json"},
+    )
+
+
+@bp.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    # Scrapers can't log in with Raven, so they authenticate with a token
+    token = current_app.config["METRICS_TOKEN"]
+    authorization = request.headers.get("Authorization", "")
+    if token and hmac.compare_digest(authorization.encode(), f"Bearer {token}".encode()):
+        return render_metrics()
+    return admin_metrics()
+
+
+@auth_decorator
+def admin_metrics():
+    crsid = auth_decorator.principal
+    user = User.query.filter_by(crsid=crsid).first()
+
+    if not user or not user.has_permission_to(PermissionType.CAN_VIEW_ADMIN_PAGE):
+        abort(404)
+
+    return render_metrics()
+
+
+def render_metrics():
+    return (
+        metrics.render(),
+        200,
+        {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
 @bp.route("/logout")
 def logout():
     auth_decorator.logout()
@@ -12,21 +12,21 @@ from flask import (
     url_for,
     current_app,
 )
-from lightbluetent.models import db, Group, User, Room, Authentication, Asset, Link
+from lightbluetent.models import db, Group, User, Room, Authentication, Link
 from lightbluetent.users import auth_decorator
-from lightbluetent.api import Meeting
+from lightbluetent.api import Meeting, MeetingStatusService
+from lightbluetent.logos import stage_logo, submit_logo
 from lightbluetent.utils import (
-    path_sanitise,
     gen_unique_string,
     gen_room_id,
     get_form_values,
-    resize_image,
     match_link,
     match_link_name,
+    parse_crsids,
+    resolve_crsids,
 )
 from flask_babel import _
 from datetime import datetime
-from PIL import Image, UnidentifiedImageError
 
 bp = Blueprint("groups", __name__, url_prefix="/g")
 
@@ -41,15 +41,16 @@ def home(group_id):
     if not group:
         return abort(404)
         
+    statuses = MeetingStatusService()
     running_meetings = {}
     for room in group.rooms:
-        meeting = Meeting(room)
-        running_meetings[room.id] = meeting.is_running()
+        running_meetings[room.id] = statuses.is_running(room.id)
 
     return render_template(
         "groups/home.html",
         page_title=f"{ group.name }",
         running_meetings=running_meetings,
+        status_stale=statuses.stale,
         group=group,
         errors={},
     )
@@ -161,55 +162,21 @@ def update(group_id, update_type):
         if "logo" in request.files and request.files["logo"].filename != "":
             logo = request.files["logo"]
 
-            try:
-                assert logo.filename != ""
-                logo_img = Image.open(logo)
-            except (AssertionError, UnidentifiedImageError):
-                errors["logo"] = "Invalid file."
-            else:
-                if not delete_logo(group.id):
-                    abort(500)
-
-                safe_gid = path_sanitise(group.id)
-                static_filename = lambda v: (
-                    safe_gid + v + "_" + gen_unique_string() + ".png"
-                )
-
-                images_dir = current_app.config["IMAGES_DIR"]
-
-                current_app.logger.info(
-                    f"Changing logo for user { crsid }, group { group.id }..."
-                )
-
-                if not os.path.isdir(images_dir):
-                    current_app.logger.error(f"'{ images_dir }': no such directory.")
-                    abort(500)
-
-                key = f"logo:{group.id}"
-                success = False
-
-                for dpi, img in resize_image(
-                    logo_img, current_app.config["MAX_LOGO_SIZE"]
-                ):
-                    variant = f"@{dpi}x"
-                    subpath = static_filename(variant)
-                    path = os.path.join(images_dir, subpath)
-                    img.save(path)
-
-                    variant = Asset(key=key, variant=variant, path=subpath)
-                    db.session.add(variant)
-                    current_app.logger.info(
-                        f"For id={group.id!r}: saved new logo variant [{variant!r}] {path!r}"
-                    )
-                    success = True
+            images_dir = current_app.config["IMAGES_DIR"]
+            if not os.path.isdir(images_dir):
+                current_app.logger.error(f"'{ images_dir }': no such directory.")
+                abort(500)
 
-                if not success:
-                    errors["logo"] = "Failed to resize image."
+            current_app.logger.info(
+                f"Changing logo for user { crsid }, group { group.id }..."
+            )
 
-                else:
-                    current_app.logger.info(f"Saved new logo for group '{ group.id }'")
-                    group.logo = key
-                    db.session.commit()
+            # The variants are rendered in the background; see logos.py
+            error = stage_logo(group, logo)
+            if error is None:
+                submit_logo(group.id, group.logo_pending)
+            else:
+                errors["logo"] = error
 
         for link in group.links:
             url_field = request.form.get(f"{link.id}-url", "").strip()
@@ -250,22 +217,28 @@ def update(group_id, update_type):
 
         values["new_owner_crsid"] = request.form.get("new_owner_crsid", "").strip()
 
-        # Add a new owner
+        # Add new owners; several CRSids may be given, separated by commas or whitespace
         if values["new_owner_crsid"]:
             current_app.logger.info(
-                f"{ crsid } is adding new owner '{ values['new_owner_crsid'] }' to group '{ group.id }'..."
+                f"{ crsid } is adding new owner(s) '{ values['new_owner_crsid'] }' to group '{ group.id }'..."
             )
 
-            new_owner = User.query.filter_by(crsid=values["new_owner_crsid"]).first()
-            if new_owner:
-                group.owners.append(new_owner)
-                current_app.logger.info(
-                    f"New owner '{ new_owner.full_name }' added to group '{ group.id }'."
-                )
-            else:
+            new_owner_crsids, invalid_crsids = parse_crsids(values["new_owner_crsid"])
+            new_owners, missing_crsids = resolve_crsids(new_owner_crsids)
+
+            if invalid_crsids:
+                errors["new_owner_crsid"] = f"Invalid CRSid(s): { ', '.join(invalid_crsids) }."
+            elif missing_crsids:
                 errors[
                     "new_owner_crsid"
-                ] = "That user is not registered yet. Users must register before being added as owners."
+                ] = f"Not registered yet: { ', '.join(missing_crsids) }. Users must register before being added as owners."
+            else:
+                for new_owner in new_owners:
+                    if new_owner not in group.owners:
+                        group.owners.append(new_owner)
+                        current_app.logger.info(
+                            f"New owner '{ new_owner.full_name }' added to group '{ group.id }'."
+                        )
     elif update_type == "links_order":
         links_order = request.get_json(force=True)
         for index, val in enumerate(links_order["order"]):
@@ -395,7 +368,7 @@ def delete(group_id):
 
             db.session.commit()
 
-            if not delete_logo(group.id):
+            if not group.delete_logo():
                 abort(500)
 
             db.session.delete(group)
@@ -0,0 +1,291 @@
+import os
+import io
+import re
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, request
+from PIL import Image, UnidentifiedImageError
+from lightbluetent.models import db, Group, Asset, asset_cache
+from lightbluetent.utils import resize_image, path_sanitise, gen_unique_string
+from lightbluetent.metrics import metrics
+
+
+# Group logos are processed outside the request that uploads them: the upload
+# is written to LOGO_STAGING_DIR and recorded in Group.logo_pending, and a
+# background thread renders its variants and swaps them in. Every upload gets
+# its own asset key, so pages see either all of the old variants or all of the
+# new ones, never a mixture. With LOGO_WORKERS = 0 nothing is processed in the
+# web process and `flask process-logos` must be run instead; it also finishes
+# uploads left behind by a restart.
+# Usage:
+# error = stage_logo(group, request.files["logo"])
+# if error is None:
+#     submit_logo(group.id, group.logo_pending)
+
+
+# One executor per process, as for api.http_session.
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    global _executor, _executor_pid
+
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=current_app.config["LOGO_WORKERS"],
+                thread_name_prefix="logos",
+            )
+            _executor_pid = os.getpid()
+
+    return _executor
+
+
+# Formats logo variants are saved in: content type, extension and options.
+# Every variant is saved as PNG, which all browsers get; the formats in
+# LOGO_EXTRA_FORMATS that this Pillow build can write are offered ahead of it.
+FORMATS = {
+    "PNG": ("image/png", "png", {"optimize": True}),
+    "WEBP": ("image/webp", "webp", {"quality": 90, "method": 4}),
+    "AVIF": ("image/avif", "avif", {"quality": 75}),
+}
+
+# Variants are named by the SHA-256 of their contents, so never change
+hashed_name_re = re.compile(r"^[0-9a-f]{64}\.(png|webp|avif)$")
+
+
+def logo_formats():
+    Image.init()
+    extra = current_app.config["LOGO_EXTRA_FORMATS"]
+    return ["PNG"] + [format for format in extra if format in FORMATS and format in Image.SAVE]
+
+
+# Encode a variant and store it under the hash of its bytes, unless an
+# identical file is already stored. Returns (subpath, content_type).
+def save_variant(image, format, images_dir):
+    content_type, extension, options = FORMATS[format]
+    buffer = io.BytesIO()
+    image.save(buffer, format, **options)
+    data = buffer.getvalue()
+
+    subpath = f"{hashlib.sha256(data).hexdigest()}.{extension}"
+    path = os.path.join(images_dir, subpath)
+    if not os.path.exists(path):
+        # Written aside and renamed, so a half-written file is never served
+        temporary = f"{path}.{gen_unique_string()}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(data)
+        os.replace(temporary, path)
+
+    return subpath, content_type
+
+
+# Long-lived caching for the content-hashed logo variants; other static files
+# keep Flask's defaults.
+def cache_hashed_images(response):
+    if request.endpoint == "static" and response.status_code == 200:
+        images = current_app.config["IMAGES_DIR_FROM_STATIC"] + "/"
+        filename = (request.view_args or {}).get("filename", "")
+        if filename.startswith(images) and hashed_name_re.match(filename[len(images):]):
+            response.cache_control.public = True
+            response.cache_control.max_age = 365 * 24 * 60 * 60
+            response.cache_control.immutable = True
+    return response
+
+
+# Leading bytes of each accepted format, checked before Pillow sees the file.
+SIGNATURES = {
+    b"\x89PNG\r\n\x1a\n": "PNG",
+    b"\xff\xd8\xff": "JPEG",
+    b"GIF87a": "GIF",
+    b"GIF89a": "GIF",
+}
+
+
+# Checks that file is a PNG, JPEG or GIF within MAX_LOGO_PIXELS from its
+# header alone, without decoding it. Returns None if acceptable, otherwise
+# an error message.
+def sniff_logo(file):
+    header = file.read(8)
+    file.seek(0)
+    format = next(
+        (format for signature, format in SIGNATURES.items() if header.startswith(signature)),
+        None,
+    )
+    if format is None:
+        return "Your logo must be a PNG, JPEG or GIF file."
+
+    try:
+        # Opening only parses the header; pixels are decoded on first use
+        with Image.open(file) as image:
+            if image.format != format:
+                return "Invalid file."
+            width, height = image.size
+    except (UnidentifiedImageError, Image.DecompressionBombError):
+        return "Invalid file."
+    finally:
+        file.seek(0)
+
+    if width * height > current_app.config["MAX_LOGO_PIXELS"]:
+        return "Your logo has too many pixels; please upload a smaller image."
+
+    return None
+
+
+# Decodes a logo using as little memory as possible: JPEGs are decoded
+# straight at a fraction of their size, and other images are reduced by an
+# integer factor (palette images are subsampled) before the RGBA copy is
+# made, while still being large enough to be scaled down to fit within size.
+def load_logo(path, size):
+    with Image.open(path) as image:
+        if image.width * image.height > current_app.config["MAX_LOGO_PIXELS"]:
+            raise ValueError(f"{image.size} exceeds MAX_LOGO_PIXELS")
+
+        if image.format == "JPEG":
+            image.draft("RGB", size)
+        image.load()
+
+        # The aspect ratio is kept, so only the limiting dimension must cover size
+        factor = max(image.width // size[0], image.height // size[1])
+        if factor >= 2:
+            if image.mode not in ("RGB", "RGBA", "L", "LA"):
+                # reduce() can't average palette indexes, but converting at
+                # full size would take 4 bytes a pixel, so the image is first
+                # subsampled in its own mode to about twice the size needed
+                coarse = factor // 2
+                if coarse >= 2:
+                    image = image.resize((image.width // coarse, image.height // coarse), Image.NEAREST)
+                image = image.convert("RGBA")
+                factor = max(image.width // size[0], image.height // size[1])
+            if factor >= 2:
+                image = image.reduce(factor)
+
+        return image.convert("RGBA")
+
+
+# Save an uploaded logo for processing and mark it pending on the group. The
+# upload arrives in a temporary file if it's large (see MAX_FORM_MEMORY_SIZE)
+# and only its header is read here. Returns None on success, otherwise an error message.
+def stage_logo(group, upload):
+    error = sniff_logo(upload.stream)
+    if error is not None:
+        return error
+
+    staging_dir = current_app.config["LOGO_STAGING_DIR"]
+    os.makedirs(staging_dir, exist_ok=True)
+    filename = f"{path_sanitise(group.id)}_{gen_unique_string()}"
+    upload.save(os.path.join(staging_dir, filename))
+
+    # A previous upload still pending is superseded; its worker will notice
+    group.logo_pending = filename
+    db.session.commit()
+    current_app.logger.info(f"For id={group.id!r}: staged new logo {filename!r}")
+    return None
+
+
+def submit_logo(group_id, filename):
+    if not current_app.config["LOGO_WORKERS"]:
+        return
+
+    app = current_app._get_current_object()
+
+    def run():
+        with app.app_context():
+            try:
+                process_logo(group_id, filename)
+            except Exception:
+                db.session.rollback()
+                app.logger.exception(f"Failed to process logo {filename!r} for {group_id!r}")
+
+    executor().submit(run)
+
+
+# Render the variants of a staged logo and make them the group's logo, unless
+# the upload was superseded or deleted in the meantime.
+def process_logo(group_id, filename):
+    staged = os.path.join(current_app.config["LOGO_STAGING_DIR"], filename)
+    images_dir = current_app.config["IMAGES_DIR"]
+
+    pending = db.session.query(Group.logo_pending).filter_by(id=group_id).scalar()
+    db.session.rollback()
+    if pending != filename:
+        remove_file(staged)
+        return
+
+    key = f"logo:{group_id}:{gen_unique_string()}"
+    formats = logo_formats()
+    assets = []
+
+    max_width, max_height = current_app.config["MAX_LOGO_SIZE"]
+    hidpi = [1, 2]
+
+    try:
+        with metrics.timer("lbt_logo_processing_seconds"):
+            image = load_logo(staged, (max_width * max(hidpi), max_height * max(hidpi)))
+            current_app.logger.info(f"For id={group_id!r}: decoded logo at {image.size}")
+            for dpi, img in resize_image(image, (max_width, max_height), hidpi=hidpi):
+                variant = f"@{dpi}x"
+                for format in formats:
+                    subpath, content_type = save_variant(img, format, images_dir)
+                    assets.append(Asset(
+                        key=key, variant=variant, content_type=content_type, path=subpath
+                    ))
+    except (OSError, ValueError, Image.DecompressionBombError):
+        current_app.logger.exception(f"For id={group_id!r}: failed to resize logo {filename!r}")
+        assets = []
+
+    # Lock the group so a newer upload or a deletion can't interleave the swap
+    group = Group.query.filter_by(id=group_id).with_for_update().first()
+
+    if group is None or group.logo_pending != filename or not assets:
+        if group is not None and group.logo_pending == filename:
+            group.logo_pending = None
+        db.session.commit()
+        # Identical files may belong to other logos
+        for path in Asset.unreferenced([asset.path for asset in assets]):
+            remove_file(os.path.join(images_dir, path))
+        remove_file(staged)
+        return
+
+    old_key = group.logo
+    old_assets = Asset.query.filter_by(key=old_key).all() if old_key else []
+    old_paths = [asset.path for asset in old_assets]
+
+    for asset in old_assets:
+        db.session.delete(asset)
+    db.session.add_all(assets)
+    group.logo = key
+    group.logo_pending = None
+    db.session.commit()
+
+    # Identical files may belong to other logos, or to the new one
+    for path in Asset.unreferenced(old_paths):
+        remove_file(os.path.join(images_dir, path))
+    if old_key:
+        asset_cache.delete(old_key)
+    remove_file(staged)
+
+    current_app.logger.info(f"For id={group_id!r}: saved new logo {key!r} with {len(assets)} variant(s)")
+
+
+# Process every upload that's still pending, e.g. after a restart.
+def process_pending_logos():
+    pending = db.session.query(Group.id, Group.logo_pending).filter(
+        Group.logo_pending.isnot(None)
+    ).all()
+    db.session.rollback()
+
+    for group_id, filename in pending:
+        process_logo(group_id, filename)
+
+    return len(pending)
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,192 @@
+import time
+from contextlib import contextmanager
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+from lightbluetent.cache import BACKENDS, BufferedCounters
+
+
+# Prometheus-style metrics, served in the text exposition format at /metrics.
+# Samples are kept as integer counters in one of the cache backends, so with
+# the "sqlite" or "redis" backend every gunicorn worker adds to the same
+# series and a scrape sees the totals for the whole deployment; with
+# "memory" it only sees the worker that answered. Each worker adds its
+# samples up in memory and writes them to the backend every FLUSH_INTERVAL
+# seconds, so recording one costs no I/O on the request path.
+# Usage:
+# metrics.init_app(app, caches=(lookup_cache,))
+# with metrics.timer("lbt_bbb_request_duration_seconds", call="create"):
+#     ...
+# metrics.inc("lbt_db_pool_checkouts_total")
+class Metrics:
+
+    # Upper bounds, in seconds, of the histogram buckets
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    METRICS = {
+        "lbt_request_duration_seconds": (
+            "histogram", "Time taken to handle HTTP requests, by endpoint",
+        ),
+        "lbt_bbb_request_duration_seconds": (
+            "histogram", "Latency of BigBlueButton API calls, by call",
+        ),
+        "lbt_lookup_request_duration_seconds": (
+            "histogram", "Latency of University Lookup API calls",
+        ),
+        "lbt_logo_processing_seconds": (
+            "histogram", "Time taken to decode and resize an uploaded logo",
+        ),
+        "lbt_compression_seconds": (
+            "histogram", "Time taken to compress responses, by encoding",
+        ),
+        "lbt_compression_bytes_total": (
+            "counter", "Bytes of responses before (in) and after (out) compression",
+        ),
+        "lbt_db_pool_checkouts_total": (
+            "counter", "Database connections checked out of the pool",
+        ),
+        "lbt_db_pool_connects_total": (
+            "counter", "New database connections opened by the pool",
+        ),
+    }
+
+    PREFIX = "metrics|"
+
+    def __init__(self):
+        self.counters = None
+        self.app = None
+        self.caches = ()
+
+    def init_app(self, app, caches=()):
+        backend = app.config["METRICS_BACKEND"]
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend for metrics: {backend!r}")
+
+        self.app = app
+        self.counters = BufferedCounters(
+            BACKENDS[backend](app.config["METRICS_URL"], 0), app.config["METRICS_FLUSH_INTERVAL"]
+        )
+        self.caches = caches
+
+        if not event.contains(Pool, "checkout", self.on_checkout):
+            event.listen(Pool, "checkout", self.on_checkout)
+            event.listen(Pool, "connect", self.on_connect)
+
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+
+    # Series are stored under "metrics|<name>|<labels>|<suffix>", where the
+    # labels are already formatted for the exposition format.
+    def _key(self, name, labels, suffix):
+        label_str = ",".join(
+            f'{label}="{escape(value)}"' for label, value in sorted(labels.items())
+        )
+        return f"{self.PREFIX}{name}|{label_str}|{suffix}"
+
+    def _incr(self, key, amount=1):
+        try:
+            self.counters.incr(key, amount)
+        except Exception:
+            # Losing a sample is better than failing whatever was measured
+            self.app.logger.exception("Failed to record metric")
+
+    def inc(self, name, amount=1, **labels):
+        self._incr(self._key(name, labels, "value"), amount)
+
+    def observe(self, name, seconds, **labels):
+        bucket = next((str(le) for le in self.BUCKETS if seconds <= le), "+Inf")
+        self._incr(self._key(name, labels, f"bucket:{bucket}"))
+        self._incr(self._key(name, labels, "count"))
+        # Counters are integers, so sums are kept in microseconds
+        self._incr(self._key(name, labels, "sum"), round(seconds * 1e6))
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        self.inc("lbt_db_pool_checkouts_total")
+
+    def on_connect(self, dbapi_connection, connection_record):
+        self.inc("lbt_db_pool_connects_total")
+
+    def start_request(self):
+        g.metrics_start_time = time.perf_counter()
+
+    def finish_request(self, response):
+        # Requests that didn't match a route (404s) would only add noise
+        if "metrics_start_time" in g and request.endpoint is not None:
+            self.observe(
+                "lbt_request_duration_seconds",
+                time.perf_counter() - g.metrics_start_time,
+                endpoint=request.endpoint,
+            )
+        return response
+
+    # The metrics in the Prometheus text exposition format.
+    def render(self):
+        series = {}
+        for key, value in self.counters.counters(self.PREFIX).items():
+            name, rest = key[len(self.PREFIX):].split("|", 1)
+            label_str, suffix = rest.rsplit("|", 1)
+            series.setdefault(name, {}).setdefault(label_str, {})[suffix] = value
+
+        lines = []
+        for name, (kind, description) in self.METRICS.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for label_str, samples in sorted(series.get(name, {}).items()):
+                if kind == "counter":
+                    lines.append(sample(name, label_str, samples.get("value", 0)))
+                    continue
+
+                cumulative = 0
+                for le in [str(le) for le in self.BUCKETS] + ["+Inf"]:
+                    cumulative += samples.get(f"bucket:{le}", 0)
+                    lines.append(sample(
+                        f"{name}_bucket", join_labels(label_str, f'le="{le}"'), cumulative
+                    ))
+                lines.append(sample(f"{name}_sum", label_str, samples.get("sum", 0) / 1e6))
+                lines.append(sample(f"{name}_count", label_str, samples.get("count", 0)))
+
+        lines.extend(self._render_caches())
+        return "\n".join(lines) + "\n"
+
+    # Cache statistics are already kept by each TTLCache in its own backend.
+    def _render_caches(self):
+        lookups = [
+            "# HELP lbt_cache_lookups_total Cache lookups, by cache and result",
+            "# TYPE lbt_cache_lookups_total counter",
+        ]
+        ratios = [
+            "# HELP lbt_cache_hit_ratio Fraction of cache lookups not needing a load",
+            "# TYPE lbt_cache_hit_ratio gauge",
+        ]
+        for cache in self.caches:
+            stats = cache.stats()
+            for result in ("hits", "misses", "stale", "negative_hits"):
+                labels = f'cache="{escape(cache.name)}",result="{result}"'
+                lookups.append(sample("lbt_cache_lookups_total", labels, stats[result]))
+            ratios.append(sample("lbt_cache_hit_ratio", f'cache="{escape(cache.name)}"', stats["hit_ratio"]))
+        return lookups + ratios
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def join_labels(*label_strs):
+    return ",".join(label_str for label_str in label_strs if label_str)
+
+
+def sample(name, label_str, value):
+    if label_str:
+        return f"{name}{{{label_str}}} {value}"
+    return f"{name} {value}"
+
+
+metrics = Metrics()
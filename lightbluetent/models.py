@@ -1,20 +1,44 @@
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import event
+from sqlalchemy import event, func, and_, inspect
+from sqlalchemy.orm import subqueryload, Session as SQLAlchemySession
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from flask_migrate import Migrate
 from datetime import datetime
 from lightbluetent.config import PermissionType, RoleType
-from flask import current_app
+from lightbluetent.cache import TTLCache
+from flask import current_app, g
+from collections import namedtuple
+import threading
 import enum
+import os
+import re
 
 db = SQLAlchemy()
 migrate = Migrate()
 
+# Asset variants by key, as lists of [variant, path], so that rendering an
+# image doesn't query the assets table; see utils.responsive_image.
+asset_cache = TTLCache("assets", "ASSET_CACHE")
+
+# Rendered directory pages and group cards; see general.index. The generation
+# counters "directory" and "group:<id>" are bumped whenever a commit changes
+# something the directory shows (see the session events at the end of this
+# file), which invalidates the affected entries.
+directory_cache = TTLCache("directory", "DIRECTORY_CACHE")
+
+# Holds the generation counter "settings", bumped whenever a commit changes a
+# Setting (see the session events at the end of this file), which tells
+# every worker's SettingsRegistry to reload.
+settings_cache = TTLCache("settings", "SETTINGS_CACHE")
+
 
 # Association table between users and groups.
 user_group = db.Table(
     "users_groups",
     db.Column("user_id", db.Integer, db.ForeignKey("users.id"), primary_key=True),
     db.Column("group_id", db.String(20), db.ForeignKey("groups.id"), primary_key=True),
+    # The primary key only serves lookups by user; this serves group.owners
+    db.Index("ix_users_groups_group_id", "group_id"),
 )
 
 # Association table between roles and permissions.
@@ -34,8 +58,45 @@ whitelist = db.Table(
     db.Column("user_id", db.Integer, db.ForeignKey("users.id")),
     db.Column("group_id", db.String(20), db.ForeignKey("groups.id")),
     db.Column("room_id", db.String(28), db.ForeignKey("rooms.id")),
+    db.Index("ix_whitelist_user_id", "user_id"),
+    db.Index("ix_whitelist_group_id", "group_id"),
+    db.Index("ix_whitelist_room_id", "room_id"),
 )
 
+# Full-text search over names and descriptions. In PostgreSQL the search
+# vector is a weighted tsvector (name above description) with a GIN index;
+# elsewhere, e.g. SQLite in tests, it's the lowercased text, searched with
+# LIKE. Either way it is kept up to date by the before_insert/before_update
+# events at the end of this file.
+SearchVector = TSVECTOR().with_variant(db.Text(), "sqlite")
+
+search_word_re = re.compile(r"\w+")
+
+
+def search_vector(connection, name, description):
+    if connection.dialect.name == "postgresql":
+        return func.setweight(
+            func.to_tsvector("english", name or ""), "A"
+        ).op("||")(func.setweight(func.to_tsvector("english", description or ""), "B"))
+    return f"{ name or '' } { description or '' }".lower()
+
+
+# Returns (condition, rank) for matching column against the words of q, each
+# as a prefix so that results update while the user types.
+def search_condition(column, q):
+    words = search_word_re.findall(q.lower())
+    if not words:
+        return None, None
+    if db.engine.dialect.name == "postgresql":
+        query = func.to_tsquery("english", " & ".join(f"{ word }:*" for word in words))
+        return column.op("@@")(query), func.ts_rank(column, query)
+    # \w matches "_", which LIKE would take as a wildcard
+    patterns = [re.sub(r"([\\%_])", r"\\\1", word) for word in words]
+    condition = and_(*(column.like(f"%{ pattern }%", escape="\\") for pattern in patterns))
+    # The name comes first in the text, so earlier matches rank higher
+    return condition, sum(func.instr(column, word) for word in words) * -1
+
+
 # Different levels of authentication for attendees joining a room
 class Authentication(enum.Enum):
     PUBLIC = "public"
@@ -77,6 +138,12 @@ class Link(db.Model):
     display_order = db.Column(db.Integer, nullable=False)
     type = db.Column(db.Enum(LinkType), nullable=False, default=LinkType.OTHER)
 
+    # Links are always fetched for one group or room, in display order
+    __table_args__ = (
+        db.Index("ix_links_group_id_display_order", "group_id", "display_order"),
+        db.Index("ix_links_room_id_display_order", "room_id", "display_order"),
+    )
+
     def __repr__(self):
         return f"Link(room: {self.room!r}, name: {self.name!r}, url: {self.url!r})"
 
@@ -94,10 +161,10 @@ class Room(db.Model):
         db.String(100), nullable=True, unique=True
     )  # e.g. "srcf-committee-meetings" corresponds to https://events.srcf.net/r/srcf-committee-meetings
     group_id = db.Column(
-        db.String(20), db.ForeignKey("groups.id"), nullable=True
+        db.String(20), db.ForeignKey("groups.id"), nullable=True, index=True
     )  # For group-owned rooms
     user_id = db.Column(
-        db.Integer, db.ForeignKey("users.id"), nullable=True
+        db.Integer, db.ForeignKey("users.id"), nullable=True, index=True
     )  # For user-owned rooms
     sessions = db.relationship("Session", backref="room", lazy=True)
     links = db.relationship("Link", backref="room", lazy=True)
@@ -126,12 +193,39 @@ class Room(db.Model):
         backref=db.backref("rooms_whitelisted_for", lazy=True),
     )
 
+    status = db.relationship(
+        "MeetingStatus",
+        backref="room",
+        uselist=False,
+        lazy=True,
+        cascade="all, delete-orphan",
+    )
+
     time_created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
+    search_vector = db.Column(SearchVector, nullable=True)
+
+    __table_args__ = (
+        db.Index("ix_rooms_search_vector", "search_vector", postgresql_using="gin"),
+    )
+
     def __repr__(self):
         return f"Room(group: {self.group!r}, name: {self.name!r})"
 
+    @staticmethod
+    def search(q, limit=20):
+        """Search group rooms; personal rooms aren't listed publicly."""
+        condition, rank = search_condition(Room.search_vector, q)
+        if condition is None:
+            return []
+        return (
+            Room.query.filter(condition, Room.group_id.isnot(None))
+            .order_by(rank.desc())
+            .limit(limit)
+            .all()
+        )
+
     def get_next_link(self):
         # have we already created an empty link?
         # add default for when self.links is empty
@@ -171,7 +265,9 @@ class User(db.Model):
     __tablename__ = "users"
 
     id = db.Column(db.Integer, primary_key=True)
-    crsid = db.Column(db.String(7), db.CheckConstraint("crsid = lower(crsid)"))
+    crsid = db.Column(
+        db.String(7), db.CheckConstraint("crsid = lower(crsid)"), unique=True, index=True
+    )
     email = db.Column(db.String, unique=True, nullable=True)
     full_name = db.Column(db.String, unique=False, nullable=True)
     time_created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
@@ -212,13 +308,45 @@ class Group(db.Model):
     links = db.relationship("Link", backref="group", lazy=True)
 
     logo = db.Column(db.String, unique=False, nullable=True)
+    # Staged upload still being processed into the next logo; see logos.py
+    logo_pending = db.Column(db.String, unique=False, nullable=True)
 
     time_created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
+    search_vector = db.Column(SearchVector, nullable=True)
+
+    __table_args__ = (
+        db.Index("ix_groups_search_vector", "search_vector", postgresql_using="gin"),
+    )
+
     def __repr__(self):
         return f"Group({self.name!r})"
 
+    @staticmethod
+    def search(q, limit=20):
+        condition, rank = search_condition(Group.search_vector, q)
+        if condition is None:
+            return []
+        return Group.query.filter(condition).order_by(rank.desc()).limit(limit).all()
+
+    @staticmethod
+    def load_directory(group_ids):
+        """
+        Load the given groups along with the rooms, links and owners that the
+        directory renders, using one query per relationship rather than one
+        per group. Logos are resolved separately, see
+        responsive_image.prefetch.
+
+        subqueryload rather than selectinload, which splits its IN lists
+        into batches of 500 and so adds queries as groups are added.
+        """
+        return Group.query.options(
+            subqueryload(Group.rooms),
+            subqueryload(Group.links),
+            subqueryload(Group.owners),
+        ).filter(Group.id.in_(group_ids)).all()
+
     def get_display_order(self):
         out = [0] * len(self.links)
         for link in self.links:
@@ -258,16 +386,28 @@ class Group(db.Model):
             current_app.logger.info(f"'{ images_dir }':  no such directory.")
             return False
 
+        # A logo still being processed is dropped when it's done
+        self.logo_pending = None
+
         if self.logo is None:
+            db.session.commit()
             return True
 
         current_app.logger.info(f"For id='{ self.id }': deleting logo...")
+        paths = []
         for asset in Asset.query.filter_by(key=self.logo):
-            old_logo = os.path.join(images_dir, asset.path)
-            delete_logo_variant(old_logo)
+            paths.append(asset.path)
             db.session.delete(asset)
+        asset_cache.delete(self.logo)
         self.logo = None
         db.session.commit()
+
+        # Files are shared between identical logos, so only remove the unused
+        for path in Asset.unreferenced(paths):
+            old_logo = os.path.join(images_dir, path)
+            if os.path.isfile(old_logo):
+                os.remove(old_logo)
+                current_app.logger.info(f"Deleted logo '{ old_logo }'")
         return True
 
 
@@ -275,7 +415,7 @@ class Session(db.Model):
     __tablename__ = "sessions"
 
     id = db.Column(db.Integer, primary_key=True)
-    room_id = db.Column(db.String(28), db.ForeignKey("rooms.id"), nullable=True)
+    room_id = db.Column(db.String(28), db.ForeignKey("rooms.id"), nullable=True, index=True)
     start = db.Column(db.DateTime, nullable=False)
     end = db.Column(db.DateTime, nullable=False)
     recur = db.Column(db.Enum(Recurrence), nullable=False, default=Recurrence.NONE)
@@ -286,11 +426,32 @@ class Session(db.Model):
         return f"Session(group: {self.group!r}, start: {self.start!r}, end: {self.end!r}, reccur: {self.recur!r}, limit: {self.limit!r})"
 
 
+class MeetingStatus(db.Model):
+    """
+    The BBB meeting state of each room, as last seen by the meeting poller
+    (see lightbluetent/poller.py). polled_at is the time of the last
+    successful poll, so page views can tell when it is out of date.
+    """
+
+    __tablename__ = "meeting_statuses"
+
+    room_id = db.Column(
+        db.String(28), db.ForeignKey("rooms.id", ondelete="CASCADE"), primary_key=True
+    )
+    is_running = db.Column(db.Boolean, nullable=False, default=False)
+    participant_count = db.Column(db.Integer, nullable=False, default=0)
+    start_time = db.Column(db.DateTime, nullable=True)
+    polled_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"MeetingStatus({self.room_id!r}, running: {self.is_running!r}, participants: {self.participant_count!r})"
+
+
 class Setting(db.Model):
     __tablename__ = "settings"
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String, unique=False, nullable=False)
+    name = db.Column(db.String, unique=True, nullable=False, index=True)
     value = db.Column(db.String, unique=False, nullable=True)
     enabled = db.Column(db.Boolean, nullable=True, default=False)
     updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
@@ -299,6 +460,53 @@ class Setting(db.Model):
         return f"Setting({self.name!r}, {self.enabled!r})"
 
 
+# A snapshot of a Setting row that can outlive the session it was loaded in.
+SettingValue = namedtuple("SettingValue", ("name", "value", "enabled", "updated_at"))
+
+
+class SettingsRegistry:
+    """
+    All site settings as a dict keyed by name, loaded once per process and
+    served from memory. At most once per request it reads the "settings"
+    generation from settings_cache, and reloads if a commit in any worker
+    has changed a setting since.
+
+        settings_registry.get("enable_signups").enabled
+    """
+
+    def __init__(self):
+        self._settings = None
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        with self._lock:
+            self._settings = None
+
+    def all(self):
+        if "settings" not in g:
+            # Read before loading, so that a change committed meanwhile
+            # causes another reload rather than being missed
+            generation = settings_cache.generation("settings")
+            with self._lock:
+                if self._settings is None or generation != self._generation:
+                    self._settings = {
+                        setting.name: SettingValue(
+                            setting.name, setting.value, setting.enabled, setting.updated_at
+                        )
+                        for setting in Setting.query.all()
+                    }
+                    self._generation = generation
+                g.settings = self._settings
+        return g.settings
+
+    def get(self, name):
+        return self.all().get(name)
+
+
+settings_registry = SettingsRegistry()
+
+
 class Role(db.Model):
     __tablename__ = "roles"
 
@@ -334,22 +542,41 @@ class Asset(db.Model):
     """
     The asset table allows storage of assets, but crucially, allows
     asset variants to be defined. For example, for image assets one may
-    have HiDPI variants for @1x, @2x, etc; this would be stored as:
-
-        id | key       | variant | path
-        ---|-----------|---------|-------------------------
-         1 | srcf-logo | @1x     | srcf-logo-19a6c2c9.png
-         2 | foo-logo  | NULL    | foo-bar.jpeg
-         3 | srcf-logo | @2x     | srcf-logo-35d372d5.png
+    have HiDPI variants for @1x, @2x, etc, each in several formats; this
+    would be stored as:
+
+        id | key       | variant | content_type | path
+        ---|-----------|---------|--------------|-------------------
+         1 | srcf-logo | @1x     | image/png    | 19a6c2c9...e1.png
+         2 | foo-logo  | NULL    | NULL         | foo-bar.jpeg
+         3 | srcf-logo | @2x     | image/png    | 35d372d5...0b.png
+         4 | srcf-logo | @2x     | image/webp   | 8f0c2a71...4d.webp
         ...
 
+    Logo variants are named after the hash of their contents, so identical
+    files are stored once and may be shared by several rows. A NULL
+    content_type is treated as the fallback format that every browser gets.
     """
 
     __tablename__ = "assets"
     id = db.Column(db.Integer, primary_key=True)
     key = db.Column(db.String, unique=False, nullable=False)
     variant = db.Column(db.String, unique=False, nullable=True)
-    path = db.Column(db.String, unique=True, nullable=False)
+    content_type = db.Column(db.String, unique=False, nullable=True)
+    path = db.Column(db.String, unique=False, nullable=False, index=True)
+
+    # Serves lookups by key alone too, as key is the leading column
+    __table_args__ = (
+        db.Index("ix_assets_key_variant", "key", "variant", "content_type", unique=True),
+    )
+
+    @staticmethod
+    def unreferenced(paths):
+        """The given paths no asset refers to, whose files can be removed."""
+        referenced = {
+            path for (path,) in db.session.query(Asset.path).filter(Asset.path.in_(paths))
+        }
+        return [path for path in paths if path not in referenced]
 
     def __repr__(self):
         if self.variant is None:
@@ -357,6 +584,73 @@ class Asset(db.Model):
         return f"Asset({self.key!r}/{self.variant!r}: {self.path!r})"
 
 
+@event.listens_for(Group, "before_insert")
+@event.listens_for(Group, "before_update")
+@event.listens_for(Room, "before_insert")
+@event.listens_for(Room, "before_update")
+def update_search_vector(mapper, connection, target):
+    target.search_vector = search_vector(connection, target.name, target.description)
+
+
+USER_DIRECTORY_FIELDS = ("crsid", "full_name")
+
+
+# IDs of the groups whose directory card shows obj, if any.
+def directory_groups(obj):
+    if isinstance(obj, Group):
+        return {obj.id}
+    if isinstance(obj, (Room, Link)) and obj.group_id is not None:
+        return {obj.group_id}
+    if isinstance(obj, Asset) and obj.key.startswith("logo:"):
+        # Keys are "logo:<group id>:<unique suffix>", or "logo:<group id>"
+        return {obj.key.split(":")[1]}
+    if isinstance(obj, User):
+        # Owners are loaded with the directory's groups; only their names
+        # and crsids matter, so other changes don't load their groups
+        state = inspect(obj)
+        if state.deleted or any(state.attrs[name].history.has_changes() for name in USER_DIRECTORY_FIELDS):
+            return {group.id for group in obj.groups}
+    return set()
+
+
+@event.listens_for(SQLAlchemySession, "after_flush")
+def collect_directory_changes(session, flush_context):
+    changed = session.info.setdefault("directory_groups", set())
+    for obj in set(session.new) | set(session.dirty) | set(session.deleted):
+        changed |= directory_groups(obj)
+
+
+@event.listens_for(SQLAlchemySession, "after_commit")
+def invalidate_directory(session):
+    changed = session.info.pop("directory_groups", set())
+    if changed and directory_cache.backend is not None:
+        for group_id in changed:
+            directory_cache.bump(f"group:{ group_id }")
+        directory_cache.bump("directory")
+
+
+@event.listens_for(SQLAlchemySession, "after_rollback")
+def discard_directory_changes(session):
+    session.info.pop("directory_groups", None)
+
+
+@event.listens_for(SQLAlchemySession, "after_flush")
+def collect_settings_changes(session, flush_context):
+    if any(isinstance(obj, Setting) for obj in set(session.new) | set(session.dirty) | set(session.deleted)):
+        session.info["settings_changed"] = True
+
+
+@event.listens_for(SQLAlchemySession, "after_commit")
+def invalidate_settings(session):
+    if session.info.pop("settings_changed", False) and settings_cache.backend is not None:
+        settings_cache.bump("settings")
+
+
+@event.listens_for(SQLAlchemySession, "after_rollback")
+def discard_settings_changes(session):
+    session.info.pop("settings_changed", None)
+
+
 # @event.listens_for(Link, "after_insert")
 # @event.listens_for(Link, "after_delete")
 # def preserve_display_order(mapper, conn, target):
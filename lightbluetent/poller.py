@@ -0,0 +1,81 @@
+import random
+import threading
+from datetime import datetime
+from flask import current_app
+from lightbluetent.models import db, Room, MeetingStatus
+from lightbluetent.api import MeetingStatusService
+
+
+# Polls BBB's getMeetings and stores the state of every room in the
+# meeting_statuses table, so that page views never have to ask BBB. Run it
+# with `flask poll-meetings`, or set MEETING_POLLER_THREAD to run it in a
+# thread of the web process instead (only sensible with a single worker).
+
+
+# Poll once and update meeting_statuses. Returns False if BBB couldn't be
+# queried, in which case the table is left as it was.
+def poll_once():
+    index = MeetingStatusService.fetch_index()
+
+    if index is None:
+        return False
+
+    now = datetime.utcnow()
+    statuses = {status.room_id: status for status in MeetingStatus.query.all()}
+
+    for (room_id,) in db.session.query(Room.id):
+        status = statuses.get(room_id)
+        if status is None:
+            status = MeetingStatus(room_id=room_id)
+            db.session.add(status)
+
+        meeting = index.get(room_id)
+        if meeting is not None and meeting["running"]:
+            status.is_running = True
+            status.participant_count = meeting["participant_count"]
+            # BBB reports startTime in milliseconds since the epoch
+            status.start_time = datetime.utcfromtimestamp(meeting["start_time"] / 1000)
+        else:
+            status.is_running = False
+            status.participant_count = 0
+            status.start_time = None
+
+        status.polled_at = now
+
+    db.session.commit()
+    return True
+
+
+# Poll every MEETING_POLLER_INTERVAL seconds until stop is set. While BBB is
+# down the delay doubles on each failure, up to MEETING_POLLER_MAX_BACKOFF,
+# and every delay is jittered so that several pollers don't synchronise.
+def run_poller(app, stop=None):
+    stop = stop or threading.Event()
+    interval = app.config["MEETING_POLLER_INTERVAL"]
+    failures = 0
+
+    while not stop.is_set():
+        with app.app_context():
+            try:
+                ok = poll_once()
+            except Exception:
+                db.session.rollback()
+                current_app.logger.exception("Failed to poll meetings")
+                ok = False
+
+            if ok:
+                failures = 0
+            else:
+                failures += 1
+                current_app.logger.warning(f"Polling meetings failed { failures } time(s) in a row")
+
+        delay = min(interval * 2 ** failures, app.config["MEETING_POLLER_MAX_BACKOFF"])
+        delay += random.uniform(0, interval * app.config["MEETING_POLLER_JITTER"])
+        stop.wait(delay)
+
+
+def start_poller_thread(app):
+    stop = threading.Event()
+    thread = threading.Thread(target=run_poller, args=(app, stop), daemon=True)
+    thread.start()
+    return stop
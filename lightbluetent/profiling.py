@@ -0,0 +1,137 @@
+import time
+from flask import g, request, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from lightbluetent.cache import BACKENDS, BufferedCounters
+
+
+# Counts the SQL queries each request makes and the time spent in them, using
+# SQLAlchemy's engine events. Slow queries and requests are logged, totals are
+# kept per endpoint for the admin panel, and with QUERY_PROFILER_SERVER_TIMING
+# set, responses get a Server-Timing header (off by default, as it tells any
+# visitor how long the database took). Configured with the QUERY_PROFILER_*
+# settings; the totals are added up in each worker and written every
+# FLUSH_INTERVAL seconds to a cache backend ("memory" is per worker, "sqlite"
+# or "redis" covers every worker).
+# Usage:
+# query_profiler.init_app(app)
+# query_profiler.endpoint_stats()
+class QueryProfiler:
+
+    STATS = ("requests", "queries", "db_ms", "total_ms", "slow")
+
+    def __init__(self):
+        self.counters = None
+        self.app = None
+
+    def init_app(self, app):
+        config = app.config
+        backend = config["QUERY_PROFILER_BACKEND"]
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend for the query profiler: {backend!r}")
+
+        self.app = app
+        self.counters = BufferedCounters(
+            BACKENDS[backend](config["QUERY_PROFILER_URL"], 0),
+            config["QUERY_PROFILER_FLUSH_INTERVAL"],
+        )
+        self.slow_query_ms = config["QUERY_PROFILER_SLOW_QUERY_MS"]
+        self.slow_request_ms = config["QUERY_PROFILER_SLOW_REQUEST_MS"]
+        self.max_queries = config["QUERY_PROFILER_MAX_QUERIES"]
+        self.server_timing = config["QUERY_PROFILER_SERVER_TIMING"]
+
+        if not event.contains(Engine, "before_cursor_execute", self.before_cursor_execute):
+            event.listen(Engine, "before_cursor_execute", self.before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", self.after_cursor_execute)
+
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+
+    # A stack, as in SQLAlchemy's own profiling recipe, since a connection
+    # may execute a query while handling another one's events.
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = (time.perf_counter() - conn.info["query_start_time"].pop()) * 1000
+
+        if elapsed > self.slow_query_ms:
+            self.app.logger.warning(f"Slow query ({elapsed:.1f} ms): {statement}")
+
+        # Queries run outside a request (CLI commands, the poller) aren't counted
+        if has_app_context() and "query_count" in g:
+            g.query_count += 1
+            g.query_ms += elapsed
+
+    def start_request(self):
+        g.query_count = 0
+        g.query_ms = 0.0
+        g.request_start_time = time.perf_counter()
+
+    def finish_request(self, response):
+        if "request_start_time" not in g:
+            return response
+
+        total_ms = (time.perf_counter() - g.request_start_time) * 1000
+        queries, db_ms = g.query_count, g.query_ms
+
+        if self.server_timing:
+            response.headers.add(
+                "Server-Timing", f'db;dur={db_ms:.1f};desc="{queries} queries"'
+            )
+            response.headers.add("Server-Timing", f"app;dur={total_ms:.1f}")
+
+        slow = queries > self.max_queries or total_ms > self.slow_request_ms
+        if slow:
+            self.app.logger.warning(
+                f"Slow request {request.method} {request.path}: {total_ms:.1f} ms, "
+                f"{queries} queries taking {db_ms:.1f} ms"
+            )
+
+        # Requests that didn't match a route (404s) aren't worth aggregating
+        if request.endpoint is not None:
+            self._record(request.endpoint, {
+                "requests": 1,
+                "queries": queries,
+                "db_ms": round(db_ms),
+                "total_ms": round(total_ms),
+                "slow": int(slow),
+            })
+
+        return response
+
+    def _key(self, endpoint, stat):
+        return f"query_profiler:{endpoint}:{stat}"
+
+    def _record(self, endpoint, values):
+        try:
+            for stat, value in values.items():
+                if value:
+                    self.counters.incr(self._key(endpoint, stat), value)
+        except Exception:
+            # Losing a sample is better than failing the request
+            self.app.logger.exception("Failed to record request statistics")
+
+    # Totals and averages for each endpoint that has served a request, busiest
+    # (by total time) first.
+    def endpoint_stats(self):
+        endpoints = sorted({rule.endpoint for rule in self.app.url_map.iter_rules()})
+        stats = []
+
+        for endpoint in endpoints:
+            totals = {stat: self.counters.counter(self._key(endpoint, stat)) for stat in self.STATS}
+            requests = totals["requests"]
+            if not requests:
+                continue
+            stats.append(dict(
+                totals,
+                endpoint=endpoint,
+                avg_queries=totals["queries"] / requests,
+                avg_db_ms=totals["db_ms"] / requests,
+                avg_total_ms=totals["total_ms"] / requests,
+            ))
+
+        return sorted(stats, key=lambda s: s["total_ms"], reverse=True)
+
+
+query_profiler = QueryProfiler()
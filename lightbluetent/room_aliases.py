@@ -10,7 +10,7 @@ from flask import (
 )
 from lightbluetent.models import db, Group, Room, User, Role, RoleType
 from lightbluetent.users import auth_decorator
-from lightbluetent.api import Meeting
+from lightbluetent.api import Meeting, MeetingStatusService
 from lightbluetent.utils import get_form_values, fetch_lookup_data
 from flask_babel import _
 
@@ -45,7 +45,9 @@ def home(room_id=None, room_alias=None):
 
     # create a BBB meeting instance
     meeting = Meeting(room)
-    running = meeting.is_running()
+    statuses = MeetingStatusService(room_ids=[room.id])
+    running = statuses.is_running(room.id)
+    status_stale = statuses.stale
 
     values = {}
     errors = {}
@@ -79,6 +81,7 @@ def home(room_id=None, room_alias=None):
                     group=group,
                     user=user,
                     running=running,
+                    status_stale=status_stale,
                     errors=errors,
                     **values,
                     
@@ -90,6 +93,7 @@ def home(room_id=None, room_alias=None):
                     room=room,
                     user=user,
                     running=running,
+                    status_stale=status_stale,
                     errors=errors,
                     **values,
                 )
@@ -107,10 +111,9 @@ def home(room_id=None, room_alias=None):
         # if authenticated
         if crsid:
 
-            lookup_data = fetch_lookup_data(crsid)
-
             user = User.query.filter_by(crsid=crsid).first()
             if not user:
+                lookup_data = fetch_lookup_data(crsid) or {"name": None, "email": None}
                 # Create a visitor user if they're signed in with Raven but not actually in the DB
                 user = User(
                     email=lookup_data["email"],
@@ -123,7 +126,10 @@ def home(room_id=None, room_alias=None):
                 db.session.commit()
 
             if room.authentication.value in ("raven", "whitelist") and user:
-                raven_join_url = meeting.attendee_url(lookup_data["name"])
+                lookup_data = fetch_lookup_data(crsid, user)
+                # Fall back to the CRSid if Lookup doesn't know them
+                name = lookup_data["name"] if lookup_data else crsid
+                raven_join_url = meeting.attendee_url(name)
 
         if room.group:
             return render_template(
@@ -134,6 +140,7 @@ def home(room_id=None, room_alias=None):
                 group=group,
                 user=user,
                 running=running,
+                status_stale=status_stale,
                 errors=errors,
             )
         else:
@@ -144,6 +151,7 @@ def home(room_id=None, room_alias=None):
                 room=room,
                 user=user,
                 running=running,
+                status_stale=status_stale,
                 errors=errors,
             )
 
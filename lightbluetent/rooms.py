@@ -14,13 +14,11 @@ from lightbluetent.models import (
     Group,
     Room,
     Authentication,
-    Role,
     Recurrence,
     RecurrenceType,
     Session,
     Link,
 )
-from lightbluetent.config import RoleType
 from lightbluetent.users import auth_decorator
 from lightbluetent.api import Meeting
 from lightbluetent.utils import (
@@ -30,6 +28,8 @@ from lightbluetent.utils import (
     validate_room_alias,
     match_link,
     match_link_name,
+    parse_crsids,
+    resolve_crsids,
 )
 from flask_babel import _
 from datetime import datetime
@@ -71,8 +71,8 @@ def begin(room_id):
         )
         abort(500)
 
-    lookup_data = fetch_lookup_data(crsid)
-    full_name = lookup_data["name"]
+    lookup_data = fetch_lookup_data(crsid, user)
+    full_name = lookup_data["name"] if lookup_data else crsid
 
     meeting = Meeting(room)
     running = meeting.is_running()
@@ -151,8 +151,10 @@ def update(room_id, update_type):
         for key in ("alias_checked",):
             values[key] = bool(request.form.get(key, False))
 
-        if len(values["whitelist"]) > 7:
-            errors["whitelist"] = "Invalid CRSid."
+        # Any number of CRSids may be pasted in, separated by commas or whitespace
+        whitelist_crsids, invalid_crsids = parse_crsids(values["whitelist"])
+        if invalid_crsids:
+            errors["whitelist"] = f"Invalid CRSid(s): { ', '.join(invalid_crsids) }."
 
         if values["alias_checked"]:
             if values["alias"] == "":
@@ -165,31 +167,6 @@ def update(room_id, update_type):
             if room_with_alias and room_with_alias.id != room.id:
                 errors["alias"] = "That URL is already in use. Choose a different one."
 
-        if values["whitelist"] != "":
-            current_app.logger.info(
-                f"{ crsid } is whitelisting '{ values['whitelist'] }' for room '{ room.id }'..."
-            )
-
-            # Whitelist a new CRSid.
-            # We check if the user's already registered. If not, we create a
-            # visitor user containing only the whitelisted CRSid.
-
-            existing_user = User.query.filter_by(crsid=values["whitelist"]).first()
-            if existing_user:
-                room.whitelisted_users.append(existing_user)
-            else:
-                user = User(
-                    email=None,
-                    full_name=None,
-                    crsid=values["whitelist"],
-                    role=Role.query.filter_by(role=RoleType("visitor")).first(),
-                )
-                db.session.add(user)
-                current_app.logger.info(
-                    f"Registered visitor with CRSid { values['whitelist'] }"
-                )
-                room.whitelisted_users.append(user)
-
         for link in room.links:
             url_field = request.form.get(f"{link.id}-url", "").strip()
             name_field = request.form.get(f"{link.id}-name", "").strip()
@@ -220,6 +197,19 @@ def update(room_id, update_type):
                     current_app.logger.info(f"Deleted link: {link}")
 
         if not errors:
+            if whitelist_crsids:
+                current_app.logger.info(
+                    f"{ crsid } is whitelisting { len(whitelist_crsids) } CRSid(s) for room '{ room.id }'..."
+                )
+
+                # Whitelist the new CRSids, once the rest of the form is valid.
+                # Users that aren't registered yet are created as visitors, all
+                # at once, named from Lookup.
+                whitelisted, _missing = resolve_crsids(whitelist_crsids, create_missing=True)
+                for whitelisted_user in whitelisted:
+                    if whitelisted_user not in room.whitelisted_users:
+                        room.whitelisted_users.append(whitelisted_user)
+
             room.name = values["name"]
             room.authentication = Authentication(values["authentication"])
             room.description = values["description"]
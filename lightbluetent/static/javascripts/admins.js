@@ -116,4 +116,54 @@ $('#site-cover-submit').on('click', function () {
             window.location.reload();
         })
     });
-});
\ No newline at end of file
+});
+
+// render one entry of an admin listing
+function listingEntry(item) {
+    const entry = $(item.url ? '<a>' : '<div>')
+        .addClass('list-group-item flex-column align-items-start');
+    if (item.url) entry.attr('href', item.url).addClass('list-group-item-action');
+    const heading = $('<h5 class="mb-1 mr-1 text-truncate">').text(item.title + ' ');
+    heading.append($('<small class="text-muted">').text(item.subtitle));
+    entry.append(heading);
+    if (item.description) entry.append($('<p class="mb-1">').text(item.description));
+    entry.append($('<small>').text(item.detail));
+    return entry;
+}
+
+// fetch the next page of an admin listing; if reset, start again from the first page
+function loadListing(listing, reset) {
+    const items = listing.find('.lbt-admin-listing-items');
+    const more = listing.find('.lbt-admin-listing-more');
+    const params = { q: listing.find('.lbt-admin-listing-search').val() };
+    if (!reset && listing.data('next') !== undefined && listing.data('next') !== '') {
+        params.after = listing.data('next');
+    }
+    const request = $.getJSON(listing.data('path'), params).done(function (res) {
+        // ignore responses to searches that have since been replaced
+        if (listing.data('request') !== request) return;
+        if (reset) items.empty();
+        res.items.forEach(function (item) { items.append(listingEntry(item)) });
+        listing.data('next', res.next === null ? '' : res.next);
+        more.toggle(res.next !== null);
+    });
+    listing.data('request', request);
+}
+
+// admin listings load incrementally and search on the server as you type
+$('.lbt-admin-listing').each(function () {
+    const listing = $(this);
+    let timeout = null;
+    listing.find('.lbt-admin-listing-more').on('click', function () {
+        loadListing(listing, false);
+    });
+    listing.find('.lbt-admin-listing-search').on('input', function () {
+        clearTimeout(timeout);
+        timeout = setTimeout(function () { loadListing(listing, true) }, 250);
+    });
+    if (listing.data('next') === undefined) {
+        loadListing(listing, true);
+    } else {
+        listing.find('.lbt-admin-listing-more').toggle(listing.data('next') !== '');
+    }
+});
@@ -0,0 +1,56 @@
+// render one search result
+function searchResult(result) {
+    const entry = $('<a class="list-group-item list-group-item-action flex-column align-items-start">')
+        .attr('href', result.url);
+    const heading = $('<h5 class="mb-1 mr-1 text-truncate">').text(result.name + ' ');
+    if (result.group) heading.append($('<small class="text-muted">').text(result.group));
+    entry.append(heading);
+    if (result.description) entry.append($('<p class="mb-1">').text(result.description));
+    return entry;
+}
+
+// search groups and rooms on the server as you type, in place of the full directory
+const directorySearch = $('#directory-search');
+let searchTimeout = null;
+let searchRequest = null;
+directorySearch.find('input').on('input', function () {
+    const q = $(this).val().trim();
+    const results = $('#directory-search-results');
+    clearTimeout(searchTimeout);
+    if (!q) {
+        searchRequest = null;
+        results.empty();
+        $('#directory-groups, #directory-more').show();
+        return;
+    }
+    searchTimeout = setTimeout(function () {
+        const request = $.getJSON(directorySearch.data('path'), { q: q }).done(function (res) {
+            // ignore responses to searches that have since been replaced
+            if (request !== searchRequest) return;
+            results.empty();
+            res.groups.concat(res.rooms).forEach(function (result) {
+                results.append(searchResult(result));
+            });
+            if (!res.groups.length && !res.rooms.length) {
+                results.append($('<div class="list-group-item text-muted">').text('No results'));
+            }
+            $('#directory-groups, #directory-more').hide();
+        });
+        searchRequest = request;
+    }, 250);
+});
+
+// fetch the next page of the directory, in the same order as the first
+$('#directory-more').on('click', function () {
+    const more = $(this).prop('disabled', true);
+    $.getJSON(directorySearch.data('path'), { page: more.data('page'), seed: more.data('seed') }).done(function (res) {
+        $('#directory-groups').append(res.cards.join(''));
+        if (res.next_page) {
+            more.data('page', res.next_page).prop('disabled', false);
+        } else {
+            more.remove();
+        }
+    }).fail(function () {
+        more.prop('disabled', false);
+    });
+});
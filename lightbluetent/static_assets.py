@@ -0,0 +1,140 @@
+import os
+import io
+import gzip
+import json
+import fnmatch
+import hashlib
+import mimetypes
+from flask import current_app, request, send_from_directory
+
+
+# Fingerprinted, precompressed static files. `flask collect-static` copies the
+# static files matching STATIC_COLLECT_PATTERNS to static/dist under names
+# containing a hash of their contents, writes gzip (and, if the optional
+# brotli package is installed, brotli) copies next to them, and records the
+# names in static/dist/manifest.json. When USE_STATIC_MANIFEST is set,
+# url_for("static", ...) resolves through the manifest, and the files in dist
+# are served with the best encoding the client accepts and cached for good.
+# Usage:
+# static_assets.init_app(app)
+# static_assets.collect()
+class StaticAssets:
+
+    DIST = "dist"
+    MANIFEST = "manifest.json"
+    # Only text compresses well; images are already compressed
+    COMPRESSIBLE = {".css", ".js", ".svg", ".ico", ".json", ".txt"}
+    # Most preferred first
+    ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+    MAX_AGE = 365 * 24 * 60 * 60
+
+    def __init__(self):
+        self.manifest = {}
+
+    def init_app(self, app):
+        if not app.config["USE_STATIC_MANIFEST"]:
+            return
+
+        path = os.path.join(app.static_folder, self.DIST, self.MANIFEST)
+        try:
+            with open(path) as f:
+                self.manifest = json.load(f)
+        except FileNotFoundError:
+            app.logger.warning(f"No static manifest at '{ path }'; run `flask collect-static`")
+            return
+
+        app.url_defaults(self.hashed_url)
+        app.view_functions["static"] = self.send_static
+
+    def hashed_url(self, endpoint, values):
+        if endpoint == "static" and values.get("filename") in self.manifest:
+            values["filename"] = self.manifest[values["filename"]]
+
+    def send_static(self, filename):
+        if not filename.startswith(self.DIST + "/"):
+            return current_app.send_static_file(filename)
+
+        static_folder = current_app.static_folder
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+        for encoding, suffix in self.ENCODINGS:
+            if request.accept_encodings[encoding] and os.path.isfile(
+                os.path.join(static_folder, filename + suffix)
+            ):
+                response = send_from_directory(static_folder, filename + suffix, mimetype=mimetype)
+                response.headers["Content-Encoding"] = encoding
+                break
+        else:
+            response = send_from_directory(static_folder, filename, mimetype=mimetype)
+
+        response.vary.add("Accept-Encoding")
+        # The name changes whenever the contents do
+        response.cache_control.public = True
+        response.cache_control.max_age = self.MAX_AGE
+        response.cache_control.immutable = True
+        return response
+
+    # Write hashed copies of the static files to static/dist and a new
+    # manifest. Older copies are left in place, so pages rendered before a
+    # deploy keep working. Returns the manifest.
+    def collect(self):
+        static_folder = current_app.static_folder
+        dist = os.path.join(static_folder, self.DIST)
+        patterns = current_app.config["STATIC_COLLECT_PATTERNS"]
+
+        try:
+            # Optional dependency: without it only gzip copies are written
+            import brotli
+        except ImportError:
+            brotli = None
+
+        manifest = {}
+        for root, dirs, files in os.walk(static_folder):
+            if os.path.abspath(root) == os.path.abspath(static_folder):
+                dirs[:] = [d for d in dirs if d != self.DIST]
+
+            for name in files:
+                source = os.path.join(root, name)
+                relpath = os.path.relpath(source, static_folder).replace(os.sep, "/")
+                if not any(fnmatch.fnmatch(relpath, pattern) for pattern in patterns):
+                    continue
+
+                with open(source, "rb") as f:
+                    data = f.read()
+
+                stem, extension = os.path.splitext(relpath)
+                digest = hashlib.sha256(data).hexdigest()[:12]
+                hashed = f"{self.DIST}/{stem}.{digest}{extension}"
+                manifest[relpath] = hashed
+
+                target = os.path.join(static_folder, hashed)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                write_file(target, data)
+
+                if extension in self.COMPRESSIBLE:
+                    gzipped = io.BytesIO()
+                    # mtime=0 so that identical files compress identically
+                    with gzip.GzipFile(fileobj=gzipped, mode="wb", compresslevel=9, mtime=0) as f:
+                        f.write(data)
+                    write_compressed(target + ".gz", gzipped.getvalue(), data)
+                    if brotli is not None:
+                        write_compressed(target + ".br", brotli.compress(data, quality=11), data)
+
+        os.makedirs(dist, exist_ok=True)
+        write_file(os.path.join(dist, self.MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode())
+        self.manifest = manifest
+        return manifest
+
+
+def write_file(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+# Compressed copies are only worth keeping if they are smaller.
+def write_compressed(path, compressed, original):
+    if len(compressed) < len(original):
+        write_file(path, compressed)
+
+
+static_assets = StaticAssets()
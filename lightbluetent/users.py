@@ -8,7 +8,7 @@ from flask import (
     abort,
     current_app,
 )
-from lightbluetent.models import db, User, Group, Setting, Role, Room, Authentication
+from lightbluetent.models import db, User, Group, settings_registry, Role, Room, Authentication
 from lightbluetent.config import RoleType
 from lightbluetent.utils import (
     gen_unique_string,
@@ -255,10 +255,11 @@ def register():
 
     else:
 
-        signups = Setting.query.filter_by(name="enable_signups").first()
+        signups = settings_registry.get("enable_signups")
         if signups.enabled:
             # defaults
-            lookup_data = fetch_lookup_data(crsid)
+            # don't prefill any fields if Lookup failed
+            lookup_data = fetch_lookup_data(crsid) or {"name": "", "email": ""}
             values = {
                 "full_name": lookup_data["name"],
                 "email_address": lookup_data["email"],
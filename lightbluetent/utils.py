@@ -4,13 +4,18 @@ import re
 import sys
 import requests
 from jinja2 import is_undefined, Markup
-from flask import render_template, url_for, current_app
+from flask import render_template, url_for, current_app, g
 import traceback
-from lightbluetent.models import db, Asset, LinkType
+from lightbluetent.models import db, Asset, LinkType, User, Role, asset_cache
+from lightbluetent.config import RoleType
+from concurrent.futures import ThreadPoolExecutor
+from lightbluetent.cache import TTLCache
+from lightbluetent.metrics import metrics
 from PIL import Image
 import math
 import unicodedata
 import hashlib
+from datetime import datetime
 
 email_re = re.compile(r"^\S+@[a-zA-Z0-9._-]+\.[a-zA-Z0-9._-]+$")
 short_name_re = re.compile(r"^\w{1,20}$")
@@ -18,6 +23,8 @@ alias_re = re.compile(r"^[a-zA-Z0-9_-]{2,30}$")
 time_re = re.compile(r"\d{2}:\d{2}")
 date_re = re.compile(r"\d{4}-\d{2}-\d{2}")
 link_name_re = re.compile(r"^[a-zA-Z0-9 ()!?.,-]{0,40}$")
+crsid_re = re.compile(r"^[a-z][a-z0-9]{1,6}$")
+crsid_separator_re = re.compile(r"[\s,;]+")
 
 
 def match_time(time):
@@ -107,20 +114,25 @@ def get_form_values(request, keys):
     return values
 
 
+# Substrings identifying each kind of social link, checked in order.
+link_type_matches = (
+    (LinkType.FACEBOOK, ("facebook.", "fb.me", "fb.com")),
+    (LinkType.TWITTER, ("twitter.", "t.co")),
+    (LinkType.INSTAGRAM, ("instagram.",)),
+    (LinkType.YOUTUBE, ("youtube.", "youtu.be")),
+)
+
+
 # write an enum for this?
 def match_link(value):
-    if re.search(email_re, value):
+    if email_re.search(value):
         return LinkType.EMAIL
-    elif any(match in value.lower() for match in ["facebook.", "fb.me", "fb.com"]):
-        return LinkType.FACEBOOK
-    elif any(match in value.lower() for match in ["twitter.", "t.co", "fb.com"]):
-        return LinkType.TWITTER
-    elif "instagram." in value.lower():
-        return LinkType.INSTAGRAM
-    elif any(match in value.lower() for match in ["youtube.", "youtu.be"]):
-        return LinkType.YOUTUBE
-    else:
-        return LinkType.OTHER
+
+    value = value.lower()
+    for link_type, matches in link_type_matches:
+        if any(match in value for match in matches):
+            return link_type
+    return LinkType.OTHER
 
 
 def get_social_by_id(id, socials):
@@ -156,17 +168,64 @@ def server_error(e):
     return render_template("error.html", error=e, tb=tb), 500
 
 
-def fetch_lookup_data(crsid):
-    url = f"https://www.lookup.cam.ac.uk/api/v1/person/crsid/{crsid}"
-    res = requests.get(
-        url,
-        params={"fetch": "email,departingEmail", "format": "json"},
-        timeout=(0.5, 10),
-    )
+# Lookup API responses keyed by crsid. Unknown crsids (404s) are negatively
+# cached; transient failures aren't cached at all.
+lookup_cache = TTLCache("lookup", "LOOKUP_CACHE")
+
+
+class LookupAPIError(Exception):
+    pass
+
+
+# Returns {"name": ..., "email": ...} for crsid, or None if it couldn't be
+# found. If user is given and already has a name we don't ask Lookup at all;
+# otherwise repeat visitors are answered from lookup_cache. Nothing is written
+# to the database, as this is called while handling GET requests.
+def fetch_lookup_data(crsid, user=None):
+    if user is not None and user.full_name:
+        return {"name": user.full_name, "email": user.email}
+
+    try:
+        return lookup_cache.get_or_load(crsid.lower(), lambda: request_lookup_data(crsid))
+    except LookupAPIError as e:
+        current_app.logger.error(f"Lookup failed for { crsid }: { e }")
+        return None
+
+
+# Fetch lookup data for many crsids at once, LOOKUP_CONCURRENCY at a time.
+# Returns {crsid: lookup_data}, where lookup_data is None for failures.
+def fetch_lookup_data_many(crsids):
+    app = current_app._get_current_object()
+
+    def fetch(crsid):
+        with app.app_context():
+            return fetch_lookup_data(crsid)
+
+    with ThreadPoolExecutor(max_workers=app.config["LOOKUP_CONCURRENCY"]) as executor:
+        return dict(zip(crsids, executor.map(fetch, crsids)))
+
+
+# Query the Lookup API. Returns None if there is no such person, and raises
+# LookupAPIError if the API couldn't be queried, so that isn't cached.
+def request_lookup_data(crsid):
+    url = f"{current_app.config['LOOKUP_API_URL']}person/crsid/{crsid}"
+    try:
+        with metrics.timer("lbt_lookup_request_duration_seconds"):
+            res = requests.get(
+                url,
+                params={"fetch": "email,departingEmail", "format": "json"},
+                timeout=(0.5, 10),
+            )
+    except requests.exceptions.RequestException as e:
+        raise LookupAPIError(e)
+
     if res.status_code == 200:
         # request successful
         response = res.json()["result"]["person"]
 
+        if response is None:
+            return None
+
         email = None
 
         if len(response["attributes"]) > 0:
@@ -174,12 +233,14 @@ def fetch_lookup_data(crsid):
 
         return {"name": response["visibleName"], "email": email}
     elif res.status_code == 401:
-        # not authorized, we're outside of the cudn
-        # feed us dummy data
-        return {"email": "mug99@cam.ac.uk", "name": "Testing Software"}
+        # not authorized, we're outside of the cudn. A failure like any other,
+        # so that no made-up name is cached or saved onto a user
+        raise LookupAPIError("Not authorised; is this host outside the CUDN?")
+    elif res.status_code == 404:
+        return None
     else:
         # something bad happened, don't prefill any fields
-        return None
+        raise LookupAPIError(f"Error { res.status_code } from server: { res.text }")
 
 
 def get_form_values(request, keys):
@@ -189,6 +250,52 @@ def get_form_values(request, keys):
     return values
 
 
+# Split a pasted list or CSV of crsids. Returns (crsids, invalid), both
+# lowercased, deduplicated and in the order given.
+def parse_crsids(text):
+    crsids = []
+    invalid = []
+    for crsid in crsid_separator_re.split(text.lower()):
+        if not crsid or crsid in crsids or crsid in invalid:
+            continue
+        if crsid_re.match(crsid):
+            crsids.append(crsid)
+        else:
+            invalid.append(crsid)
+    return crsids, invalid
+
+
+# Resolve crsids to users with a single IN query. Returns (users, missing).
+# If create_missing is set, visitors are created for unknown crsids in one
+# bulk insert, named from Lookup, and there are never any missing.
+def resolve_crsids(crsids, create_missing=False):
+    users = {user.crsid: user for user in User.query.filter(User.crsid.in_(crsids))}
+    missing = [crsid for crsid in crsids if crsid not in users]
+
+    if missing and create_missing:
+        lookup_data = fetch_lookup_data_many(missing)
+        visitor = Role.query.filter_by(role=RoleType.VISITOR).first()
+        db.session.execute(
+            User.__table__.insert(),
+            [
+                {
+                    "crsid": crsid,
+                    "email": None,
+                    "full_name": lookup_data[crsid]["name"] if lookup_data[crsid] else None,
+                    "role_id": visitor.id,
+                    "time_created": datetime.utcnow(),
+                }
+                for crsid in missing
+            ],
+        )
+        current_app.logger.info(f"Registered visitors with CRSids { ', '.join(missing) }")
+        for user in User.query.filter(User.crsid.in_(missing)):
+            users[user.crsid] = user
+        missing = []
+
+    return [users[crsid] for crsid in crsids if crsid in users], missing
+
+
 def resize_image(image, max_dimensions, *, preserve_aspect=True, grow=False, fill_canvas=(0,0,0,0), fill_composite=True, attachment=(0.5,0.5), hidpi=[1,2]):
     """
     Resize an image using pillow 'smartly'
@@ -214,79 +321,104 @@ def resize_image(image, max_dimensions, *, preserve_aspect=True, grow=False, fil
       hidpi:
         a list of hidpi resolutions to output
 
-    TODO: possible optimisation using reduce here?
+    The largest resolution is scaled straight from the source and each smaller
+    one from the one above it, and the image is only placed on its canvas
+    once scaled, so the source is resampled once and no canvas is allocated
+    at its full size.
     """
 
+    max_lwidth, max_lheight = max_dimensions
+
     if not isinstance(image, Image.Image):
         image = Image.open(image)
+    # JPEGs not yet decoded can be decoded straight at a fraction of their size
+    image.draft("RGB", (max_lwidth * max(hidpi), max_lheight * max(hidpi)))
     image = image.convert("RGBA")
 
     orig_width, orig_height = image.size
-    max_lwidth, max_lheight = max_dimensions
 
     ratio_x = max_lwidth / orig_width
     ratio_y = max_lheight / orig_height
     if not grow:
         ratio_x = min(1, ratio_x)
         ratio_y = min(1, ratio_y)
+    if preserve_aspect:
+        ratio_x = ratio_y = min(ratio_x, ratio_y)
 
     new_lwidth = round(ratio_x * orig_width)
     new_lheight = round(ratio_y * orig_height)
 
-    if preserve_aspect:
-        if ratio_x < ratio_y:
-            new_lwidth = max_lwidth
-        elif ratio_y < ratio_x:
-            new_lheight = max_lheight
-        else:
-            new_lwidth = max_lwidth
-            new_lheight = max_lheight
-        ratio_x = ratio_y = min(ratio_x, ratio_y)
+    # Without growing, no resolution may be larger than the source would be on
+    # its canvas, which is this size
+    source_width, source_height = orig_width, orig_height
 
     if fill_canvas is not False:
-        canv_width = math.ceil(max_lwidth / ratio_x)
-        canv_height = math.ceil(max_lheight / ratio_y)
-        att_rx, att_ry = attachment
-        att_x = math.floor(att_rx * (canv_width - orig_width))
-        att_y = math.floor(att_ry * (canv_height - orig_height))
-
-        canvas_size = canv_width, canv_height
-        canvas = Image.new("RGBA", canvas_size, fill_canvas)
-        if fill_composite:
-            canvas2 = Image.new("RGBA", canvas_size, (0,0,0,0))
-            canvas2.paste(image, (att_x, att_y))
-            image = Image.alpha_composite(canvas, canvas2)
-        else:
-            canvas.paste(image, (att_x, att_y))
-            image = canvas
-
-        orig_width, orig_height = image.size
+        source_width = math.ceil(max_lwidth / ratio_x)
+        source_height = math.ceil(max_lheight / ratio_y)
         new_lwidth = max_lwidth
         new_lheight = max_lheight
 
-    for px_density in hidpi:
-        out_width = new_lwidth*px_density
-        out_height = new_lheight*px_density
-        if not grow:
-            print((out_width, out_height), (orig_width, orig_height))
-        if not grow and (out_width > orig_width or out_height > orig_height):
+    densities = [
+        px_density for px_density in hidpi
+        if grow or (new_lwidth * px_density <= source_width and new_lheight * px_density <= source_height)
+    ]
+
+    outputs = {}
+    scaled = image
+
+    for px_density in sorted(densities, reverse=True):
+        out_size = out_width, out_height = new_lwidth * px_density, new_lheight * px_density
+
+        if fill_canvas is False:
+            scaled = scaled.resize(out_size, reducing_gap=3.0)
+            outputs[px_density] = scaled
             continue
-        yield px_density, image.resize((out_width, out_height))
+
+        scaled_size = (
+            max(1, round(orig_width * out_width / source_width)),
+            max(1, round(orig_height * out_height / source_height)),
+        )
+        scaled = scaled.resize(scaled_size, reducing_gap=3.0)
+
+        att_rx, att_ry = attachment
+        position = (
+            math.floor(att_rx * (out_width - scaled_size[0])),
+            math.floor(att_ry * (out_height - scaled_size[1])),
+        )
+        canvas = Image.new("RGBA", out_size, fill_canvas)
+        if fill_composite:
+            layer = Image.new("RGBA", out_size, (0,0,0,0))
+            layer.paste(scaled, position)
+            canvas = Image.alpha_composite(canvas, layer)
+        else:
+            canvas.paste(scaled, position)
+        outputs[px_density] = canvas
+
+    for px_density in densities:
+        yield px_density, outputs[px_density]
 
 
 class responsive_image:
     resp_re = re.compile(r'^@([0-9]+(.[0-9]+)?)x$')
-    def __init__(self, key):
+    # Alternative formats offered ahead of the fallback, most preferred first
+    source_types = ("image/avif", "image/webp")
+    def __init__(self, key, assets=None):
+        if assets is None:
+            assets = self.fetch_assets([key])[key]
         main_res = 0
         main = None
         variants = {}
-        for variant in Asset.query.filter_by(key=key):
-            path = os.path.join(current_app.config["IMAGES_DIR_FROM_STATIC"], variant.path)
+        sources = {}
+        for variant, subpath, content_type in assets:
+            path = os.path.join(current_app.config["IMAGES_DIR_FROM_STATIC"], subpath)
             path = url_for('static', filename=path)
-            if variant.variant is None:
+            if content_type in self.source_types:
+                if variant is not None and (m := self.resp_re.match(variant)) is not None:
+                    sources.setdefault(content_type, {})[m.group(1)] = path
+            elif variant is None:
                 main = path
                 main_res = float('inf')
-            elif (m := self.resp_re.match(variant.variant)) is not None:
+            elif (m := self.resp_re.match(variant)) is not None:
                 v = m.group(1)
                 vf = float(v)
                 if (vf := float(v)) > main_res:
@@ -298,6 +430,7 @@ class responsive_image:
                 pass
         self.main = main
         self.variants = variants
+        self.sources = sources
 
     def img_attr(self, raw=False):
         srcset = []
@@ -311,6 +444,19 @@ class responsive_image:
             attrs = Markup(attrs)
         return attrs
 
+    # <source> elements for a <picture> around the <img>, so that browsers
+    # pick the smallest format they support.
+    def sources_html(self, raw=False):
+        html = []
+        for content_type in self.source_types:
+            if content_type in self.sources:
+                srcset = ", ".join(f"{url} {res}x" for res, url in self.sources[content_type].items())
+                html.append(f"<source type=\"{content_type}\" srcset=\"{srcset}\">")
+        html = "".join(html)
+        if not raw:
+            html = Markup(html)
+        return html
+
     def css(self, raw=False, prop='background-image'):
         # not too widely supported, would be better to provide
         # tooling for generating appropriate media queries
@@ -327,14 +473,49 @@ class responsive_image:
             props = Markup(props)
         return props
 
+    # Returns {key: [(variant, path, content_type), ...]} for the given keys,
+    # from the asset cache where possible and otherwise with a single IN query.
+    @staticmethod
+    def fetch_assets(keys):
+        def load(missing):
+            assets = {key: [] for key in missing}
+            for asset in Asset.query.filter(Asset.key.in_(missing)):
+                assets[asset.key].append((asset.variant, asset.path, asset.content_type))
+            return assets
+
+        return asset_cache.get_many_or_load(list(keys), load)
+
+    # Resolve every key a page is going to render up front, so the filters
+    # below don't each need a query. Instances are kept for the request.
+    @classmethod
+    def prefetch(cls, keys):
+        resolved = g.setdefault("responsive_images", {})
+        keys = {key for key in keys if key not in resolved}
+        if keys:
+            for key, assets in cls.fetch_assets(keys).items():
+                resolved[key] = cls(key, assets)
+
+    @classmethod
+    def get(cls, key):
+        cls.prefetch([key])
+        return g.responsive_images[key]
+
+    @staticmethod
+    def invalidate(key):
+        asset_cache.delete(key)
+        g.get("responsive_images", {}).pop(key, None)
+
     @classmethod
     def initialise_filters(cls, app):
         @app.template_filter('responsive_image.img')
         def responsive_image_filter_img(key):
-            return cls(key).img_attr()
+            return cls.get(key).img_attr()
+        @app.template_filter('responsive_image.sources')
+        def responsive_image_filter_sources(key):
+            return cls.get(key).sources_html()
         @app.template_filter('responsive_image.css')
         def responsive_image_filter_css(key, prop='background-image'):
-            return cls(key).css(prop)
+            return cls.get(key).css(prop)
         @app.template_filter('responsive_image.main')
         def responsive_image_filter_main(key):
-            return cls(key).main
+            return cls.get(key).main
@@ -0,0 +1,32 @@
+"""Add meeting_statuses table for the meeting poller
+
+Revision ID: b1e5f3a9c2d4
+Revises: 42c343872516
+Create Date: 2026-10-18 10:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b1e5f3a9c2d4'
+down_revision = '42c343872516'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('meeting_statuses',
+    sa.Column('room_id', sa.String(length=28), nullable=False),
+    sa.Column('is_running', sa.Boolean(), nullable=False),
+    sa.Column('participant_count', sa.Integer(), nullable=False),
+    sa.Column('start_time', sa.DateTime(), nullable=True),
+    sa.Column('polled_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['room_id'], ['rooms.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('room_id')
+    )
+
+
+def downgrade():
+    op.drop_table('meeting_statuses')
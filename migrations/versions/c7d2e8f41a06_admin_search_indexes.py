@@ -0,0 +1,40 @@
+"""Add trigram indexes for searching the admin panel listings
+
+Revision ID: c7d2e8f41a06
+Revises: b1e5f3a9c2d4
+Create Date: 2026-10-18 14:37:02.551873
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d2e8f41a06'
+down_revision = 'b1e5f3a9c2d4'
+branch_labels = None
+depends_on = None
+
+
+# The admin panel searches these columns with ILIKE '%...%', which only
+# trigram (pg_trgm) GIN indexes can serve.
+TRIGRAM_INDEXES = [
+    ('ix_groups_name_trgm', 'groups', 'name'),
+    ('ix_groups_id_trgm', 'groups', 'id'),
+    ('ix_rooms_name_trgm', 'rooms', 'name'),
+    ('ix_rooms_id_trgm', 'rooms', 'id'),
+    ('ix_rooms_alias_trgm', 'rooms', 'alias'),
+    ('ix_users_crsid_trgm', 'users', 'crsid'),
+    ('ix_users_full_name_trgm', 'users', 'full_name'),
+]
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, column in TRIGRAM_INDEXES:
+        op.create_index(name, table, [column], unique=False,
+                        postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'})
+
+
+def downgrade():
+    for name, table, column in reversed(TRIGRAM_INDEXES):
+        op.drop_index(name, table_name=table)
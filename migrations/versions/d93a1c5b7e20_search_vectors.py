@@ -0,0 +1,39 @@
+"""Add full-text search vectors to groups and rooms
+
+Revision ID: d93a1c5b7e20
+Revises: c7d2e8f41a06
+Create Date: 2026-10-18 16:05:48.120394
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'd93a1c5b7e20'
+down_revision = 'c7d2e8f41a06'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('groups', sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+    op.add_column('rooms', sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+    op.create_index('ix_groups_search_vector', 'groups', ['search_vector'], unique=False, postgresql_using='gin')
+    op.create_index('ix_rooms_search_vector', 'rooms', ['search_vector'], unique=False, postgresql_using='gin')
+
+    # Backfill; from now on the models keep these up to date
+    for table in ('groups', 'rooms'):
+        op.execute(
+            f"UPDATE {table} SET search_vector = "
+            "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+            "setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+        )
+
+
+def downgrade():
+    op.drop_index('ix_rooms_search_vector', table_name='rooms')
+    op.drop_index('ix_groups_search_vector', table_name='groups')
+    op.drop_column('rooms', 'search_vector')
+    op.drop_column('groups', 'search_vector')
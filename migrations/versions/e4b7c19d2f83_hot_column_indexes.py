@@ -0,0 +1,43 @@
+"""Index the columns that views look rows up by
+
+Revision ID: e4b7c19d2f83
+Revises: d93a1c5b7e20
+Create Date: 2026-10-18 16:02:41.318207
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b7c19d2f83'
+down_revision = 'd93a1c5b7e20'
+branch_labels = None
+depends_on = None
+
+
+# (name, table, columns, unique). rooms.alias is already covered by its unique
+# constraint, and the trigram indexes on users.crsid can't serve equality.
+INDEXES = [
+    ('ix_users_crsid', 'users', ['crsid'], True),
+    ('ix_settings_name', 'settings', ['name'], True),
+    ('ix_assets_key_variant', 'assets', ['key', 'variant'], True),
+    ('ix_sessions_room_id', 'sessions', ['room_id'], False),
+    ('ix_rooms_group_id', 'rooms', ['group_id'], False),
+    ('ix_rooms_user_id', 'rooms', ['user_id'], False),
+    ('ix_users_groups_group_id', 'users_groups', ['group_id'], False),
+    ('ix_whitelist_user_id', 'whitelist', ['user_id'], False),
+    ('ix_whitelist_group_id', 'whitelist', ['group_id'], False),
+    ('ix_whitelist_room_id', 'whitelist', ['room_id'], False),
+    ('ix_links_group_id_display_order', 'links', ['group_id', 'display_order'], False),
+    ('ix_links_room_id_display_order', 'links', ['room_id', 'display_order'], False),
+]
+
+
+def upgrade():
+    for name, table, columns, unique in INDEXES:
+        op.create_index(name, table, columns, unique=unique)
+
+
+def downgrade():
+    for name, table, columns, unique in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -1,4 +1,5 @@
 #!/bin/bash -e
+/home/mw781/.local/bin/pipenv run flask collect-static
 /home/mw781/.local/bin/pipenv run gunicorn -w 2  \
     -b unix:/public/home/mw781/web.sock \
     --log-level=info \
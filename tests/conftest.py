@@ -1,7 +1,12 @@
+import time
 import pytest
+from flask.testing import FlaskClient
 
 from lightbluetent.app import create_app
-from lightbluetent.models import db
+from lightbluetent.models import db, Role, Permission, Setting, User, Group, Room
+from lightbluetent.config import RoleType
+from lightbluetent import api
+from stub_servers import StubBBB, StubLookup
 
 
 @pytest.fixture
@@ -17,4 +22,118 @@ def database(app):
         db.drop_all()
         db.create_all()
 
-    yield db
\ No newline at end of file
+    yield db
+
+
+# Talisman redirects plain HTTP to HTTPS, and session cookies are secure.
+class HTTPSClient(FlaskClient):
+
+    def open(self, *args, **kwargs):
+        kwargs.setdefault("base_url", "https://localhost")
+        return super().open(*args, **kwargs)
+
+
+@pytest.fixture
+def client(app):
+    app.test_client_class = HTTPSClient
+    return app.test_client()
+
+
+# The settings, roles and permissions that create_app seeds into an existing
+# database; the database fixture creates the tables after it has run.
+@pytest.fixture
+def seeded(app, database):
+    with app.app_context():
+        for setting in app.config["SITE_SETTINGS"]:
+            db.session.add(
+                Setting(name=setting["name"], enabled=setting.get("enabled"), value=setting.get("value"))
+            )
+
+        permissions = {}
+        for role_info in app.config["ROLES_INFO"]:
+            role = Role(role=role_info["role"], description=role_info["description"])
+            for name in role_info["permissions"]:
+                if name not in permissions:
+                    permissions[name] = Permission(name=name)
+                role.permissions.append(permissions[name])
+            db.session.add(role)
+
+        db.session.commit()
+
+    yield db
+
+
+# Creates users; call inside an app context.
+@pytest.fixture
+def add_user(seeded):
+    def add_user(crsid, role_type=RoleType.USER):
+        role = Role.query.filter_by(role=role_type).one()
+        user = User(crsid=crsid, email=f"{crsid}@cam.ac.uk", full_name=crsid.upper(), role=role)
+        db.session.add(user)
+        db.session.commit()
+        return user
+
+    return add_user
+
+
+# Creates a group with the given number of rooms; call inside an app context.
+@pytest.fixture
+def add_group(database):
+    def add_group(group_id, name=None, description=None, rooms=0):
+        group = Group(id=group_id, name=name or group_id.title(), description=description)
+        for i in range(rooms):
+            group.rooms.append(Room(
+                id=f"{group_id}-{i:03d}",
+                name=f"{group.name} room {i}",
+                attendee_pw=f"{group_id}-{i}-attendee",
+                moderator_pw=f"{group_id}-{i}-moderator",
+            ))
+        db.session.add(group)
+        db.session.commit()
+        return group
+
+    return add_group
+
+
+@pytest.fixture
+def admin(app, add_user):
+    with app.app_context():
+        add_user("adm123", RoleType.ADMINISTRATOR)
+    return "adm123"
+
+
+# Log the client in as crsid, as if Raven had authenticated them.
+@pytest.fixture
+def login(client):
+    def login(crsid):
+        with client.session_transaction(base_url="https://localhost") as session:
+            session["_ucam_webauth"] = {
+                "state": {
+                    "principal": crsid,
+                    "ptags": [],
+                    "issue": int(time.time()),
+                    "life": 60 * 60,
+                    "last": time.time(),
+                }
+            }
+
+    return login
+
+
+# A stub BBB server the app is pointed at; see stub_servers.py.
+@pytest.fixture
+def bbb(monkeypatch):
+    with StubBBB() as stub:
+        monkeypatch.setenv("BIGBLUEBUTTON_URL", stub.url + "bigbluebutton/api/")
+        monkeypatch.setenv("BIGBLUEBUTTON_SECRET", "secret")
+        # Every test starts without pooled connections
+        monkeypatch.setattr(api, "_http_session", None)
+        yield stub
+
+
+# A stub Lookup API the app is pointed at; see stub_servers.py.
+@pytest.fixture
+def lookup(app):
+    with StubLookup() as stub:
+        app.config["LOOKUP_API_URL"] = stub.url + "api/v1/"
+        yield stub
@@ -0,0 +1,499 @@
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urljoin
+
+import requests
+from werkzeug.serving import make_server
+
+from lightbluetent.app import create_app
+from lightbluetent.config import RoleType
+from lightbluetent.models import db, Authentication, Group, Role, Room, User
+from stub_servers import StubBBB, StubLookup, percentiles
+
+
+# Load testing: serves the app over HTTP from a local threaded server, pointed
+# at stub BBB and Lookup servers (see stub_servers.py), and drives a scripted
+# scenario at it with many concurrent virtual users, in the manner of locust.
+# The report gives throughput and latency percentiles for each kind of
+# request, and can be saved as JSON and compared with the report of another
+# commit. Like the tests, it recreates the tables of the database that
+# SQLALCHEMY_URI points at.
+# Usage:
+# SQLALCHEMY_URI=sqlite:////tmp/lbt-load.db PYTHONPATH=. python tests/loadtest.py directory_storm --output before.json
+# (check out another commit)
+# SQLALCHEMY_URI=sqlite:////tmp/lbt-load.db PYTHONPATH=. python tests/loadtest.py directory_storm --compare before.json
+
+
+# Marks a method of a VirtualUser as one of its tasks, picked with the given
+# relative weight.
+def task(weight=1):
+    def decorator(f):
+        f.task_weight = weight
+        return f
+
+    return decorator
+
+
+# One simulated visitor. Each iteration runs one of its tasks, picked by
+# weight, and then waits for a random time within wait_time seconds. setup()
+# creates the data the scenario needs before any user starts.
+class VirtualUser:
+
+    description = ""
+    users = 10
+    iterations = 10
+    spawn_rate = 10
+    wait_time = (0.0, 0.0)
+
+    def __init__(self, client, index, seed=0):
+        self.client = client
+        self.index = index
+        self.random = random.Random(f"{seed}-{index}")
+        self.tasks = [
+            getattr(self, name) for name in dir(type(self))
+            if hasattr(getattr(type(self), name), "task_weight")
+        ]
+        self.weights = [task.task_weight for task in self.tasks]
+
+    # Called in an app context.
+    @classmethod
+    def setup(cls, bbb, lookup, users):
+        pass
+
+    def on_start(self):
+        pass
+
+    def run(self, iterations=None, deadline=None, wait_time=None):
+        low, high = self.wait_time if wait_time is None else wait_time
+        self.on_start()
+        done = 0
+        while (iterations is None or done < iterations) and (deadline is None or time.monotonic() < deadline):
+            self.random.choices(self.tasks, self.weights)[0]()
+            done += 1
+            time.sleep(self.random.uniform(low, high))
+
+
+# The load generator talks plain HTTP to the app, as a TLS-terminating proxy
+# would, so Secure cookies must still be sent back.
+class BehindProxyCookiePolicy(DefaultCookiePolicy):
+
+    def return_ok_secure(self, cookie, request):
+        return True
+
+
+# A requests session for one virtual user that records every request it
+# makes in the run's Stats, under a name grouping similar requests.
+class LoadClient:
+
+    def __init__(self, app, base_url, stats):
+        self.app = app
+        self.base_url = base_url
+        self.stats = stats
+        self.session = requests.Session()
+        self.session.cookies.set_policy(BehindProxyCookiePolicy())
+        self.session.headers["X-Forwarded-Proto"] = "https"
+
+    # Logs in as crsid, as if Raven had authenticated them.
+    def login(self, crsid):
+        state = {
+            "_ucam_webauth": {
+                "state": {
+                    "principal": crsid,
+                    "ptags": [],
+                    "issue": int(time.time()),
+                    "life": 60 * 60,
+                    "last": time.time(),
+                }
+            }
+        }
+        cookie = self.app.session_interface.get_signing_serializer(self.app).dumps(state)
+        self.session.cookies.set(self.app.session_cookie_name, cookie)
+
+    def request(self, method, path, name, expect=(200,), **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.session.request(
+                method, urljoin(self.base_url, path), allow_redirects=False, **kwargs
+            )
+            ok = response.status_code in expect
+        except requests.RequestException:
+            response, ok = None, False
+        self.stats.record(name, time.perf_counter() - start, ok)
+        return response
+
+    def get(self, path, name, **kwargs):
+        return self.request("GET", path, name, **kwargs)
+
+    def post(self, path, name, **kwargs):
+        return self.request("POST", path, name, **kwargs)
+
+
+class Stats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = {}
+        self.failures = {}
+
+    def record(self, name, seconds, ok):
+        with self.lock:
+            self.durations.setdefault(name, []).append(seconds)
+            self.failures[name] = self.failures.get(name, 0) + (not ok)
+
+    # Throughput, in requests per second, and latency percentiles, in ms,
+    # for each name and in total.
+    def report(self, elapsed):
+        def summary(durations, failures):
+            points = percentiles(durations, (50, 90, 99, 100))
+            return {
+                "requests": len(durations),
+                "failures": failures,
+                "rps": round(len(durations) / elapsed, 1),
+                "p50": round(points[50], 1),
+                "p90": round(points[90], 1),
+                "p99": round(points[99], 1),
+                "max": round(points[100], 1),
+            }
+
+        with self.lock:
+            requests = {
+                name: summary(durations, self.failures[name])
+                for name, durations in sorted(self.durations.items())
+            }
+            everything = [d for durations in self.durations.values() for d in durations]
+            total = summary(everything, sum(self.failures.values())) if everything else None
+        return {"elapsed": round(elapsed, 2), "requests": requests, "total": total}
+
+
+# The app on a local threaded HTTP server, like a single gunicorn worker with
+# a thread per connection.
+class LoadTestServer:
+
+    def __init__(self, app):
+        self.server = make_server("127.0.0.1", 0, app, threaded=True)
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_port}/"
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# Sets up the scenario, then starts users virtual users, spawn_rate a second,
+# each running iterations tasks or until duration seconds have passed.
+def run(app, scenario, bbb, lookup, users=None, iterations=None, duration=None,
+        spawn_rate=None, wait_time=None, seed=0):
+    users = users or scenario.users
+    spawn_rate = spawn_rate or scenario.spawn_rate
+    if iterations is None and duration is None:
+        iterations = scenario.iterations
+
+    with app.app_context():
+        scenario.setup(bbb, lookup, users)
+
+    stats = Stats()
+    with LoadTestServer(app) as server:
+        start = time.perf_counter()
+        deadline = time.monotonic() + duration if duration else None
+        threads = []
+        for index in range(users):
+            user = scenario(LoadClient(app, server.url, stats), index, seed)
+            thread = threading.Thread(
+                target=user.run, args=(iterations, deadline, wait_time), daemon=True
+            )
+            thread.start()
+            threads.append(thread)
+            time.sleep(1 / spawn_rate)
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+    return stats.report(elapsed)
+
+
+def add_group(group_id, name, description, rooms, owners=()):
+    group = Group(id=group_id, name=name, description=description)
+    group.owners.extend(owners)
+    for i in range(rooms):
+        group.rooms.append(Room(
+            id=f"{group_id}-{i:03d}",
+            name=f"{name} room {i}",
+            attendee_pw=f"{group_id}-{i}-attendee",
+            moderator_pw=f"{group_id}-{i}-moderator",
+            authentication=Authentication.PUBLIC,
+        ))
+    db.session.add(group)
+    return group
+
+
+WORDS = (
+    "chess", "rowing", "debating", "jazz", "film", "robotics", "poetry",
+    "climbing", "astronomy", "choir", "hiking", "baking", "drama", "coding",
+)
+
+
+class DirectoryStorm(VirtualUser):
+
+    description = "Freshers arriving when a fair opens: the directory, searches and stall pages"
+    users = 100
+    iterations = 20
+    spawn_rate = 20
+    wait_time = (0.1, 0.5)
+
+    GROUPS = 300
+    ROOMS_PER_GROUP = 2
+
+    @classmethod
+    def setup(cls, bbb, lookup, users):
+        for i in range(cls.GROUPS):
+            word = WORDS[i % len(WORDS)]
+            group = add_group(
+                f"soc{i:04d}",
+                f"{word.title()} Society {i}",
+                f"The university's {i}th society for {word} and {WORDS[(i * 7) % len(WORDS)]}.",
+                cls.ROOMS_PER_GROUP,
+            )
+            # A third of the stalls are live
+            if i % 3 == 0:
+                bbb.start_meeting(group.rooms[0].id, group.rooms[0].name)
+        db.session.commit()
+
+    @task(6)
+    def directory(self):
+        self.client.get("/", "GET /")
+
+    @task(2)
+    def search(self):
+        self.client.get("/search", "GET /search", params={"q": self.random.choice(WORDS)})
+
+    @task(2)
+    def stall(self):
+        self.client.get(f"/g/soc{self.random.randrange(self.GROUPS):04d}", "GET /g/[group]")
+
+
+class AliasJoin(VirtualUser):
+
+    description = "Attendees of a talk all joining its room through one alias"
+    users = 500
+    iterations = 1
+    spawn_rate = 50
+
+    ALIAS = "freshers-talk"
+
+    @classmethod
+    def setup(cls, bbb, lookup, users):
+        group = add_group("talks", "Talks", "Talks for freshers", 1)
+        group.rooms[0].alias = cls.ALIAS
+        db.session.commit()
+        bbb.start_meeting(group.rooms[0].id, group.rooms[0].name)
+
+    @task()
+    def join(self):
+        self.client.get(f"/{self.ALIAS}", "GET /[alias]")
+        response = self.client.post(
+            f"/{self.ALIAS}",
+            "POST /[alias]",
+            expect=(302,),
+            data={"name": f"Attendee {self.index}", "password": ""},
+        )
+        # Browsers then follow the redirect to BBB
+        if response is not None and response.status_code == 302:
+            self.client.get(response.headers["Location"], "GET [bbb]/join")
+
+
+class OrganiserEdits(VirtualUser):
+
+    description = "Organisers logged in and editing their rooms, whitelisting people as they go"
+    users = 20
+    iterations = 20
+    spawn_rate = 10
+    wait_time = (0.2, 1.0)
+
+    ROOMS_PER_GROUP = 3
+    WHITELIST_SIZE = 5
+
+    @classmethod
+    def setup(cls, bbb, lookup, users):
+        role = Role.query.filter_by(role=RoleType.USER).one()
+        for index in range(users):
+            crsid = cls.crsid(index)
+            owner = User(crsid=crsid, email=f"{crsid}@cam.ac.uk", full_name=f"Organiser {index}", role=role)
+            add_group(f"org{index:03d}", f"Organisers {index}", None, cls.ROOMS_PER_GROUP, owners=[owner])
+            # Everyone they might whitelist, so each whitelisting calls Lookup
+            for n in range(cls.iterations * cls.WHITELIST_SIZE):
+                whitelisted = cls.whitelisted_crsid(index, n)
+                lookup.add_person(whitelisted, f"Whitelisted {whitelisted}")
+        db.session.commit()
+
+    @staticmethod
+    def crsid(index):
+        return f"o{index:03d}"
+
+    @staticmethod
+    def whitelisted_crsid(index, n):
+        return f"w{index:03d}{n:03d}"
+
+    def on_start(self):
+        self.client.login(self.crsid(self.index))
+        self.group_id = f"org{self.index:03d}"
+        self.whitelisted = 0
+
+    def room_id(self):
+        return f"{self.group_id}-{self.random.randrange(self.ROOMS_PER_GROUP):03d}"
+
+    def room_details(self, room_id, whitelist=""):
+        self.client.post(
+            f"/r/{room_id}/update/room_details",
+            "POST /r/[room]/update/room_details",
+            expect=(302,),
+            data={
+                "name": f"Room {self.random.randrange(1000)}",
+                "authentication": "public",
+                "password": "",
+                "whitelist": whitelist,
+                "alias": "",
+                "description": f"About {self.random.choice(WORDS)}",
+            },
+        )
+
+    @task(2)
+    def rooms(self):
+        self.client.get(f"/g/{self.group_id}/rooms", "GET /g/[group]/rooms")
+
+    @task(3)
+    def manage(self):
+        self.client.get(f"/r/{self.room_id()}/manage", "GET /r/[room]/manage")
+
+    @task(2)
+    def edit(self):
+        self.room_details(self.room_id())
+
+    @task(1)
+    def whitelist(self):
+        crsids = [
+            self.whitelisted_crsid(self.index, self.whitelisted + n) for n in range(self.WHITELIST_SIZE)
+        ]
+        self.whitelisted += self.WHITELIST_SIZE
+        self.room_details(self.room_id(), whitelist=", ".join(crsids))
+
+
+SCENARIOS = {
+    "directory_storm": DirectoryStorm,
+    "alias_join": AliasJoin,
+    "organiser_edits": OrganiserEdits,
+}
+
+
+def format_report(report):
+    lines = [
+        f"{report['scenario']} at {report['commit']}: {report['users']} users, {report['elapsed']} s",
+        f"{'Name':40} {'Reqs':>7} {'Fails':>6} {'Req/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}",
+    ]
+    rows = list(report["requests"].items())
+    if report["total"]:
+        rows.append(("Total", report["total"]))
+    for name, s in rows:
+        lines.append(
+            f"{name:40} {s['requests']:>7} {s['failures']:>6} {s['rps']:>8} "
+            f"{s['p50']:>8} {s['p90']:>8} {s['p99']:>8} {s['max']:>8}"
+        )
+    return "\n".join(lines)
+
+
+# The change in throughput and latency of each kind of request between two
+# reports, as (name, metric, before, after, percentage change).
+def compare(baseline, report):
+    changes = []
+    for name, after in list(report["requests"].items()) + [("Total", report["total"])]:
+        before = baseline["total"] if name == "Total" else baseline["requests"].get(name)
+        if not before or not after:
+            continue
+        for metric in ("rps", "p50", "p90", "p99"):
+            change = (after[metric] - before[metric]) / before[metric] * 100 if before[metric] else 0.0
+            changes.append((name, metric, before[metric], after[metric], change))
+    return changes
+
+
+def format_comparison(baseline, report):
+    lines = [f"Compared with {baseline['scenario']} at {baseline['commit']}:"]
+    for name, metric, before, after, change in compare(baseline, report):
+        lines.append(f"{name:40} {metric:>4} {before:>9} -> {after:<9} ({change:+.0f}%)")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the app against stub BBB and Lookup servers")
+    parser.add_argument("scenario", choices=SCENARIOS)
+    parser.add_argument("--users", type=int, help="virtual users; defaults to the scenario's")
+    parser.add_argument("--spawn-rate", type=float, help="users started per second")
+    parser.add_argument("--iterations", type=int, help="tasks each user runs")
+    parser.add_argument("--duration", type=float, help="seconds to run for, instead of iterations")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--bbb-latency", type=float, default=0.05, help="seconds")
+    parser.add_argument("--bbb-error-rate", type=float, default=0.0)
+    parser.add_argument("--lookup-latency", type=float, default=0.1, help="seconds")
+    parser.add_argument("--lookup-error-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="save the report as JSON")
+    parser.add_argument("--compare", help="a JSON report to compare with")
+    args = parser.parse_args(argv)
+    scenario = SCENARIOS[args.scenario]
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    with StubBBB(latency=args.bbb_latency, error_rate=args.bbb_error_rate, seed=args.seed) as bbb, \
+            StubLookup(latency=args.lookup_latency, error_rate=args.lookup_error_rate, seed=args.seed) as lookup:
+        os.environ["BIGBLUEBUTTON_URL"] = bbb.url + "bigbluebutton/api/"
+        os.environ["BIGBLUEBUTTON_SECRET"] = "secret"
+
+        app = create_app("testing")
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+        # Again, so that it seeds the new tables with roles and settings
+        app = create_app("testing")
+        app.config["LOOKUP_API_URL"] = lookup.url + "api/v1/"
+
+        report = run(
+            app, scenario, bbb, lookup,
+            users=args.users,
+            iterations=args.iterations,
+            duration=args.duration,
+            spawn_rate=args.spawn_rate,
+            seed=args.seed,
+        )
+
+    report.update(
+        scenario=args.scenario,
+        commit=app.config["GITHUB_REV"],
+        users=args.users or scenario.users,
+        options={key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+    )
+    print(scenario.description)
+    print(format_report(report))
+
+    if args.compare:
+        with open(args.compare) as f:
+            print(format_comparison(json.load(f), report))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,351 @@
+import json
+import time
+import socket
+import random
+import threading
+import socketserver
+from fnmatch import fnmatchcase
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from xml.sax.saxutils import escape
+
+
+# Local HTTP servers standing in for the services the app calls, with
+# configurable latency (seconds) and error rate (fraction of requests answered
+# with a 500). Each counts the requests and TCP connections it has served, so
+# tests can check that connections are reused.
+# Usage:
+# with StubBBB(latency=0.01) as bbb:
+#     monkeypatch.setenv("BIGBLUEBUTTON_URL", bbb.url)
+#     ...
+#     assert bbb.connections == 1
+class StubServer:
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.calls = {}
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, as real servers do
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # Headers and body are written separately; don't let Nagle's
+                # algorithm hold the body back for the client's delayed ACK
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                with stub.lock:
+                    stub.connections += 1
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                call = url.path.rstrip("/").rsplit("/", 1)[-1]
+
+                with stub.lock:
+                    stub.requests += 1
+                    stub.calls[call] = stub.calls.get(call, 0) + 1
+                    failed = stub.random.random() < stub.error_rate
+
+                if stub.latency:
+                    time.sleep(stub.latency)
+
+                if failed:
+                    status, content_type, body = 500, "text/plain", "Stub error"
+                else:
+                    status, content_type, body = stub.handle(call, params, self.headers)
+
+                data = body.encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+        )
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # Returns (status, content type, body) for a call.
+    def handle(self, call, params, headers):
+        raise NotImplementedError
+
+
+# The BigBlueButton API calls the app makes: create, join, isMeetingRunning
+# and getMeetings. Checksums aren't verified. Meetings run from their create
+# call, or start_meeting(), until end_meeting() is called.
+class StubBBB(StubServer):
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # meetingID -> (name, start time in ms, participant count)
+        self.meetings = {}
+
+    # As if a moderator had started the meeting.
+    def start_meeting(self, meeting_id, name="", participants=0):
+        with self.lock:
+            self.meetings.setdefault(meeting_id, (name, int(time.time() * 1000), participants))
+
+    def end_meeting(self, meeting_id):
+        with self.lock:
+            self.meetings.pop(meeting_id, None)
+
+    def handle(self, call, params, headers):
+        meeting_id = params.get("meetingID", "")
+
+        if call == "create":
+            with self.lock:
+                self.meetings.setdefault(
+                    meeting_id, (params.get("name", ""), int(time.time() * 1000), 0)
+                )
+            return xml_response(f"<meetingID>{escape(meeting_id)}</meetingID>")
+
+        if call == "join":
+            with self.lock:
+                if meeting_id not in self.meetings:
+                    return xml_response(
+                        "<messageKey>notFound</messageKey><message>No meeting</message>",
+                        returncode="FAILED",
+                    )
+                name, start_time, participants = self.meetings[meeting_id]
+                self.meetings[meeting_id] = (name, start_time, participants + 1)
+            return xml_response("<messageKey>successfullyJoined</messageKey>")
+
+        if call == "isMeetingRunning":
+            running = "true" if meeting_id in self.meetings else "false"
+            return xml_response(f"<running>{running}</running>")
+
+        if call == "getMeetings":
+            with self.lock:
+                meetings = "".join(
+                    f"<meeting><meetingID>{escape(id)}</meetingID>"
+                    f"<meetingName>{escape(name)}</meetingName><running>true</running>"
+                    f"<participantCount>{participants}</participantCount>"
+                    f"<startTime>{start_time}</startTime></meeting>"
+                    for id, (name, start_time, participants) in self.meetings.items()
+                )
+            return xml_response(f"<meetings>{meetings}</meetings>")
+
+        return xml_response(
+            "<messageKey>unsupportedRequest</messageKey><message>Unknown call</message>",
+            returncode="FAILED",
+        )
+
+
+# The University Lookup API's person/crsid/<crsid> call, for the people
+# added with add_person(). Unknown crsids get a 404. Setting status answers
+# every call with that status instead, e.g. 401 as outside the CUDN.
+class StubLookup(StubServer):
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.people = {}
+        self.status = None
+
+    def add_person(self, crsid, name, email=None):
+        with self.lock:
+            self.people[crsid] = (name, email or f"{crsid}@cam.ac.uk")
+
+    def handle(self, call, params, headers):
+        if self.status is not None:
+            return self.status, "application/json", "{}"
+
+        with self.lock:
+            person = self.people.get(call)
+        if person is None:
+            return 404, "application/json", json.dumps({"result": {"person": None}})
+
+        name, email = person
+        return 200, "application/json", json.dumps({
+            "result": {
+                "person": {
+                    "identifier": {"scheme": "crsid", "value": call},
+                    "visibleName": name,
+                    "attributes": [{"scheme": "email", "value": email}],
+                }
+            }
+        })
+
+
+# A Redis-compatible server for the commands RedisBackend sends: GET, SET
+# (with EX), DEL, INCRBY, MGET and SCAN, pipelined or not, over RESP2 or
+# RESP3. Keys expire by clock, which tests can replace to move time on.
+# Failed requests are answered with an error reply.
+class StubRedis(StubServer):
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # key -> (value, expiry time or None)
+        self.data = {}
+        self.clock = time.time
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"redis://{host}:{port}/0"
+
+    def start(self):
+        stub = self
+
+        class Handler(socketserver.StreamRequestHandler):
+
+            def setup(self):
+                super().setup()
+                self.protocol = 2
+                with stub.lock:
+                    stub.connections += 1
+
+            def handle(self):
+                while True:
+                    command = read_command(self.rfile)
+                    if command is None:
+                        return
+                    name, args = command[0].decode().upper(), command[1:]
+                    with stub.lock:
+                        stub.requests += 1
+                        stub.calls[name] = stub.calls.get(name, 0) + 1
+                        failed = stub.random.random() < stub.error_rate
+                    if stub.latency:
+                        time.sleep(stub.latency)
+
+                    if failed:
+                        reply = RedisError("Stub error")
+                    elif name == "HELLO":
+                        self.protocol = int(args[0]) if args else self.protocol
+                        reply = {b"server": b"stub", b"proto": self.protocol}
+                    else:
+                        with stub.lock:
+                            reply = stub.execute(name, args)
+                    self.wfile.write(resp(reply, self.protocol))
+
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+        )
+        self.thread.start()
+        return self
+
+    def _get(self, key):
+        value, expires = self.data.get(key, (None, None))
+        if expires is not None and expires <= self.clock():
+            del self.data[key]
+            return None
+        return value
+
+    # Returns the reply to a command, for resp(); call with the lock held.
+    def execute(self, name, args):
+        if name == "GET":
+            return self._get(args[0])
+
+        if name == "SET":
+            expires = None
+            if len(args) >= 4 and args[2].upper() == b"EX":
+                expires = self.clock() + int(args[3])
+            self.data[args[0]] = (args[1], expires)
+            return "OK"
+
+        if name == "DEL":
+            return sum(self.data.pop(key, None) is not None for key in args)
+
+        if name in ("INCR", "INCRBY"):
+            value = int(self._get(args[0]) or 0) + (int(args[1]) if len(args) > 1 else 1)
+            self.data[args[0]] = (str(value).encode(), None)
+            return value
+
+        if name == "MGET":
+            return [self._get(key) for key in args]
+
+        if name == "SCAN":
+            options = dict(zip(args[1::2], args[2::2]))
+            pattern = options.get(b"MATCH", b"*").decode()
+            keys = [key for key in list(self.data) if fnmatchcase(key.decode(), pattern)]
+            # One pass, so the cursor is done straight away
+            return [b"0", [key for key in keys if self._get(key) is not None]]
+
+        return RedisError(f"unknown command '{name}'")
+
+
+class RedisError(Exception):
+    pass
+
+
+# Reads one command, as an array of bulk strings; None at end of stream.
+def read_command(rfile):
+    line = rfile.readline()
+    if not line:
+        return None
+    args = []
+    for _ in range(int(line[1:])):
+        length = int(rfile.readline()[1:])
+        args.append(rfile.read(length + 2)[:-2])
+    return args
+
+
+# Encodes a reply in RESP: str as a status, bytes as a bulk string, dicts as
+# maps (RESP3 only) and None as the protocol's null.
+def resp(value, protocol=2):
+    if value is None:
+        return b"_\r\n" if protocol == 3 else b"$-1\r\n"
+    if isinstance(value, RedisError):
+        return f"-ERR {value}\r\n".encode()
+    if isinstance(value, str):
+        return f"+{value}\r\n".encode()
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, list):
+        return b"*%d\r\n" % len(value) + b"".join(resp(item, protocol) for item in value)
+    if isinstance(value, dict):
+        return b"%%%d\r\n" % len(value) + b"".join(
+            resp(key, protocol) + resp(item, protocol) for key, item in value.items()
+        )
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+def xml_response(body, returncode="SUCCESS"):
+    return (
+        200,
+        "text/xml",
+        f"<response><returncode>{returncode}</returncode>{body}</response>",
+    )
+
+
+# Latency percentiles, in milliseconds, of a list of durations in seconds.
+def percentiles(durations, points=(50, 99)):
+    ordered = sorted(durations)
+    return {
+        point: ordered[min(len(ordered) - 1, len(ordered) * point // 100)] * 1000
+        for point in points
+    }
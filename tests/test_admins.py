@@ -0,0 +1,150 @@
+import time
+import pytest
+
+from lightbluetent.admins import count_running
+from lightbluetent.api import Meeting
+from lightbluetent.models import db, Group, MeetingStatus
+
+
+@pytest.fixture
+def groups(app, add_group):
+    with app.app_context():
+        for i in range(10):
+            add_group(f"group{i}", rooms=5)
+
+
+def no_bbb(call, params):
+    raise AssertionError(f"BBB was called: {call}")
+
+
+def test_count_running_reads_polled_statuses(app, groups, monkeypatch):
+    app.config["MEETING_POLLER_ENABLED"] = True
+    monkeypatch.setattr(Meeting, "request", staticmethod(no_bbb))
+
+    with app.test_request_context():
+        for room_id in ("group0-000", "group3-001", "group3-004"):
+            db.session.add(MeetingStatus(room_id=room_id, is_running=True))
+        db.session.add(MeetingStatus(room_id="group5-000", is_running=False))
+        db.session.commit()
+
+        counts = count_running(Group.query.order_by(Group.id).all())
+
+    assert counts == {f"group{i}": {0: 1, 3: 2}.get(i, 0) for i in range(10)}
+
+
+def test_count_running_makes_one_bbb_call_without_poller(app, groups, bbb):
+    with app.test_request_context():
+        for room_id in ("group1-002", "group7-000"):
+            Meeting.request("create", {"meetingID": room_id})
+        bbb.calls.clear()
+
+        counts = count_running(Group.query.order_by(Group.id).all())
+
+    assert counts == {f"group{i}": int(i in (1, 7)) for i in range(10)}
+    assert bbb.calls == {"getMeetings": 1}
+
+
+# The 50 rooms' statuses take as long as one call, not 50 of them.
+def test_count_running_latency_is_independent_of_the_number_of_rooms(app, groups, bbb):
+    bbb.latency = 0.2
+
+    with app.test_request_context():
+        groups = Group.query.order_by(Group.id).all()
+        start = time.perf_counter()
+        count_running(groups)
+        elapsed = time.perf_counter() - start
+
+    assert elapsed < 2 * bbb.latency
+    assert bbb.calls == {"getMeetings": 1}
+
+
+@pytest.fixture
+def admin_client(client, admin, login):
+    login(admin)
+    return client
+
+
+def test_admin_panel_renders(app, admin_client, groups, monkeypatch):
+    app.config["MEETING_POLLER_ENABLED"] = True
+    monkeypatch.setattr(Meeting, "request", staticmethod(no_bbb))
+
+    response = admin_client.get("/admin/")
+
+    assert response.status_code == 200
+    assert b"There are currently 10 registered groups." in response.data
+
+
+def test_admin_panel_is_not_for_users(client, add_user, login, app):
+    with app.app_context():
+        add_user("usr123")
+    login("usr123")
+
+    assert client.get("/admin/").status_code == 404
+    assert client.get("/admin/list/groups").status_code == 404
+
+
+def list_all(client, listing, q=""):
+    pages = []
+    after = None
+    while True:
+        params = {"q": q}
+        if after is not None:
+            params["after"] = after
+        response = client.get(f"/admin/list/{listing}", query_string=params)
+        assert response.status_code == 200
+        page = response.get_json()
+        pages.append([item["subtitle"] for item in page["items"]])
+        after = page["next"]
+        if after is None:
+            return pages
+
+
+def test_listing_pages_by_keyset(app, admin_client, add_group, monkeypatch):
+    app.config["ADMIN_PAGE_SIZE"] = 4
+    app.config["MEETING_POLLER_ENABLED"] = True
+    monkeypatch.setattr(Meeting, "request", staticmethod(no_bbb))
+    with app.app_context():
+        for i in range(10):
+            add_group(f"group{i:02d}", rooms=1)
+
+    pages = list_all(admin_client, "groups")
+
+    assert [len(page) for page in pages] == [4, 4, 2]
+    assert sum(pages, []) == [f"group{i:02d}" for i in range(10)]
+
+
+def test_listing_pages_stay_consistent_when_rows_are_added(app, admin_client, add_group):
+    app.config["ADMIN_PAGE_SIZE"] = 3
+    with app.app_context():
+        for i in (0, 2, 4, 6):
+            add_group(f"group{i}")
+
+    first = admin_client.get("/admin/list/groups").get_json()
+    # A row added before the cursor doesn't shift the next page, as it would
+    # with OFFSET
+    with app.app_context():
+        add_group("group1")
+    second = admin_client.get("/admin/list/groups", query_string={"after": first["next"]}).get_json()
+
+    assert [item["subtitle"] for item in first["items"]] == ["group0", "group2", "group4"]
+    assert [item["subtitle"] for item in second["items"]] == ["group6"]
+    assert second["next"] is None
+
+
+def test_listing_search(app, admin_client, add_group, add_user):
+    with app.app_context():
+        add_group("chess", name="Chess Society")
+        add_group("choir", name="Chapel Choir")
+        add_group("rowing", name="Boat Club")
+        add_user("abc123")
+
+    assert list_all(admin_client, "groups", "ch") == [["chess", "choir"]]
+    assert list_all(admin_client, "groups", "boat") == [["rowing"]]
+    # LIKE wildcards are matched literally
+    assert list_all(admin_client, "groups", "%") == [[]]
+    assert list_all(admin_client, "users", "abc") == [["abc123"]]
+
+
+def test_listing_rejects_bad_cursors(admin_client):
+    assert admin_client.get("/admin/list/users", query_string={"after": "x"}).status_code == 400
+    assert admin_client.get("/admin/list/nothing").status_code == 404
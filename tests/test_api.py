@@ -0,0 +1,75 @@
+import socket
+import time
+import requests
+
+from lightbluetent import api
+from lightbluetent.api import Meeting, http_session
+from stub_servers import percentiles
+
+
+def test_requests_reuse_one_connection(app, bbb):
+    with app.app_context():
+        for _ in range(20):
+            response, error = Meeting.request("getMeetings", {})
+            assert response["returncode"] == "SUCCESS"
+
+    assert bbb.requests == 20
+    assert bbb.connections == 1
+
+
+def test_read_timeout_is_taken_from_config(app, bbb):
+    app.config["BBB_READ_TIMEOUT"] = 0.05
+    bbb.latency = 0.5
+
+    with app.app_context():
+        response, error = Meeting.request("getMeetings", {})
+
+    assert response is None
+    assert "ReadTimeout" in error
+
+
+def test_connection_errors_are_retried(app, monkeypatch):
+    # A port nothing listens on
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    monkeypatch.setenv("BIGBLUEBUTTON_URL", f"http://127.0.0.1:{port}/bigbluebutton/api/")
+    monkeypatch.setenv("BIGBLUEBUTTON_SECRET", "secret")
+    monkeypatch.setattr(api, "_http_session", None)
+    app.config["BBB_CONNECT_RETRIES"] = 3
+    app.config["BBB_RETRY_BACKOFF"] = 0
+
+    with app.app_context():
+        assert http_session().get_adapter("http://").max_retries.connect == 3
+        response, error = Meeting.request("getMeetings", {})
+
+    assert response is None
+    assert error.startswith("Could not connect")
+
+
+def test_pooled_session_is_faster_than_new_connections(app, bbb):
+    calls = 200
+
+    with app.app_context():
+        url = Meeting.build_url("getMeetings", {})
+        session = http_session()
+        fresh, pooled = [], []
+
+        # Alternated, so that noise affects both alike
+        for _ in range(calls):
+            for get, durations in (
+                # As before the pooled session: a new connection for every call
+                (lambda: requests.get(url, headers={"Connection": "close"}), fresh),
+                (lambda: session.get(url), pooled),
+            ):
+                start = time.perf_counter()
+                get().raise_for_status()
+                durations.append(time.perf_counter() - start)
+
+    fresh, pooled = percentiles(fresh), percentiles(pooled)
+    print(
+        f"\nBBB calls (ms): new connections p50={fresh[50]:.2f} p99={fresh[99]:.2f}, "
+        f"pooled p50={pooled[50]:.2f} p99={pooled[99]:.2f}"
+    )
+    assert bbb.connections == calls + 1
+    assert pooled[50] < fresh[50]
@@ -0,0 +1,154 @@
+import io
+from datetime import datetime, timedelta
+
+import pytest
+from flask import g, make_response
+from PIL import Image
+
+from lightbluetent.api import Meeting, MeetingStatusService
+from lightbluetent.compression import compression
+from lightbluetent.general import render_directory
+from lightbluetent.models import Link, Room, Session
+from lightbluetent.utils import match_link, validate_email, path_sanitise, resize_image, responsive_image
+from test_directory import grow_groups
+
+pytest.importorskip("pytest_benchmark")
+
+
+# Micro-benchmarks of the helpers on hot paths. benchmark.sh compares them
+# with the baseline stored in tests/benchmarks and fails if any has become
+# slower by more than a threshold; a plain test run times them and checks
+# their results without comparing. Skipped without pytest-benchmark.
+
+
+@pytest.fixture
+def bbb_env(monkeypatch):
+    monkeypatch.setenv("BIGBLUEBUTTON_URL", "https://bbb.example/bigbluebutton/api/")
+    monkeypatch.setenv("BIGBLUEBUTTON_SECRET", "secret")
+
+
+JOIN_PARAMS = {
+    "fullName": "Attendee Name",
+    "meetingID": "chess-society-a1b-2c3",
+    "password": "a1b2c3d4e5f6",
+    "redirect": "true",
+}
+
+
+def test_generate_checksum(benchmark, bbb_env):
+    assert len(benchmark(Meeting.generate_checksum, "join", "meetingID=chess&password=x")) == 40
+
+
+def test_build_url(benchmark, bbb_env):
+    assert "checksum=" in benchmark(Meeting.build_url, "join", JOIN_PARAMS)
+
+
+LINKS = [
+    "someone@cam.ac.uk",
+    "https://www.facebook.com/chesssoc",
+    "https://twitter.com/chesssoc",
+    "https://www.instagram.com/chesssoc",
+    "https://youtu.be/dQw4w9WgXcQ",
+    "https://www.srcf.net/chess",
+]
+
+
+def test_match_link(benchmark):
+    types = benchmark(lambda: [match_link(link) for link in LINKS])
+    assert [t.value for t in types] == ["email", "facebook", "twitter", "instagram", "youtube", "other"]
+
+
+def test_validate_email(benchmark):
+    assert benchmark(validate_email, "abc123", "abc123+events@cam.ac.uk") is None
+
+
+def test_path_sanitise(benchmark):
+    assert benchmark(path_sanitise, "Café Society's logo (final).png").startswith("Cafe_")
+
+
+@pytest.fixture(scope="module")
+def photo():
+    image = Image.linear_gradient("L").resize((1600, 1200)).convert("RGB")
+    data = io.BytesIO()
+    image.save(data, "JPEG")
+    return data.getvalue()
+
+
+def test_resize_image(benchmark, photo):
+    outputs = benchmark(lambda: dict(resize_image(io.BytesIO(photo), (512, 512))))
+    assert {density: image.size for density, image in outputs.items()} == {1: (512, 512), 2: (1024, 1024)}
+
+
+ASSETS = [
+    (None, "logos/chess.png", "image/png"),
+    ("@1x", "logos/chess@1x.png", "image/png"),
+    ("@2x", "logos/chess@2x.png", "image/png"),
+    ("@1x", "logos/chess@1x.webp", "image/webp"),
+    ("@2x", "logos/chess@2x.webp", "image/webp"),
+]
+
+
+def test_img_attr(benchmark, app):
+    image = responsive_image("chess", ASSETS)
+    assert "srcset=" in benchmark(image.img_attr)
+
+
+def test_get_display_order(benchmark):
+    room = Room(links=[Link(id=i, display_order=(i * 3) % 10) for i in range(10)])
+    assert benchmark(room.get_display_order) == "0|7|4|1|8|5|2|9|6|3"
+
+
+def test_jinja_filters(benchmark, app):
+    filters, tests = app.jinja_env.filters, app.jinja_env.tests
+    session = Session(end=datetime.now() - timedelta(hours=2))
+    # As prefetched for the page
+    g.responsive_images = {"chess": responsive_image("chess", ASSETS)}
+
+    def run():
+        return (
+            [filters["get_ordinal"](n) for n in range(1, 25)],
+            filters["ended_hours_ago"](session, 1),
+            tests["equalto"]("raven", "raven"),
+            filters["responsive_image.img"]("chess"),
+            filters["responsive_image.css"]("chess"),
+        )
+
+    ordinals, ended, equal, img, css = benchmark(run)
+    assert ordinals[:4] == ["1st", "2nd", "3rd", "4th"] and ordinals[10] == "11th"
+    assert ended and equal
+    assert "srcset=" in img and "image-set(" in css
+
+
+# The directory page as rendered with each number of groups all on the first
+# page; rendering 5000 takes a while, so each is rendered once and shared
+# between encodings.
+directory_pages = {}
+
+
+def directory_page(app, add_user, groups):
+    if groups not in directory_pages:
+        app.config["MEETING_POLLER_ENABLED"] = True
+        app.config["DIRECTORY_PAGE_SIZE"] = groups
+        with app.test_request_context():
+            owner = add_user("own123")
+            grow_groups(groups, owner)
+            directory_pages[groups] = render_directory(MeetingStatusService(), 0)
+    return directory_pages[groups]
+
+
+# Bytes on the wire and CPU time to compress the directory page, with the
+# configured gzip level and brotli quality.
+@pytest.mark.parametrize("encoding", ["gzip", "br"])
+@pytest.mark.parametrize("groups", [100, 1000, 5000])
+def test_compress_directory(benchmark, app, add_user, groups, encoding):
+    if encoding == "br":
+        pytest.importorskip("brotli")
+    html = directory_page(app, add_user, groups)
+
+    with app.test_request_context(headers={"Accept-Encoding": encoding}):
+        response = benchmark(lambda: compression.compress(make_response(html)))
+
+    assert response.headers["Content-Encoding"] == encoding
+    size = len(html.encode())
+    benchmark.extra_info.update(bytes=size, compressed_bytes=len(response.data))
+    print(f"\n{groups} groups, {encoding}: {size} -> {len(response.data)} bytes")
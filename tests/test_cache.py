@@ -0,0 +1,209 @@
+import atexit
+import threading
+import time
+import pytest
+
+from lightbluetent import cache as cache_module
+from lightbluetent.cache import MemoryBackend, SQLiteBackend, RedisBackend, BufferedCounters, TTLCache
+from stub_servers import StubRedis
+
+
+# Time as the cache sees it, moved on by hand.
+class Clock:
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+    monotonic = time
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def redis_stub(clock):
+    pytest.importorskip("redis")
+    with StubRedis() as stub:
+        stub.clock = clock.time
+        yield stub
+
+
+# A TTLCache on each backend: fresh for 10s, absences for 2s, then served
+# stale for 30s more.
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def cache(request, app, tmp_path, clock):
+    url = None
+    if request.param == "sqlite":
+        url = str(tmp_path / "cache.sqlite3")
+    elif request.param == "redis":
+        url = request.getfixturevalue("redis_stub").url
+
+    app.config.update(
+        TEST_CACHE_BACKEND=request.param,
+        TEST_CACHE_URL=url,
+        TEST_CACHE_TTL=10,
+        TEST_CACHE_NEGATIVE_TTL=2,
+        TEST_CACHE_STALE_TTL=30,
+    )
+    cache = TTLCache("test", "TEST_CACHE")
+    cache.init_app(app)
+    with app.app_context():
+        yield cache
+
+
+# Returns each of values in turn, counting the calls.
+class Loader:
+
+    def __init__(self, *values):
+        self.values = list(values)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.values.pop(0)
+
+
+def wait_for_revalidation(cache, key):
+    deadline = time.monotonic() + 5
+    while key in cache._refreshing:
+        assert time.monotonic() < deadline, "Revalidation didn't finish"
+        time.sleep(0.01)
+
+
+def test_entries_are_reloaded_once_past_their_ttl_and_stale_window(cache, clock):
+    load = Loader("first", "second")
+
+    assert cache.get_or_load("key", load) == "first"
+    clock.advance(9)
+    assert cache.get_or_load("key", load) == "first"
+    assert load.calls == 1
+
+    clock.advance(32)
+    assert cache.get_or_load("key", load) == "second"
+    assert load.calls == 2
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["loads"]) == (1, 2, 2)
+
+
+def test_absences_are_cached_for_the_negative_ttl(cache, clock):
+    load = Loader(None, "found")
+
+    assert cache.get_or_load("key", load) is None
+    clock.advance(1)
+    assert cache.get_or_load("key", load) is None
+    assert load.calls == 1
+    assert cache.stats()["negative_hits"] == 1
+
+    # Well within the TTL of a value, but not of an absence
+    clock.advance(2)
+    cache.get_or_load("key", load)
+    wait_for_revalidation(cache, "key")
+    assert cache.get_or_load("key", load) == "found"
+    assert load.calls == 2
+
+
+def test_stale_entries_are_served_while_one_reload_runs(cache, clock):
+    reloading = threading.Event()
+    reload_done = threading.Event()
+
+    def reload():
+        reloading.set()
+        reload_done.wait(5)
+        return "new"
+
+    cache.get_or_load("key", Loader("old"))
+    clock.advance(11)
+
+    assert cache.get_or_load("key", reload) == "old"
+    assert reloading.wait(5)
+    # Still stale, but already being reloaded
+    assert cache.get_or_load("key", Loader()) == "old"
+
+    reload_done.set()
+    wait_for_revalidation(cache, "key")
+    assert cache.get_or_load("key", Loader()) == "new"
+    assert cache.stats()["stale"] == 2
+
+
+def test_many_keys_are_loaded_in_one_call(cache, clock):
+    calls = []
+
+    def load(keys):
+        calls.append(keys)
+        return {key: key.upper() for key in keys if key != "missing"}
+
+    cache.get_many_or_load(["a", "b"], load)
+    values = cache.get_many_or_load(["a", "b", "c", "missing"], load)
+
+    assert values == {"a": "A", "b": "B", "c": "C", "missing": None}
+    assert calls == [["a", "b"], ["c", "missing"]]
+
+
+def test_memory_backend_evicts_the_least_recently_used(clock):
+    backend = MemoryBackend(maxsize=2)
+    backend.set("a", "1", 60)
+    backend.set("b", "2", 60)
+    backend.get("a")
+    backend.set("c", "3", 60)
+
+    assert [backend.get(key) for key in "abc"] == ["1", None, "3"]
+
+
+def test_sqlite_backend_stays_bounded(tmp_path, clock):
+    backend = SQLiteBackend(str(tmp_path / "cache.sqlite3"), maxsize=32)
+    backend.set("expired", "value", 1)
+    clock.advance(2)
+    for i in range(100):
+        backend.set(f"key{i}", "value", 60 + i)
+
+    rows = backend._connect().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+    assert rows <= backend.maxsize + backend.evict_every
+    # The soonest to expire go first
+    assert backend.get("key99") == "value"
+    assert backend.get("key0") is None
+    assert backend._connect().execute("SELECT 1 FROM cache WHERE key = 'expired'").fetchone() is None
+
+
+def test_redis_backend(redis_stub, clock):
+    backend = RedisBackend(redis_stub.url)
+
+    backend.set("key", "value", 10)
+    assert backend.get("key") == "value"
+    clock.advance(10)
+    assert backend.get("key") is None
+
+    backend.set("key", "value", 10)
+    backend.delete("key")
+    assert backend.get("key") is None
+
+    backend.incr("test:stats:hits")
+    backend.incr_many({"test:stats:hits": 2, "test:stats:misses": 1, "other": 5})
+    assert backend.counter("test:stats:hits") == 3
+    assert backend.counters("test:stats:") == {"test:stats:hits": 3, "test:stats:misses": 1}
+
+
+def test_buffered_counters_share_one_exit_handler(monkeypatch):
+    registered = []
+    monkeypatch.setattr(atexit, "register", registered.append)
+    backend = MemoryBackend()
+
+    # As each app does with its caches
+    buffers = [BufferedCounters(backend, 60) for _ in range(3)]
+    for counters in buffers:
+        counters.incr("requests")
+
+    assert registered == []
+    assert backend.counter("requests") == 0
+    cache_module._flush_buffered_counters()
+    assert backend.counter("requests") == 3
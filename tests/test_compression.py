@@ -0,0 +1,108 @@
+import gzip
+import pytest
+
+from lightbluetent.app import create_app
+from lightbluetent.compression import compression
+from lightbluetent.config import TestingConfig
+from lightbluetent.models import db, Group
+
+
+# Settings to create the app with; compression reads its own in create_app.
+# Tests override it with parametrize.
+@pytest.fixture
+def config():
+    return {}
+
+
+@pytest.fixture
+def app(config, monkeypatch):
+    for name, value in config.items():
+        monkeypatch.setattr(TestingConfig, name, value)
+    return create_app("testing")
+
+
+@pytest.fixture
+def directory_client(app, client, seeded, add_group):
+    app.config["MEETING_POLLER_ENABLED"] = True
+    with app.app_context():
+        for i in range(20):
+            add_group(f"group{i:02d}", name=f"Group {i}", description="A group", rooms=1)
+    return client
+
+
+@pytest.fixture
+def brotli():
+    brotli = pytest.importorskip("brotli")
+    assert compression.brotli is not None
+    return brotli
+
+
+@pytest.mark.parametrize("accept_encoding, encoding", [
+    ("gzip", "gzip"),
+    ("gzip, deflate", "gzip"),
+    ("deflate", None),
+    ("gzip;q=0", None),
+    ("", None),
+])
+def test_gzip_negotiation(directory_client, accept_encoding, encoding):
+    response = directory_client.get("/", headers={"Accept-Encoding": accept_encoding})
+
+    assert response.status_code == 200
+    assert response.headers.get("Content-Encoding") == encoding
+    assert "Accept-Encoding" in response.vary
+    if encoding == "gzip":
+        assert b"Group 19" in gzip.decompress(response.data)
+    else:
+        assert b"Group 19" in response.data
+
+
+@pytest.mark.parametrize("accept_encoding, encoding", [
+    # Ties go to brotli, whatever the order
+    ("gzip, br", "br"),
+    ("br, gzip", "br"),
+    ("*", "br"),
+    ("br;q=0.5, gzip", "gzip"),
+    ("br", "br"),
+])
+def test_brotli_negotiation(directory_client, brotli, accept_encoding, encoding):
+    response = directory_client.get("/", headers={"Accept-Encoding": accept_encoding})
+
+    assert response.headers["Content-Encoding"] == encoding
+    body = brotli.decompress(response.data) if encoding == "br" else gzip.decompress(response.data)
+    assert b"Group 19" in body
+
+
+@pytest.mark.parametrize("config", [{"COMPRESS_MIN_SIZE": 10 ** 7}])
+def test_small_responses_are_not_compressed(directory_client):
+    response = directory_client.get("/", headers={"Accept-Encoding": "gzip"})
+
+    assert "Content-Encoding" not in response.headers
+
+
+def test_compressed_pages_revalidate_with_weak_etag(directory_client):
+    response = directory_client.get("/", headers={"Accept-Encoding": "gzip"})
+    etag = response.headers["ETag"]
+    assert etag.startswith("W/")
+
+    response = directory_client.get("/", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert response.status_code == 304
+
+
+# BREACH: a CSRF token next to input reflected from the request mustn't be
+# compressed, or its value can be recovered from the response sizes.
+def test_pages_with_csrf_tokens_are_not_compressed(app, directory_client, add_user, login):
+    with app.app_context():
+        user = add_user("abc123")
+        group = Group.query.get("group00")
+        group.owners.append(user)
+        db.session.commit()
+    login("abc123")
+
+    response = directory_client.get("/r/group00-000/manage", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert b'name="_csrf_token"' in response.data
+    assert "Content-Encoding" not in response.headers
+
+    # Pages without one still are
+    response = directory_client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
@@ -0,0 +1,95 @@
+import pytest
+
+from lightbluetent.config import RoleType
+from lightbluetent.models import db, Room, User
+from lightbluetent.utils import parse_crsids, resolve_crsids
+
+
+@pytest.mark.parametrize("text", [
+    "abc123,def45,gh6",
+    "abc123, def45; gh6",
+    "abc123\ndef45\r\ngh6\n",
+    "  ABC123\tdef45  Gh6 ",
+])
+def test_crsids_are_split_on_commas_semicolons_and_whitespace(text):
+    assert parse_crsids(text) == (["abc123", "def45", "gh6"], [])
+
+
+def test_invalid_crsids_are_returned_separately():
+    crsids, invalid = parse_crsids("abc123, 1abc, a, toolong12, x@y, def45")
+
+    assert crsids == ["abc123", "def45"]
+    assert invalid == ["1abc", "a", "toolong12", "x@y"]
+
+
+def test_duplicates_are_dropped_in_order():
+    assert parse_crsids("def45, abc123, DEF45, abc123, bad!, bad!") == (["def45", "abc123"], ["bad!"])
+
+
+def test_existing_users_are_resolved_in_the_order_given(app, add_user, lookup):
+    with app.app_context():
+        add_user("abc123")
+        add_user("def45")
+
+        users, missing = resolve_crsids(["def45", "zz999", "abc123"])
+
+        assert [user.crsid for user in users] == ["def45", "abc123"]
+        assert missing == ["zz999"]
+        assert User.query.count() == 2
+    assert lookup.requests == 0
+
+
+def test_new_users_are_created_as_visitors_named_from_lookup(app, add_user, lookup):
+    lookup.add_person("new1", "New Person")
+
+    with app.app_context():
+        add_user("abc123")
+
+        users, missing = resolve_crsids(["new1", "abc123", "new2"], create_missing=True)
+
+        assert missing == []
+        assert [user.crsid for user in users] == ["new1", "abc123", "new2"]
+        assert {user.crsid: user.full_name for user in users} == {
+            "new1": "New Person", "abc123": "ABC123", "new2": None,
+        }
+        assert [user.role.role for user in users] == [RoleType.VISITOR, RoleType.USER, RoleType.VISITOR]
+    # Only the new users are looked up
+    assert lookup.requests == 2
+
+
+@pytest.fixture
+def room_owner(app, client, login, add_user, add_group):
+    with app.app_context():
+        owner = add_user("own123")
+        group = add_group("chess", rooms=1)
+        group.owners.append(owner)
+        db.session.commit()
+    login("own123")
+
+
+def update_room_details(client, **fields):
+    return client.post("/r/chess-000/update/room_details", data={
+        "name": "Chess room",
+        "authentication": "whitelist",
+        "description": "",
+        **fields,
+    })
+
+
+def test_whitelisting_creates_users_only_once_the_form_is_valid(app, client, room_owner, lookup):
+    with app.app_context():
+        db.session.add(Room(
+            id="other-000", name="Other", alias="taken", attendee_pw="a", moderator_pw="m"
+        ))
+        db.session.commit()
+
+    response = update_room_details(client, whitelist="new1 new2", alias_checked="on", alias="taken")
+    assert b"already in use" in response.data
+    with app.app_context():
+        assert User.query.filter(User.crsid.in_(["new1", "new2"])).count() == 0
+
+    response = update_room_details(client, whitelist="new1 new2", alias_checked="on", alias="chess")
+    assert response.status_code == 302
+    with app.app_context():
+        room = Room.query.get("chess-000")
+        assert sorted(user.crsid for user in room.whitelisted_users) == ["new1", "new2"]
@@ -0,0 +1,258 @@
+import random
+import re
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import event
+
+from lightbluetent.api import MeetingStatusService
+from lightbluetent.cache import SQLiteBackend
+from lightbluetent.config import Config
+from lightbluetent import general
+from lightbluetent.general import render_directory
+from lightbluetent.models import (
+    db,
+    User,
+    Group,
+    Room,
+    Link,
+    Asset,
+    MeetingStatus,
+    directory_cache,
+    settings_registry,
+)
+
+
+# Adds groups until there are count of them, each with two rooms, a link, a
+# logo and an owner, i.e. everything a directory card shows.
+def grow_groups(count, owner):
+    for i in range(Group.query.count(), count):
+        group_id = f"group{i:04d}"
+        group = Group(id=group_id, name=f"Group {i}", description="A group", logo=f"logo:{group_id}:x")
+        group.owners.append(owner)
+        group.links.append(Link(name="Website", url="https://example.com", display_order=0))
+        for j in range(2):
+            group.rooms.append(Room(
+                id=f"{group_id}-{j}",
+                name=f"Room {j}",
+                attendee_pw=f"{group_id}-{j}-a",
+                moderator_pw=f"{group_id}-{j}-m",
+            ))
+            db.session.add(MeetingStatus(room_id=f"{group_id}-{j}", is_running=j == 0))
+        for variant in ("@1x", "@2x"):
+            db.session.add(Asset(
+                key=group.logo, variant=variant, content_type="image/png", path=f"{group_id}{variant}.png"
+            ))
+        db.session.add(group)
+    db.session.commit()
+
+
+def count_queries(fn):
+    queries = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        queries.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        result = fn()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+    return queries, result
+
+
+def test_directory_query_count_is_constant(app, add_user):
+    app.config["MEETING_POLLER_ENABLED"] = True
+    # Every group on the first page
+    app.config["DIRECTORY_PAGE_SIZE"] = 1000
+    counts = {}
+
+    with app.app_context():
+        add_user("own123")
+
+    for size in (10, 100, 1000):
+        with app.test_request_context():
+            grow_groups(size, User.query.filter_by(crsid="own123").one())
+            db.session.expire_all()
+            # Render every card afresh
+            directory_cache.init_app(app)
+            # Settings are loaded at most once per request, whatever the page
+            settings_registry.all()
+
+            queries, html = count_queries(lambda: render_directory(MeetingStatusService(), 0))
+
+        counts[size] = len(queries)
+        assert html.count('class="card mb-3"') == size
+
+    assert counts[10] == counts[100] == counts[1000], counts
+
+
+# One query per table, and every logo resolved by a single IN query. The
+# rooms query includes their aliases; the groups are listed once to put them
+# in order, then the page of them loaded.
+def test_directory_loads_each_table_once(app, add_user):
+    app.config["MEETING_POLLER_ENABLED"] = True
+
+    with app.test_request_context():
+        grow_groups(20, add_user("own123"))
+        settings_registry.all()
+
+        queries, html = count_queries(lambda: render_directory(MeetingStatusService(), 0))
+        tables = [query.split()[1].split(".")[0] for query in queries]
+        assert sorted(tables) == ["assets", "groups", "groups", "links", "meeting_statuses", "rooms", "users"]
+        assets_query = queries[tables.index("assets")]
+        assert assets_query.count("?") == 20 and " IN (" in assets_query
+
+        # Logos are then memoised
+        directory_cache.init_app(app)
+        queries, html = count_queries(lambda: render_directory(MeetingStatusService(), 0))
+        assert "assets" not in [query.split()[1].split(".")[0] for query in queries]
+
+
+def test_renaming_an_owner_invalidates_their_groups_cards(app, add_user, add_group):
+    with app.app_context():
+        owner = add_user("own123")
+        add_group("go")
+        chess = add_group("chess")
+        chess.owners.append(owner)
+        db.session.commit()
+
+        def generations():
+            return {key: directory_cache.generation(key) for key in ("group:chess", "group:go", "directory")}
+
+        before = generations()
+        User.query.filter_by(crsid="own123").one().email = "own123@example.com"
+        db.session.commit()
+        assert generations() == before
+
+        User.query.filter_by(crsid="own123").one().full_name = "A. Owner"
+        db.session.commit()
+        assert generations() == {
+            "group:chess": before["group:chess"] + 1,
+            "group:go": before["group:go"],
+            "directory": before["directory"] + 1,
+        }
+
+
+@pytest.fixture
+def directory_client(app, client, seeded):
+    app.config["MEETING_POLLER_ENABLED"] = True
+    return client
+
+
+def test_directory_revalidates_with_etag(app, directory_client, add_group):
+    with app.app_context():
+        add_group("chess", name="Chess Society", rooms=1)
+
+    response = directory_client.get("/")
+    assert response.status_code == 200
+    assert b"Chess Society" in response.data
+
+    etag = response.headers["ETag"]
+    assert directory_client.get("/", headers={"If-None-Match": etag}).status_code == 304
+
+    with app.app_context():
+        Group.query.get("chess").name = "Chess Club"
+        db.session.commit()
+
+    response = directory_client.get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert b"Chess Club" in response.data
+
+
+def test_directory_edits_reach_every_worker(app, directory_client, add_group, tmp_path, monkeypatch):
+    app.config["DIRECTORY_CACHE_BACKEND"] = Config.DIRECTORY_CACHE_BACKEND
+    app.config["DIRECTORY_CACHE_URL"] = str(tmp_path / "directory.sqlite3")
+    directory_cache.init_app(app)
+    # Each worker has its own connection to the shared backend
+    this_worker = directory_cache.backend
+    other_worker = SQLiteBackend(app.config["DIRECTORY_CACHE_URL"])
+
+    with app.app_context():
+        add_group("chess", name="Chess Society", rooms=1)
+    assert b"Chess Society" in directory_client.get("/").data
+
+    # Another worker handles the edit
+    monkeypatch.setattr(directory_cache, "backend", other_worker)
+    with app.app_context():
+        Group.query.get("chess").name = "Chess Club"
+        db.session.commit()
+    monkeypatch.setattr(directory_cache, "backend", this_worker)
+
+    page = directory_client.get("/").data
+    assert b">Chess Club</h5>" in page
+    assert b">Chess Society</h5>" not in page
+
+
+def test_directory_is_sent_a_page_at_a_time(app, directory_client, add_user):
+    app.config["DIRECTORY_PAGE_SIZE"] = 4
+    with app.app_context():
+        grow_groups(10, add_user("own123"))
+
+    def group_ids(html):
+        return [f"group{int(i):04d}" for i in re.findall(r">Group (\d+)</h5>", html)]
+
+    response = directory_client.get("/")
+    html = response.get_data(as_text=True)
+    seed = response.headers["X-Directory-Rotation"]
+    assert f'data-page="2" data-seed="{ seed }"' in html
+    pages = [group_ids(html)]
+
+    next_page = 2
+    while next_page is not None:
+        results = directory_client.get("/search", query_string={"page": next_page, "seed": seed}).get_json()
+        pages.append(group_ids("".join(results["cards"])))
+        next_page = results["next_page"]
+
+    # Every group once, in the order of the rotation
+    order = sorted(f"group{i:04d}" for i in range(10))
+    random.Random(int(seed)).shuffle(order)
+    assert pages == [order[:4], order[4:8], order[8:]]
+
+    assert directory_client.get("/search", query_string={"page": 0}).status_code == 404
+
+
+def test_only_cards_are_cached_and_only_within_a_release(app, directory_client, add_group):
+    with app.app_context():
+        add_group("chess", name="Chess Society", rooms=1)
+        add_group("go", name="Go Society", rooms=1)
+    directory_cache.init_app(app)
+
+    def cached():
+        return sorted(key.split(":")[2] for key in directory_cache.backend._data if ":card:" in key)
+
+    assert directory_client.get("/").status_code == 200
+    assert cached() == ["chess", "go"]
+    assert not any(":page:" in key for key in directory_cache.backend._data)
+
+    # A new release renders its own cards
+    app.config["GITHUB_REV"] = "next-release"
+    loads = directory_cache.stats()["loads"]
+    assert directory_client.get("/").status_code == 200
+    assert directory_cache.stats()["loads"] == loads + 2
+
+
+def test_directory_order_is_stable_within_a_rotation_period(app, directory_client, add_user, monkeypatch):
+    app.config["DIRECTORY_ROTATION_PERIOD"] = 3600
+    with app.app_context():
+        grow_groups(10, add_user("own123"))
+
+    now = 3600 * 1000
+    # The clock as the directory sees it
+    monkeypatch.setattr(general, "time", SimpleNamespace(time=lambda: now))
+
+    def directory():
+        response = directory_client.get("/")
+        return response.headers["X-Directory-Rotation"], re.findall(r">Group \d+</h5>", response.get_data(as_text=True))
+
+    seed, order = directory()
+    assert seed == "1000"
+    assert len(order) == 10
+
+    now += 3599
+    assert directory() == (seed, order)
+
+    now += 1
+    next_seed, next_order = directory()
+    assert next_seed == "1001"
+    assert sorted(next_order) == sorted(order) and next_order != order
@@ -0,0 +1,47 @@
+import pytest
+
+from lightbluetent.models import Room, User
+from loadtest import SCENARIOS, AliasJoin, OrganiserEdits, run, compare, format_report
+
+
+# Short runs of each scenario, so that they keep working as the app changes.
+@pytest.mark.parametrize("name", SCENARIOS)
+def test_scenarios_run_without_failures(app, seeded, bbb, lookup, name):
+    report = run(app, SCENARIOS[name], bbb, lookup, users=4, iterations=5, spawn_rate=100, wait_time=(0, 0))
+
+    assert report["total"]["requests"] > 0
+    assert {name: stats["failures"] for name, stats in report["requests"].items()} == {
+        name: 0 for name in report["requests"]
+    }
+
+    report.update(scenario=name, commit="test", users=4)
+    assert format_report(report).splitlines()[-1].startswith("Total")
+
+
+def test_attendees_join_through_the_alias(app, seeded, bbb, lookup):
+    report = run(app, AliasJoin, bbb, lookup, users=20, spawn_rate=100)
+
+    assert report["requests"]["POST /[alias]"]["requests"] == 20
+    with app.app_context():
+        room = Room.query.filter_by(alias=AliasJoin.ALIAS).one()
+    name, start_time, participants = bbb.meetings[room.id]
+    assert participants == 20
+
+
+def test_organisers_whitelist_through_lookup(app, seeded, bbb, lookup):
+    run(app, OrganiserEdits, bbb, lookup, users=3, iterations=10, spawn_rate=100, wait_time=(0, 0))
+
+    assert lookup.requests > 0
+    with app.app_context():
+        assert User.query.filter(User.crsid.like("w%")).count() == lookup.requests
+
+
+def test_reports_are_compared_by_request():
+    def report(rps, p50):
+        stats = {"requests": 10, "failures": 0, "rps": rps, "p50": p50, "p90": p50, "p99": p50, "max": p50}
+        return {"requests": {"GET /": stats}, "total": stats}
+
+    changes = compare(report(100, 10), report(50, 20))
+
+    assert ("GET /", "rps", 100, 50, -50.0) in changes
+    assert ("Total", "p50", 10, 20, 100.0) in changes
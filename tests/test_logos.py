@@ -0,0 +1,329 @@
+import io
+import os
+import gc
+import hashlib
+import pytest
+from flask import request, make_response
+from PIL import Image, ImageChops, ImageStat
+
+from lightbluetent.models import db, Group, Asset, User
+from lightbluetent.logos import cache_hashed_images, load_logo, process_pending_logos
+from lightbluetent.utils import resize_image, responsive_image
+
+
+@pytest.fixture
+def logo_dirs(app, tmp_path):
+    app.config.update(
+        IMAGES_DIR=str(tmp_path / "images"),
+        LOGO_STAGING_DIR=str(tmp_path / "staging"),
+        # Processed explicitly, in the test's thread
+        LOGO_WORKERS=0,
+        LOGO_EXTRA_FORMATS=[],
+    )
+    os.makedirs(app.config["IMAGES_DIR"])
+
+
+@pytest.fixture
+def owner(app, client, login, add_user, add_group, logo_dirs):
+    with app.app_context():
+        user = add_user("abc123")
+        group = add_group("chess", "Chess Society")
+        group.owners.append(user)
+        db.session.commit()
+    login("abc123")
+    return "chess"
+
+
+# A 40-megapixel photo, as a phone might take; about 1 MB as a JPEG.
+@pytest.fixture(scope="module")
+def photo_40mp():
+    image = Image.linear_gradient("L").resize((8000, 5000)).convert("RGB")
+    data = io.BytesIO()
+    image.save(data, "JPEG", quality=75)
+    del image
+    gc.collect()
+    return data.getvalue()
+
+
+def upload(client, group_id, data, **fields):
+    return client.post(
+        f"/g/{group_id}/update/group_settings",
+        data={"name": "Chess Society", "logo": (io.BytesIO(data), "logo.jpg"), **fields},
+        content_type="multipart/form-data",
+    )
+
+
+# Resident memory, in bytes, that f adds at its peak; Linux only. Resetting
+# the high-water mark makes it measurable within the test process.
+def peak_rss_delta(f):
+    def status(field):
+        with open("/proc/self/status") as s:
+            line = next(line for line in s if line.startswith(field + ":"))
+        return int(line.split()[1]) * 1024
+
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pytest.skip("Can't reset the peak RSS here")
+
+    before = status("VmRSS")
+    result = f()
+    return status("VmHWM") - before, result
+
+
+def test_large_uploads_go_to_a_temporary_file(app, photo_40mp):
+    data = {"logo": (io.BytesIO(photo_40mp), "logo.jpg")}
+    with app.test_request_context(method="POST", data=data, content_type="multipart/form-data"):
+        stream = request.files["logo"].stream
+        assert not isinstance(stream, io.BytesIO)
+        assert os.fstat(stream.fileno()).st_size == len(photo_40mp)
+
+
+def test_requests_over_the_limits_are_refused(app, client, owner):
+    too_big = b"\xff\xd8\xff" + bytes(app.config["MAX_CONTENT_LENGTH"])
+    assert upload(client, owner, too_big).status_code == 413
+
+    description = "x" * app.config["MAX_FORM_MEMORY_SIZE"]
+    assert upload(client, owner, b"", description=description).status_code == 413
+
+
+def test_logos_with_too_many_pixels_are_refused_from_their_header(app, client, owner, photo_40mp):
+    app.config["MAX_LOGO_PIXELS"] = 10 * 1000 * 1000
+
+    response = upload(client, owner, photo_40mp)
+
+    assert b"too many pixels" in response.data
+    assert not os.path.exists(app.config["LOGO_STAGING_DIR"])
+
+
+def test_40_megapixel_logo_is_processed_in_bounded_memory(app, client, owner, photo_40mp):
+    def upload_and_process():
+        response = upload(client, owner, photo_40mp)
+        with app.app_context():
+            process_pending_logos()
+        return response
+
+    delta, response = peak_rss_delta(upload_and_process)
+
+    assert response.status_code == 302
+    with app.app_context():
+        group = Group.query.get(owner)
+        assert group.logo_pending is None
+        variants = Asset.query.filter_by(key=group.logo).all()
+    sizes = {
+        Image.open(os.path.join(app.config["IMAGES_DIR"], asset.path)).size for asset in variants
+    }
+    assert sizes == {(512, 512), (1024, 1024)}
+
+    # Decoding it in full takes 120 MB as RGB and 160 MB more as RGBA; it's
+    # decoded at a quarter of its size instead, about 30 MB in all
+    print(f"\nPeak RSS added by a 40 MP upload: {delta / 2**20:.1f} MB")
+    assert delta < 64 * 2**20
+
+
+# A 40-megapixel GIF, which decodes to one byte a pixel in palette mode; in
+# colour, as Pillow decodes a grey palette as "L". Its top left corner is
+# transparent.
+@pytest.fixture(scope="module")
+def gif_40mp():
+    gradient = Image.linear_gradient("L").resize((800, 500))
+    channels = (gradient, gradient.transpose(Image.FLIP_LEFT_RIGHT), Image.new("L", gradient.size, 128))
+    image = Image.merge("RGB", channels).convert("P", palette=Image.ADAPTIVE)
+    image = image.resize((8000, 5000), Image.NEAREST)
+    data = io.BytesIO()
+    image.save(data, "GIF", transparency=image.getpixel((0, 0)))
+    del image
+    gc.collect()
+    return data.getvalue()
+
+
+def test_40_megapixel_gif_is_converted_only_once_reduced(app, client, owner, gif_40mp):
+    path = os.path.join(app.config["IMAGES_DIR"], "logo.gif")
+    with open(path, "wb") as f:
+        f.write(gif_40mp)
+
+    with app.app_context():
+        delta, image = peak_rss_delta(lambda: load_logo(path, (1024, 1024)))
+
+    assert image.mode == "RGBA"
+    # Still large enough for the width to be scaled down to 1024
+    assert 1024 <= image.width < 2 * 1024
+    # Transparency survives the subsampling
+    assert image.getpixel((0, 0))[3] == 0
+    assert image.getpixel((image.width - 1, image.height - 1))[3] == 255
+
+    # 40 MB decoded, then 160 MB more if converted to RGBA at full size
+    # (about 350 MB at peak in all); about 80 MB when subsampled first
+    print(f"\nPeak RSS added by a 40 MP GIF: {delta / 2**20:.1f} MB")
+    assert delta < 128 * 2**20
+
+
+def small_logo(colour):
+    data = io.BytesIO()
+    Image.new("RGB", (1600, 1200), colour).save(data, "JPEG")
+    return data.getvalue()
+
+
+# Variants are memoised in the asset cache, so replacing or deleting a logo
+# must drop the old key's entry.
+def test_logo_changes_invalidate_the_cached_variants(app, client, owner):
+    upload(client, owner, small_logo("red"))
+    with app.test_request_context():
+        process_pending_logos()
+        first = Group.query.get(owner).logo
+        assert len(responsive_image.fetch_assets([first])[first]) == 2
+
+    upload(client, owner, small_logo("blue"))
+    with app.test_request_context():
+        process_pending_logos()
+        second = Group.query.get(owner).logo
+        assets = responsive_image.fetch_assets([first, second])
+        assert assets[first] == [] and len(assets[second]) == 2
+
+        Group.query.get(owner).delete_logo()
+        assert responsive_image.fetch_assets([second])[second] == []
+
+
+@pytest.fixture
+def second_group(app, add_group, owner):
+    with app.app_context():
+        group = add_group("go", "Go Society")
+        group.owners.append(User.query.filter_by(crsid="abc123").one())
+        db.session.commit()
+    return "go"
+
+
+def variant_paths(group_id):
+    group = Group.query.get(group_id)
+    return sorted(asset.path for asset in Asset.query.filter_by(key=group.logo))
+
+
+# Variants are stored under the hash of their contents, so identical logos
+# share their files, which are only removed once no group uses them.
+def test_identical_logos_share_files_until_neither_uses_them(app, client, owner, second_group):
+    images_dir = app.config["IMAGES_DIR"]
+    upload(client, owner, small_logo("red"))
+    upload(client, second_group, small_logo("red"), name="Go Society")
+
+    with app.test_request_context():
+        process_pending_logos()
+        assert Group.query.get(owner).logo != Group.query.get(second_group).logo
+        paths = variant_paths(owner)
+        assert len(paths) == 2
+        assert variant_paths(second_group) == paths
+        assert sorted(os.listdir(images_dir)) == paths
+        for path in paths:
+            with open(os.path.join(images_dir, path), "rb") as f:
+                assert path == f"{hashlib.sha256(f.read()).hexdigest()}.png"
+
+        Group.query.get(owner).delete_logo()
+        assert sorted(os.listdir(images_dir)) == paths
+
+        Group.query.get(second_group).delete_logo()
+        assert os.listdir(images_dir) == []
+
+
+def test_extra_formats_are_offered_ahead_of_png(app, client, owner):
+    app.config["LOGO_EXTRA_FORMATS"] = ["AVIF", "WEBP"]
+    Image.init()
+    formats = ["PNG", "WEBP"] + (["AVIF"] if "AVIF" in Image.SAVE else [])
+
+    upload(client, owner, small_logo("red"))
+    with app.test_request_context():
+        process_pending_logos()
+        group = Group.query.get(owner)
+        variants = {}
+        for asset in Asset.query.filter_by(key=group.logo):
+            with Image.open(os.path.join(app.config["IMAGES_DIR"], asset.path)) as image:
+                variants.setdefault(asset.variant, []).append(image.format)
+                assert asset.content_type == f"image/{image.format.lower()}"
+    assert {variant: sorted(found) for variant, found in variants.items()} == {
+        "@1x": sorted(formats), "@2x": sorted(formats),
+    }
+
+    page = client.get(f"/g/{owner}").get_data(as_text=True)
+    picture = page[page.index("<picture"):page.index("</picture>")]
+    # Most preferred first, then the PNG <img>
+    sources = [format for format in ("AVIF", "WEBP") if format in formats]
+    positions = [picture.find(f'<source type="image/{format.lower()}"') for format in sources]
+    assert -1 not in positions and positions == sorted(positions)
+    assert picture.index("<img") > max(positions)
+
+
+def test_sources_list_avif_then_webp_at_each_density(app):
+    assets = [
+        ("@1x", "a.png", "image/png"),
+        ("@2x", "b.png", "image/png"),
+        ("@1x", "a.webp", "image/webp"),
+        ("@2x", "b.webp", "image/webp"),
+        ("@1x", "a.avif", "image/avif"),
+    ]
+    with app.test_request_context():
+        image = responsive_image("logo", assets)
+        assert image.sources_html(raw=True) == (
+            '<source type="image/avif" srcset="/static/images/a.avif 1x">'
+            '<source type="image/webp" srcset="/static/images/a.webp 1x, /static/images/b.webp 2x">'
+        )
+        assert image.img_attr(raw=True) == (
+            'src="/static/images/b.png" srcset="/static/images/a.png 1x, /static/images/b.png 2x"'
+        )
+        assert responsive_image("logo", assets[:2]).sources_html(raw=True) == ""
+
+
+@pytest.mark.parametrize("path, immutable", [
+    (f"/static/images/{'0' * 64}.png", True),
+    (f"/static/images/{'0' * 64}.webp", True),
+    ("/static/images/default_group_logo.png", False),
+    (f"/static/javascripts/{'0' * 64}.png", False),
+    (f"/g/{'0' * 64}.png", False),
+])
+def test_only_hashed_logo_variants_are_cached_for_good(app, path, immutable):
+    with app.test_request_context(path):
+        response = cache_hashed_images(make_response("image"))
+    assert response.cache_control.immutable is immutable
+    assert response.cache_control.public is immutable
+
+
+# A detailed source image, so that differences in resampling would show.
+def detailed_image(size):
+    fractal = Image.effect_mandelbrot(size, (-2.0, -1.0, 1.0, 1.0), 100)
+    gradient = Image.linear_gradient("L").resize(size)
+    return Image.merge("RGB", (fractal, gradient, gradient.transpose(Image.FLIP_LEFT_RIGHT)))
+
+
+@pytest.mark.parametrize("source, options, sizes", [
+    # Placed on a square canvas at each density
+    ((2000, 1000), {}, {1: (512, 512), 2: (1024, 1024)}),
+    # Scaled to fit instead
+    ((2000, 1000), {"fill_canvas": False}, {1: (512, 256), 2: (1024, 512)}),
+    # Too small to fill a 2x canvas without growing
+    ((600, 300), {}, {1: (512, 512)}),
+    ((300, 300), {"fill_canvas": False}, {1: (300, 300)}),
+    ((300, 300), {"fill_canvas": False, "grow": True}, {1: (512, 512), 2: (1024, 1024)}),
+])
+def test_resized_logo_sizes(source, options, sizes):
+    outputs = dict(resize_image(detailed_image(source), (512, 512), **options))
+
+    assert {density: image.size for density, image in outputs.items()} == sizes
+
+
+# Each density is scaled from the one above rather than from the source; the
+# result must still match scaling the source straight to that size.
+@pytest.mark.parametrize("fill_canvas", [(0, 0, 0, 0), False])
+def test_resized_logos_match_a_direct_resize(fill_canvas):
+    source = detailed_image((2400, 1600))
+    outputs = dict(resize_image(source, (512, 512), fill_canvas=fill_canvas, hidpi=[1, 2, 3]))
+
+    for density, image in outputs.items():
+        if fill_canvas is False:
+            expected = source.convert("RGBA").resize(image.size)
+        else:
+            width = 512 * density
+            height = round(width * source.height / source.width)
+            expected = Image.new("RGBA", image.size, fill_canvas)
+            expected.paste(source.convert("RGBA").resize((width, height)), (0, (width - height) // 2))
+
+        difference = ImageChops.difference(image, expected)
+        # Within 1 of 255 per channel, on average over the whole image
+        assert max(ImageStat.Stat(difference).mean) <= 1, density
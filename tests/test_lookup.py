@@ -0,0 +1,67 @@
+import pytest
+
+from lightbluetent.models import db, User
+from lightbluetent.utils import fetch_lookup_data
+
+
+def test_lookups_are_cached(app, lookup):
+    lookup.add_person("abc123", "A. Person")
+
+    with app.app_context():
+        for _ in range(3):
+            assert fetch_lookup_data("abc123") == {"name": "A. Person", "email": "abc123@cam.ac.uk"}
+
+    assert lookup.requests == 1
+
+
+def test_unknown_crsids_are_negatively_cached(app, lookup):
+    with app.app_context():
+        assert fetch_lookup_data("zz999") is None
+        assert fetch_lookup_data("zz999") is None
+
+    assert lookup.requests == 1
+
+
+def test_users_with_a_name_skip_lookup(app, lookup, add_user):
+    with app.app_context():
+        user = add_user("abc123")
+        assert fetch_lookup_data("abc123", user)["name"] == "ABC123"
+
+    assert lookup.requests == 0
+
+
+def test_lookup_does_not_commit(app, lookup, add_user, monkeypatch):
+    lookup.add_person("abc123", "A. Person")
+
+    with app.app_context():
+        user = add_user("abc123")
+        user.full_name = None
+        db.session.commit()
+
+        def commit():
+            raise AssertionError("fetch_lookup_data committed")
+
+        monkeypatch.setattr(db.session, "commit", commit)
+        assert fetch_lookup_data("abc123", user)["name"] == "A. Person"
+
+
+@pytest.mark.parametrize("status", [401, 500])
+def test_failures_are_neither_cached_nor_saved(app, client, bbb, lookup, seeded, add_group, login, status):
+    lookup.status = status
+    with app.app_context():
+        add_group("group", rooms=1)
+
+    assert fetch_in_context(app, "abc123") is None
+    assert fetch_in_context(app, "abc123") is None
+    assert lookup.requests == 2
+
+    # A visitor signing in is registered without a name
+    login("abc123")
+    assert client.get("/r/group-000").status_code == 200
+    with app.app_context():
+        assert User.query.filter_by(crsid="abc123").one().full_name is None
+
+
+def fetch_in_context(app, crsid):
+    with app.app_context():
+        return fetch_lookup_data(crsid)
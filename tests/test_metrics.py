@@ -0,0 +1,66 @@
+import pytest
+
+from lightbluetent.cache import SQLiteBackend, BufferedCounters, TTLCache
+from lightbluetent.metrics import metrics
+
+
+@pytest.fixture
+def shared_metrics(tmp_path, monkeypatch):
+    path = str(tmp_path / "metrics.sqlite3")
+    monkeypatch.setattr(metrics, "counters", BufferedCounters(SQLiteBackend(path), 60))
+    # What other workers, or a scrape after a flush, would see
+    return SQLiteBackend(path)
+
+
+@pytest.fixture
+def shared_cache(app, tmp_path):
+    app.config.update(
+        TEST_CACHE_BACKEND="sqlite",
+        TEST_CACHE_URL=str(tmp_path / "cache.sqlite3"),
+        TEST_CACHE_STATS_FLUSH_INTERVAL=60,
+    )
+    cache = TTLCache("test", "TEST_CACHE")
+    cache.init_app(app)
+    return cache
+
+
+def test_metrics_can_be_scraped_with_the_token(app, client, database):
+    app.config["METRICS_TOKEN"] = "scraper"
+    client.get("/search", query_string={"q": "chess"})
+
+    # Without it, sent to log in with Raven
+    assert client.get("/metrics").status_code == 303
+    response = client.get("/metrics", headers={"Authorization": "Bearer scraper"})
+
+    assert response.status_code == 200
+    assert 'lbt_request_duration_seconds_count{endpoint="general.search"} 1' in response.data.decode()
+
+
+def test_metrics_are_written_in_batches(app, client, database, shared_metrics):
+    for _ in range(3):
+        client.get("/search", query_string={"q": "chess"})
+
+    # Nothing has been written on the request path yet
+    assert shared_metrics.counters(metrics.PREFIX) == {}
+
+    with app.app_context():
+        text = metrics.render()
+
+    assert shared_metrics.counter(
+        'metrics|lbt_request_duration_seconds|endpoint="general.search"|count'
+    ) == 3
+    assert 'lbt_request_duration_seconds_count{endpoint="general.search"} 3' in text
+
+
+def test_cache_stats_are_buffered_but_generations_are_not(shared_cache):
+    shared_cache.get_or_load("key", lambda: "value")
+    shared_cache.get_or_load("key", lambda: "other value")
+    shared_cache.bump("page")
+
+    assert shared_cache.backend.counters("test:stats:") == {}
+    assert shared_cache.backend.counter("test:generation:page") == 1
+
+    stats = shared_cache.stats()
+
+    assert (stats["misses"], stats["hits"], stats["loads"]) == (1, 1, 1)
+    assert shared_cache.backend.counter("test:stats:hits") == 1
@@ -0,0 +1,117 @@
+import pytest
+from datetime import datetime, timedelta
+
+from lightbluetent import poller
+from lightbluetent.api import MeetingStatusService
+from lightbluetent.models import db, MeetingStatus
+from lightbluetent.poller import poll_once, run_poller
+
+
+@pytest.fixture
+def rooms(app, add_group):
+    app.config["MEETING_POLLER_ENABLED"] = True
+    with app.app_context():
+        add_group("chess", rooms=3)
+
+
+def statuses():
+    return {
+        status.room_id: (status.is_running, status.participant_count, status.start_time is not None)
+        for status in MeetingStatus.query.all()
+    }
+
+
+def test_poll_stores_the_state_of_every_room(app, rooms, bbb):
+    with app.app_context():
+        # Left over from an earlier poll, since ended
+        db.session.add(MeetingStatus(room_id="chess-002", is_running=True, participant_count=4))
+        db.session.commit()
+        bbb.start_meeting("chess-000", participants=1)
+
+        assert poll_once()
+        assert statuses() == {
+            "chess-000": (True, 1, True),
+            "chess-001": (False, 0, False),
+            "chess-002": (False, 0, False),
+        }
+
+        bbb.end_meeting("chess-000")
+        bbb.start_meeting("chess-001")
+        assert poll_once()
+        assert statuses() == {
+            "chess-000": (False, 0, False),
+            "chess-001": (True, 0, True),
+            "chess-002": (False, 0, False),
+        }
+
+
+def test_failed_poll_leaves_the_table_alone(app, rooms, bbb):
+    with app.app_context():
+        bbb.start_meeting("chess-000")
+        assert poll_once()
+        before = [(s.room_id, s.is_running, s.polled_at) for s in MeetingStatus.query.all()]
+
+        bbb.end_meeting("chess-000")
+        bbb.error_rate = 1
+        assert not poll_once()
+
+        db.session.expire_all()
+        assert [(s.room_id, s.is_running, s.polled_at) for s in MeetingStatus.query.all()] == before
+
+
+# Stops run_poller after its nth wait, recording the delays.
+class Stop:
+
+    def __init__(self, waits):
+        self.waits = waits
+        self.delays = []
+
+    def is_set(self):
+        return len(self.delays) >= self.waits
+
+    def wait(self, delay):
+        self.delays.append(delay)
+
+
+def test_poller_backs_off_with_jitter_while_bbb_is_down(app, monkeypatch):
+    app.config.update(MEETING_POLLER_INTERVAL=10, MEETING_POLLER_JITTER=0.2, MEETING_POLLER_MAX_BACKOFF=300)
+    # None raises, as a database error would
+    results = [False, False, None, False, False, False, True, False]
+
+    def poll():
+        result = results.pop(0)
+        if result is None:
+            raise RuntimeError("Database went away")
+        return result
+
+    monkeypatch.setattr(poller, "poll_once", poll)
+    stop = Stop(len(results))
+
+    run_poller(app, stop)
+
+    # Doubling from the interval up to the maximum; back to the interval
+    # after a success
+    bases = [20, 40, 80, 160, 300, 300, 10, 20]
+    assert len(stop.delays) == len(bases)
+    for delay, base in zip(stop.delays, bases):
+        assert base <= delay <= base + 10 * 0.2
+    jitters = [delay - base for delay, base in zip(stop.delays, bases)]
+    assert len(set(jitters)) == len(jitters)
+
+
+def test_statuses_are_stale_once_the_last_poll_is_too_old(app, rooms, bbb, client):
+    stale_after = app.config["MEETING_POLLER_STALE_AFTER"]
+
+    with app.app_context():
+        # Never polled
+        assert MeetingStatusService().stale
+
+        assert poll_once()
+        assert not MeetingStatusService().stale
+        assert b"may be out of date" not in client.get("/g/chess").data
+
+        polled_at = datetime.utcnow() - timedelta(seconds=stale_after + 1)
+        MeetingStatus.query.update({"polled_at": polled_at})
+        db.session.commit()
+        assert MeetingStatusService().stale
+        assert b"may be out of date" in client.get("/g/chess").data
@@ -0,0 +1,53 @@
+import pytest
+
+from lightbluetent.cache import SQLiteBackend, BufferedCounters
+from lightbluetent.profiling import query_profiler
+
+
+@pytest.fixture
+def shared_stats(tmp_path, monkeypatch):
+    path = str(tmp_path / "stats.sqlite3")
+    monkeypatch.setattr(query_profiler, "counters", BufferedCounters(SQLiteBackend(path), 60))
+    # What other workers, or the admin panel after a flush, would see
+    return SQLiteBackend(path)
+
+
+def test_server_timing_is_off_by_default(client, database):
+    response = client.get("/search", query_string={"q": "chess"})
+
+    assert response.status_code == 200
+    assert "Server-Timing" not in response.headers
+
+
+def test_server_timing_counts_queries(client, database, monkeypatch):
+    monkeypatch.setattr(query_profiler, "server_timing", True)
+
+    response = client.get("/search", query_string={"q": "chess"})
+
+    timings = response.headers.getlist("Server-Timing")
+    assert timings[0].startswith("db;dur=")
+    assert timings[0].endswith('desc="2 queries"')
+    assert timings[1].startswith("app;dur=")
+
+
+def test_stats_are_written_in_batches(app, client, database, shared_stats):
+    for _ in range(3):
+        client.get("/search", query_string={"q": "chess"})
+
+    # Nothing has been written on the request path yet
+    assert shared_stats.counters("query_profiler:") == {}
+
+    with app.app_context():
+        stats = query_profiler.endpoint_stats()
+
+    assert shared_stats.counter("query_profiler:general.search:requests") == 3
+    assert shared_stats.counter("query_profiler:general.search:queries") == 6
+    assert [(s["endpoint"], s["requests"], s["avg_queries"]) for s in stats] == [("general.search", 3, 2)]
+
+
+def test_stats_are_flushed_once_the_interval_passes(client, database, shared_stats):
+    query_profiler.counters.interval = 0
+
+    client.get("/search", query_string={"q": "chess"})
+
+    assert shared_stats.counter("query_profiler:general.search:requests") == 1
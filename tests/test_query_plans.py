@@ -0,0 +1,108 @@
+import pytest
+from datetime import datetime
+
+from lightbluetent.models import (
+    db,
+    whitelist,
+    user_group,
+    User,
+    Group,
+    Room,
+    Link,
+    Asset,
+    Setting,
+    Session,
+    MeetingStatus,
+)
+
+
+# The lookups views make on every request. Each must be served by an index;
+# with enough rows a sequential scan of any of these tables is what makes
+# pages slow.
+HOT_QUERIES = {
+    "room by alias": lambda: Room.query.filter_by(alias="group050-room-1"),
+    "rooms of group": lambda: Room.query.filter_by(group_id="group050"),
+    "rooms of user": lambda: Room.query.filter_by(user_id=50),
+    "user by crsid": lambda: User.query.filter_by(crsid="usr050"),
+    "links of room": lambda: Link.query.filter_by(room_id="group050-1").order_by(Link.display_order),
+    "links of group": lambda: Link.query.filter_by(group_id="group050").order_by(Link.display_order),
+    "assets by key": lambda: Asset.query.filter_by(key="logo:group050:x"),
+    "setting by name": lambda: Setting.query.filter_by(name="enable_signups"),
+    "sessions of room": lambda: Session.query.filter_by(room_id="group050-1"),
+    "status of room": lambda: MeetingStatus.query.filter_by(room_id="group050-1"),
+    "owners of group": lambda: db.session.query(user_group).filter(user_group.c.group_id == "group050"),
+    "whitelist of user": lambda: db.session.query(whitelist).filter(whitelist.c.user_id == 50),
+    "whitelist of group": lambda: db.session.query(whitelist).filter(whitelist.c.group_id == "group050"),
+    "whitelist of room": lambda: db.session.query(whitelist).filter(whitelist.c.room_id == "group050-1"),
+}
+
+
+@pytest.fixture
+def populated(app, seeded, add_user):
+    with app.app_context():
+        users = [add_user(f"usr{i:03d}") for i in range(100)]
+        for i in range(100):
+            group_id = f"group{i:03d}"
+            group = Group(id=group_id, name=f"Group {i}", logo=f"logo:{group_id}:x")
+            group.owners.append(users[i])
+            group.whitelisted_users.append(users[(i + 1) % 100])
+            for j in range(3):
+                room = Room(
+                    id=f"{group_id}-{j}",
+                    name=f"Room {j}",
+                    alias=f"{group_id}-room-{j}",
+                    attendee_pw=f"{group_id}-{j}-a",
+                    moderator_pw=f"{group_id}-{j}-m",
+                )
+                room.whitelisted_users.append(users[(i + j) % 100])
+                room.links.append(Link(name="Website", url="https://example.com", display_order=0))
+                group.rooms.append(room)
+                db.session.add(MeetingStatus(room_id=room.id))
+                db.session.add(Session(room_id=room.id, start=datetime(2026, 1, 1, 12), end=datetime(2026, 1, 1, 13)))
+            group.links.append(Link(name="Website", url="https://example.com", display_order=0))
+            db.session.add(Asset(key=group.logo, variant="@1x", content_type="image/png", path=f"{group_id}.png"))
+            db.session.add(group)
+        for user in users:
+            db.session.add(Room(
+                id=f"{user.crsid}-0",
+                name="Personal room",
+                user=user,
+                attendee_pw=f"{user.crsid}-a",
+                moderator_pw=f"{user.crsid}-m",
+            ))
+        db.session.commit()
+        # Give the planner statistics, as a live database would have
+        db.session.execute("ANALYZE")
+        db.session.commit()
+
+
+# The steps of the query plan that read whole tables.
+def full_scans(query):
+    sql = str(query.statement.compile(db.engine, compile_kwargs={"literal_binds": True}))
+
+    if db.engine.dialect.name == "postgresql":
+        # Rule out plans that only scan because the tables are small
+        db.session.execute("SET LOCAL enable_seqscan = off")
+        plan = [row[0] for row in db.session.execute("EXPLAIN " + sql)]
+        return [step for step in plan if "Seq Scan" in step]
+
+    # SQLite: "SCAN <table>" reads every row, unless it's using an index
+    plan = [row[-1] for row in db.session.execute("EXPLAIN QUERY PLAN " + sql)]
+    return [
+        step for step in plan
+        if (step.startswith("SCAN") and " INDEX" not in step) or "TEMP B-TREE" in step
+    ]
+
+
+def test_hot_queries_use_an_index(app, populated):
+    scans = {}
+
+    with app.app_context():
+        for name, query in HOT_QUERIES.items():
+            query = query()
+            assert query.all(), f"{name} matched nothing, so its plan proves little"
+            if full_scans(query):
+                scans[name] = full_scans(query)
+            db.session.rollback()
+
+    assert scans == {}
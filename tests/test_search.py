@@ -0,0 +1,69 @@
+from lightbluetent.models import db, Group, Room
+
+
+def setup_groups(app, add_group, add_user):
+    with app.app_context():
+        add_group("chess", name="Chess Society", description="Board games every Tuesday", rooms=1)
+        add_group("choir", name="Chapel Choir", description="Evensong and concerts")
+        add_group("rowing", name="Boat Club", description="Rowing on the Cam", rooms=2)
+        user = add_user("abc123")
+        # Personal rooms aren't listed publicly
+        db.session.add(Room(
+            id="abc123-000", name="Chess practice", user=user, attendee_pw="a", moderator_pw="m"
+        ))
+        db.session.commit()
+
+
+def search(client, q):
+    response = client.get("/search", query_string={"q": q})
+    assert response.status_code == 200
+    results = response.get_json()
+    return [g["name"] for g in results["groups"]], [r["name"] for r in results["rooms"]]
+
+
+def test_search_matches_word_prefixes(app, client, add_group, add_user):
+    setup_groups(app, add_group, add_user)
+
+    assert search(client, "che") == (["Chess Society"], ["Chess Society room 0"])
+    assert search(client, "chess soc") == (["Chess Society"], ["Chess Society room 0"])
+    assert search(client, "Chapel") == (["Chapel Choir"], [])
+    assert search(client, "nothing") == ([], [])
+    assert search(client, "  ") == ([], [])
+
+
+def test_search_covers_descriptions(app, client, add_group, add_user):
+    setup_groups(app, add_group, add_user)
+
+    assert search(client, "rowing")[0] == ["Boat Club"]
+    assert search(client, "evensong")[0] == ["Chapel Choir"]
+
+
+def test_search_vector_follows_edits(app, client, add_group, add_user):
+    setup_groups(app, add_group, add_user)
+
+    with app.app_context():
+        group = Group.query.get("choir")
+        group.name = "Madrigal Singers"
+        db.session.commit()
+
+    assert search(client, "madrigal")[0] == ["Madrigal Singers"]
+    assert search(client, "chapel")[0] == []
+
+
+def test_search_ranks_name_matches_first(app, add_group, add_user):
+    setup_groups(app, add_group, add_user)
+
+    with app.app_context():
+        add_group("games", name="Games Night", description="Cards, not chess")
+        assert [group.id for group in Group.search("chess")] == ["chess", "games"]
+
+
+def test_search_wildcards_match_only_themselves(app, client, add_group, add_user):
+    setup_groups(app, add_group, add_user)
+
+    with app.app_context():
+        add_group("snake", name="snake_case Society")
+
+    # "_" is a word character, so is searched for rather than matching any
+    assert search(client, "e_c")[0] == ["snake_case Society"]
+    assert search(client, "s_c")[0] == []
@@ -0,0 +1,61 @@
+import pytest
+
+from lightbluetent.cache import SQLiteBackend
+from lightbluetent.models import db, Setting, settings_cache, settings_registry
+from test_directory import count_queries
+
+
+# Settings shared between workers through a SQLite file, as in production.
+@pytest.fixture
+def shared_settings(app, seeded, tmp_path):
+    app.config.update(SETTINGS_CACHE_BACKEND="sqlite", SETTINGS_CACHE_URL=str(tmp_path / "settings.sqlite3"))
+    settings_cache.init_app(app)
+    settings_registry.init_app(app)
+    return app.config["SETTINGS_CACHE_URL"]
+
+
+# Loads the settings as a new request would; returns the number of queries
+# made and the settings.
+def load_settings(app):
+    with app.app_context():
+        queries, settings = count_queries(settings_registry.all)
+    return len(queries), settings
+
+
+def test_settings_are_loaded_once_until_one_changes(app, shared_settings):
+    assert load_settings(app)[0] == 1
+    # Not even a query to check for changes
+    assert load_settings(app)[0] == 0
+
+    with app.app_context():
+        Setting.query.filter_by(name="enable_signups").one().enabled = False
+        db.session.commit()
+
+    queries, settings = load_settings(app)
+    assert queries == 1
+    assert settings["enable_signups"].enabled is False
+
+
+def test_changes_made_by_other_workers_are_picked_up(app, shared_settings):
+    load_settings(app)
+
+    # Another worker changes the row...
+    with app.app_context():
+        db.session.execute(
+            Setting.__table__.update().where(Setting.name == "enable_signups").values(enabled=False)
+        )
+        db.session.commit()
+    assert load_settings(app)[1]["enable_signups"].enabled is True
+
+    # ...and its commit bumps the shared generation
+    SQLiteBackend(shared_settings).incr("settings:generation:settings")
+    assert load_settings(app)[1]["enable_signups"].enabled is False
+
+
+def test_admin_setting_toggles_take_effect(app, client, shared_settings):
+    load_settings(app)
+
+    response = client.post("/admin/update/toggle_setting", json={"name": "enable_signups", "enabled": False})
+
+    assert response.status_code == 200
+    assert load_settings(app)[1]["enable_signups"].enabled is False
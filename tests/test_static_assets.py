@@ -0,0 +1,145 @@
+import gzip
+import json
+import os
+import re
+from functools import partial
+
+import pytest
+from flask import Flask, url_for
+
+from lightbluetent import app as app_module
+from lightbluetent.app import create_app
+from lightbluetent.config import TestingConfig
+from lightbluetent.static_assets import static_assets
+
+CSS = b"body { margin: 0; }\n" + b".card { padding: 1rem; }\n" * 200
+
+
+# A static folder of its own, so nothing is collected into the real one.
+@pytest.fixture
+def static_folder(tmp_path):
+    folder = tmp_path / "static"
+    files = {
+        "css/app.css": CSS,
+        # Too small for a compressed copy to be any smaller
+        "javascripts/tiny.js": b"x",
+        "images/default_group_logo.png": b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 4,
+        # Uploaded logos aren't collected
+        "images/logo.png": b"\x89PNG\r\n\x1a\n",
+    }
+    for name, data in files.items():
+        (folder / name).parent.mkdir(parents=True, exist_ok=True)
+        (folder / name).write_bytes(data)
+    return folder
+
+
+# Creates an app serving static_folder, with the given settings in place
+# before create_app reads them.
+@pytest.fixture
+def make_app(monkeypatch, static_folder):
+    monkeypatch.setattr(app_module, "Flask", partial(Flask, static_folder=str(static_folder)))
+
+    def make_app(**config):
+        for name, value in config.items():
+            monkeypatch.setattr(TestingConfig, name, value)
+        return create_app("testing")
+
+    return make_app
+
+
+def collect_static(app):
+    result = app.test_cli_runner().invoke(args=["collect-static"])
+    assert result.exit_code == 0, result.output
+    with open(os.path.join(app.static_folder, "dist", "manifest.json")) as f:
+        return result.output, json.load(f)
+
+
+@pytest.fixture
+def manifest_app(make_app):
+    collect_static(make_app())
+    return make_app(USE_STATIC_MANIFEST=True)
+
+
+def get(app, path, **headers):
+    return app.test_client().get(path, base_url="https://localhost", headers=headers)
+
+
+def test_collect_static_fingerprints_and_precompresses(make_app, static_folder):
+    output, manifest = collect_static(make_app())
+
+    assert output == "Collected 3 static file(s)\n"
+    assert sorted(manifest) == ["css/app.css", "images/default_group_logo.png", "javascripts/tiny.js"]
+    assert re.fullmatch(r"dist/css/app\.[0-9a-f]{12}\.css", manifest["css/app.css"])
+
+    for source, hashed in manifest.items():
+        assert (static_folder / hashed).read_bytes() == (static_folder / source).read_bytes()
+
+    css = static_folder / manifest["css/app.css"]
+    assert gzip.decompress((static_folder / f"{css}.gz").read_bytes()) == CSS
+    try:
+        import brotli
+    except ImportError:
+        assert not os.path.exists(f"{css}.br")
+    else:
+        assert brotli.decompress((static_folder / f"{css}.br").read_bytes()) == CSS
+    # Images are already compressed, and tiny files don't shrink
+    for name in ("images/default_group_logo.png", "javascripts/tiny.js"):
+        assert not os.path.exists(static_folder / f"{manifest[name]}.gz")
+
+    # The copies in dist aren't collected again
+    assert collect_static(make_app()) == (output, manifest)
+
+
+def test_urls_resolve_through_the_manifest(manifest_app):
+    with manifest_app.test_request_context():
+        assert url_for("static", filename="css/app.css") == (
+            "/static/" + static_assets.manifest["css/app.css"]
+        )
+        assert url_for("static", filename="images/logo.png") == "/static/images/logo.png"
+
+
+def test_urls_are_left_alone_without_the_manifest(make_app):
+    app = make_app()
+    collect_static(app)
+
+    with app.test_request_context():
+        assert url_for("static", filename="css/app.css") == "/static/css/app.css"
+
+
+@pytest.mark.parametrize("accept_encoding, encoding", [
+    ("br, gzip", "br"),
+    ("gzip", "gzip"),
+    ("gzip;q=0", None),
+    ("", None),
+])
+def test_hashed_files_are_sent_in_the_best_encoding_accepted(manifest_app, accept_encoding, encoding):
+    if encoding == "br":
+        pytest.importorskip("brotli")
+    with manifest_app.test_request_context():
+        url = url_for("static", filename="css/app.css")
+
+    response = get(manifest_app, url, **{"Accept-Encoding": accept_encoding})
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/css"
+    assert response.headers.get("Content-Encoding") == encoding
+    assert "Accept-Encoding" in response.vary
+    if encoding == "gzip":
+        assert gzip.decompress(response.data) == CSS
+    elif encoding is None:
+        assert response.data == CSS
+
+
+def test_only_hashed_files_are_cached_for_good(manifest_app):
+    with manifest_app.test_request_context():
+        hashed = url_for("static", filename="css/app.css")
+        plain = url_for("static", filename="images/logo.png")
+
+    response = get(manifest_app, hashed)
+    assert response.cache_control.immutable
+    assert response.cache_control.public
+    assert response.cache_control.max_age == 365 * 24 * 60 * 60
+
+    response = get(manifest_app, plain)
+    assert response.status_code == 200
+    assert not response.cache_control.immutable